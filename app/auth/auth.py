@@ -1,15 +1,14 @@
 from fastapi import APIRouter, HTTPException, Depends, status
 from fastapi.security import OAuth2PasswordRequestForm, OAuth2PasswordBearer
-from passlib.context import CryptContext
 from jose import jwt, JWTError
 from datetime import timedelta, datetime
-from ..config import supabase   
+from ..config import async_supabase
 from ..routes.dependencies import get_current_user
 from ..models import UserCreate, UserOut
 from ..routes.dependencies import SECRET_KEY, ALGORITHM
+from ..services.password_service import hash_password, verify_and_update
 
 router = APIRouter(prefix="/auth", tags=["Auth"])
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
 
 def create_access_token(data: dict, expires_delta: timedelta = timedelta(hours=24)):
@@ -19,28 +18,28 @@ def create_access_token(data: dict, expires_delta: timedelta = timedelta(hours=2
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 @router.post("/register", response_model=UserOut)
-def register(user: UserCreate):
+async def register(user: UserCreate):
     # Cek apakah username sudah ada (tidak case-sensitive)
     # PERBAIKAN: Ganti .eq() dengan .ilike()
-    existing_query = supabase.table("users").select("id", count='exact').ilike("nama_pengguna", user.nama_pengguna).execute()
+    existing_query = await async_supabase.table("users").select("id", count='exact').ilike("nama_pengguna", user.nama_pengguna).execute()
     
     # Cek count untuk performa yang lebih baik
     if existing_query.count > 0:
         raise HTTPException(status_code=400, detail="Username sudah terdaftar")
         
-    hashed_password = pwd_context.hash(user.password)
+    hashed_password = await hash_password(user.password)
     user_data = user.dict()
     user_data["password"] = hashed_password
-    result = supabase.table("users").insert(user_data).execute().data
+    result = (await async_supabase.table("users").insert(user_data).execute()).data
     if not result:
         raise HTTPException(status_code=500, detail="Gagal mendaftarkan pengguna")
         
     return UserOut(**result[0])
 
 @router.post("/login")
-def login(form_data: OAuth2PasswordRequestForm = Depends()):
+async def login(form_data: OAuth2PasswordRequestForm = Depends()):
     # Cari user di Supabase
-    user_query = supabase.table("users").select("*").eq("nama_pengguna", form_data.username).execute()
+    user_query = await async_supabase.table("users").select("id, nama_pengguna, nomor_telepon, role, password").eq("nama_pengguna", form_data.username).execute()
     if not user_query.data:
         raise HTTPException(status_code=400, detail="Username tidak ditemukan")
     
@@ -50,9 +49,14 @@ def login(form_data: OAuth2PasswordRequestForm = Depends()):
     # HAPUS BARIS INI KARENA MENYEBABKAN KeyError: 0
     # user = user[0] 
 
-    if not pwd_context.verify(form_data.password, user["password"]):
+    is_valid, new_hash = await verify_and_update(form_data.password, user["password"])
+    if not is_valid:
         raise HTTPException(status_code=400, detail="Password salah")
 
+    if new_hash:
+        # Hash lama memakai parameter usang (cost berbeda), simpan hash baru
+        await async_supabase.table("users").update({"password": new_hash}).eq("id", user["id"]).execute()
+
     # Buat token dengan data yang lengkap
     token_data = {
         "sub": user["nama_pengguna"],
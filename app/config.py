@@ -1,5 +1,6 @@
 import os
-from supabase import create_client, Client, ClientOptions
+import httpx
+from supabase import create_client, Client, ClientOptions, AsyncClient, AsyncClientOptions
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -13,3 +14,25 @@ client_options = ClientOptions(
 
 supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY, options=client_options)
 
+# Client async untuk handler `async def`, supaya query ke PostgREST tidak
+# memblokir event loop (termasuk koneksi WebSocket) selama menunggu respons.
+# Satu httpx.AsyncClient dipakai bersama agar koneksi keep-alive di-pool.
+SUPABASE_POOL_SIZE: int = int(os.getenv("SUPABASE_POOL_SIZE", "20"))
+
+_async_http_client = httpx.AsyncClient(
+    timeout=60,
+    limits=httpx.Limits(
+        max_connections=SUPABASE_POOL_SIZE,
+        max_keepalive_connections=SUPABASE_POOL_SIZE,
+    ),
+)
+async_client_options = AsyncClientOptions(
+    postgrest_client_timeout=60,
+    httpx_client=_async_http_client,
+)
+
+async_supabase: AsyncClient = AsyncClient(SUPABASE_URL, SUPABASE_KEY, options=async_client_options)
+
+async def close_async_supabase():
+    """Menutup pool koneksi client async saat aplikasi shutdown."""
+    await _async_http_client.aclose()
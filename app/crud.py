@@ -1,25 +1,79 @@
-from .config import supabase
+from .config import async_supabase
 from .models import *
-from supabase import Client
-from typing import List, Dict, Any
+from supabase import AsyncClient
+from typing import List, Dict, Any, Optional, Tuple
 import base64
 import math
 
 # Generic helper
+# Semua helper di sini async dan memakai `async_supabase`, sehingga aman
+# dipanggil dari handler `async def` tanpa memblokir event loop.
+
+def select_columns(columns: Optional[List[str]] = None) -> str:
+    """Mengubah daftar kolom (hasil `?fields=`) menjadi argumen `select()`; None = semua kolom."""
+    return ",".join(columns) if columns else "*"
 
 # CRUD operations for users
-def fetch(table: str, filters: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+async def fetch(table: str, filters: Dict[str, Any] = None, columns: Optional[List[str]] = None) -> List[Dict[str, Any]]:
     try:
-        query = supabase.table(table).select("*")  # eksplisit
+        query = async_supabase.table(table).select(select_columns(columns))  # eksplisit
         if filters:
             for k, v in filters.items():
                 query = query.eq(k, v)
-        result = query.execute()
+        result = await query.execute()
         return result.data or []
     except Exception as e:
         print(f"Error saat fetch: {e}")
         return []
     
+# Pagination (keyset / cursor) berdasarkan kolom id.
+# Cursor adalah id baris terakhir di halaman sebelumnya, sehingga hasilnya tetap
+# stabil walaupun ada baris baru yang masuk di antara dua request.
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+def paginate_query(query, limit: int, after: Optional[int] = None, descending: bool = False):
+    """Menambahkan filter cursor, urutan id, dan limit (+1 untuk mendeteksi halaman berikutnya)."""
+    if after is not None:
+        query = query.lt("id", after) if descending else query.gt("id", after)
+    return query.order("id", desc=descending).limit(limit + 1)
+
+def split_page(rows: List[Dict[str, Any]], limit: int) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+    """Memotong hasil `paginate_query` menjadi (baris, next_cursor)."""
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, rows[-1]["id"]
+    return rows, None
+
+async def fetch_page(
+    table: str,
+    filters: Dict[str, Any] = None,
+    limit: int = DEFAULT_PAGE_SIZE,
+    after: Optional[int] = None,
+    descending: bool = False,
+    columns: Optional[List[str]] = None,
+) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+    """Seperti `fetch`, tetapi dibatasi satu halaman. Mengembalikan (baris, next_cursor)."""
+    try:
+        query = async_supabase.table(table).select(select_columns(columns))
+        if filters:
+            for k, v in filters.items():
+                query = query.eq(k, v)
+        result = await paginate_query(query, limit, after, descending).execute()
+        return split_page(result.data or [], limit)
+    except Exception as e:
+        print(f"Error saat fetch page {table}: {e}")
+        return [], None
+
+def latest_change_xid(*row_lists: Optional[List[Dict[str, Any]]]) -> Optional[int]:
+    """
+    change_xid terbesar dari baris hasil insert/update (lihat migrasi inbox_change_feed).
+    Dikirim di event WebSocket sebagai `cursor`: client yang cursor-nya sudah lebih
+    besar tidak perlu mengambil delta lagi.
+    """
+    xids = [row["change_xid"] for rows in row_lists for row in rows or [] if row.get("change_xid") is not None]
+    return max(xids, default=None)
+
 def hitung_harga_jual(harga_awal: int, biaya_tetap: int, fee_persen: float, ppn_persen: float) -> int:
     """Menghitung harga jual akhir dengan memperhitungkan biaya tetap, fee transaksi, dan PPN atas fee."""
     fee_decimal = fee_persen / 100
@@ -37,37 +91,54 @@ def hitung_harga_jual(harga_awal: int, biaya_tetap: int, fee_persen: float, ppn_
     # Bulatkan ke atas (ceiling) untuk memastikan tidak ada kerugian
     return math.ceil(harga_jual_kotor)
 
-def insert(user: UserCreate) -> UserOut:
+async def insert(user: UserCreate) -> UserOut:
     try:
-        data = supabase.table("users").insert(user.dict()).execute()
+        data = await async_supabase.table("users").insert(user.dict()).execute()
         return UserOut(**data.data[0])
     except Exception as e:
         print("Insert error:", e)
         return None
 
 
-def update(table: str, id: int, payload: Dict[str, Any]) -> Dict[str, Any]:
-    result = supabase.table(table).update(payload).eq('id', id).execute()
+async def fetch_user_credentials(nama_pengguna: str, nomor_telepon: str) -> Optional[Dict[str, Any]]:
+    """
+    Mengambil satu user untuk proses login berdasarkan nama_pengguna + nomor_telepon.
+    Hanya kolom yang dibutuhkan yang diambil (memakai index users_nama_pengguna_nomor_telepon_idx).
+    """
+    try:
+        result = await async_supabase.table("users")\
+            .select("id, nama_pengguna, nomor_telepon, role, password")\
+            .eq("nama_pengguna", nama_pengguna)\
+            .eq("nomor_telepon", nomor_telepon)\
+            .limit(1)\
+            .execute()
+        return result.data[0] if result.data else None
+    except Exception as e:
+        print(f"Error saat fetch kredensial user: {e}")
+        return None
+
+async def update(table: str, id: int, payload: Dict[str, Any]) -> Dict[str, Any]:
+    result = await async_supabase.table(table).update(payload).eq('id', id).execute()
     data = result.data
     return data[0] if isinstance(data, list) and data else None
 
 
-def delete(table: str, id: int) -> Dict[str, Any]:
-    result = supabase.table(table).delete().eq('id', id).execute()
+async def delete(table: str, id: int) -> Dict[str, Any]:
+    result = await async_supabase.table(table).delete().eq('id', id).execute()
     data = result.data
     return data[0] if isinstance(data, list) and data else None
 
 
 # CRUD operations for products
 
-def fetch_products(filters: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+async def fetch_products(filters: Optional[Dict[str, Any]] = None, columns: Optional[List[str]] = None) -> List[Dict[str, Any]]:
     try:
-        query = supabase.table("products").select("*")
+        query = async_supabase.table("products").select(select_columns(columns))
         if filters:
             for k, v in filters.items():
                 query = query.eq(k, v)
         
-        result = query.execute()
+        result = await query.execute()
         
         # Check if data exists
         if not result.data:
@@ -80,15 +151,30 @@ def fetch_products(filters: Optional[Dict[str, Any]] = None) -> List[Dict[str, A
     except Exception as e:
         print(f"Error fetching products: {e}")
         return []
+
+async def fetch_products_by_ids(
+    ids: List[int], is_active: Optional[bool] = None, columns: Optional[List[str]] = None
+) -> List[Dict[str, Any]]:
+    """
+    Mengambil banyak produk sekaligus dalam satu query `in_()`, bukan satu query per ID.
+    Error tidak ditelan: dipakai loader cache katalog, yang tidak boleh menyimpan hasil gagal.
+    """
+    if not ids:
+        return []
+    query = async_supabase.table("products").select(select_columns(columns)).in_("id", sorted(set(ids)))
+    if is_active is not None:
+        query = query.eq("is_active", is_active)
+    result = await query.order("id").execute()
+    return result.data or []
     
-def insert_product(product: ProductCreate, user_id: int) -> ProductOut:
+async def insert_product(product: ProductCreate, user_id: int) -> ProductOut:
     try:
         # Pydantic's .model_dump() is a good practice for modern versions
         product_dict = product.model_dump()
         
-        # We're no longer decoding here. The client sends the Base64 string directly
-        # The Supabase 'BYTEA' column will store this Base64 representation.
-        data = supabase.table("products").insert(product_dict).execute()
+        # Gambar sudah disimpan oleh route (app/services/image_store.py);
+        # kolom 'gambar' hanya berisi nama file hasil store_image.
+        data = await async_supabase.table("products").insert(product_dict).execute()
         
         if not data.data:
             raise Exception("Failed to insert product. Supabase returned no data.")
@@ -96,7 +182,7 @@ def insert_product(product: ProductCreate, user_id: int) -> ProductOut:
         product_data = data.data[0]
         product_id = product_data['id']
         
-        supabase.table("product_users").insert({'user_id': user_id, 'product_id': product_id}).execute()
+        await async_supabase.table("product_users").insert({'user_id': user_id, 'product_id': product_id}).execute()
         
         return ProductOut(**product_data)
     except Exception as e:
@@ -104,9 +190,9 @@ def insert_product(product: ProductCreate, user_id: int) -> ProductOut:
         raise e
 
 # Fungsi untuk memeriksa kepemilikan produk
-def is_product_owner(user_id: int, product_id: int) -> bool:
+async def is_product_owner(user_id: int, product_id: int) -> bool:
     try:
-        result = supabase.table("product_users").select("*").eq('user_id', user_id).eq('product_id', product_id).execute()
+        result = await async_supabase.table("product_users").select("*").eq('user_id', user_id).eq('product_id', product_id).execute()
         return len(result.data) > 0
     except Exception as e:
         print(f"Error checking product ownership: {e}")
@@ -114,47 +200,47 @@ def is_product_owner(user_id: int, product_id: int) -> bool:
 
 
 # CRUD operations for categories
-def fetch_categories(filters: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+async def fetch_categories(filters: Dict[str, Any] = None) -> List[Dict[str, Any]]:
     try:
-        query = supabase.table("categories").select("*")
+        query = async_supabase.table("categories").select("*")
         if filters:
             for k, v in filters.items():
                 query = query.eq(k, v)
-        result = query.execute()
+        result = await query.execute()
         return result.data or []
     except Exception as e:
         print(f"Error saat fetch categories: {e}")
         return []
     
-def insert_category(category: CategoryCreate) -> CategoryOut:
+async def insert_category(category: CategoryCreate) -> CategoryOut:
     try:
-        data = supabase.table("categories").insert(category.dict()).execute()
+        data = await async_supabase.table("categories").insert(category.dict()).execute()
         return CategoryOut(**data.data[0])
     except Exception as e:
         print("Insert category error:", e)
         return None
 
 # CRUD operations for carts
-def fetch_carts(filters: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+async def fetch_carts(filters: Dict[str, Any] = None) -> List[Dict[str, Any]]:
     try:
-        query = supabase.table("cart_items").select("*")
+        query = async_supabase.table("cart_items").select("*")
         if filters:
             for k, v in filters.items():
                 query = query.eq(k, v)
-        result = query.execute()
+        result = await query.execute()
         return result.data or []
     except Exception as e:
         print(f"Error saat fetch carts: {e}")
         return []
     
 # CRUD operations for orders
-def fetch_orders(filters: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+async def fetch_orders(filters: Dict[str, Any] = None, columns: Optional[List[str]] = None) -> List[Dict[str, Any]]:
     try:
-        query = supabase.table("orders").select("*")
+        query = async_supabase.table("orders").select(select_columns(columns))
         if filters:
             for k, v in filters.items():
                 query = query.eq(k, v)
-        result = query.execute()
+        result = await query.execute()
         return result.data or []
     except Exception as e:
         print(f"Error saat fetch orders: {e}")
@@ -1,7 +1,18 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Depends, HTTPException, status
 from fastapi.middleware.cors import CORSMiddleware
-from .routes import users, products, categories, carts, orders, payments, product_users, fcm, websockets
+from .routes import users, products, categories, carts, orders, payments, product_users, fcm, websockets, images
 from .auth import auth  # import routers lain di sini
+from .config import close_async_supabase
+from .services.password_service import shutdown_password_pool
+from .services.notification_service import get_notification_stats
+from .services.outbox import outbox
+from .services.catalogue_cache import get_catalogue_cache_stats
+from .services.versioning import ConditionalGetMiddleware, versions
+from .services.idempotency import IdempotencyMiddleware, get_idempotency_stats
+from .services.payment_gateway import snap_client, close_payment_gateway
+from .routes.websockets import manager as ws_manager
+from .routes.dependencies import get_current_user
+from .models import UserOut
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -9,12 +20,19 @@ load_dotenv()
 app = FastAPI(title="E-Kantin API")
 
 
+# ETag + 304 untuk endpoint yang sering di-poll (lihat services/versioning.py)
+app.add_middleware(ConditionalGetMiddleware)
+# Idempotency-Key untuk pembuatan order dan transaksi Midtrans (lihat services/idempotency.py)
+app.add_middleware(IdempotencyMiddleware)
+# CORS didaftarkan terakhir agar menjadi middleware terluar: respons 304 dan
+# respons idempotency yang diputar ulang juga mendapat header Access-Control-*
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # atau ganti dengan domain frontend kamu
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Change-Cursor", "ETag", "Idempotency-Replayed"],
 )
 
 # include routers
@@ -28,9 +46,41 @@ app.include_router(payments.router)
 app.include_router(product_users.router)
 app.include_router(fcm.router)
 app.include_router(websockets.router)
+app.include_router(images.router)
 # ...
 
+@app.on_event("startup")
+async def startup_event():
+    await ws_manager.start()
+    await outbox.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await outbox.stop()
+    await ws_manager.stop()
+    await close_async_supabase()
+    await close_payment_gateway()
+    shutdown_password_pool()
+
 # health check
 @app.get("/health")
 async def health_check():
-    return {"status": "ok"}
\ No newline at end of file
+    return {"status": "ok"}
+
+@app.get("/metrics")
+async def get_metrics(current_user: UserOut = Depends(get_current_user)):
+    """
+    Statistik internal untuk memantau antrian dan latensi background worker.
+    Hanya untuk staff: berisi jumlah dead-letter, kondisi Midtrans, dan jumlah staff online.
+    """
+    if current_user.role != "staff":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Hanya staff yang dapat melihat metrics.")
+    return {
+        "notifications": get_notification_stats(),
+        "outbox": await outbox.stats(),
+        "websockets": ws_manager.stats(),
+        "catalogue_cache": get_catalogue_cache_stats(),
+        "versioning": versions.stats(),
+        "idempotency": get_idempotency_stats(),
+        "payment_gateway": snap_client.stats(),
+    }
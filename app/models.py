@@ -1,5 +1,5 @@
-from pydantic import BaseModel, Field
-from typing import Optional, List
+from pydantic import BaseModel, Field, create_model
+from typing import Optional, List, Type
 from datetime import datetime
 
 
@@ -77,6 +77,8 @@ class ProductCreate(BaseModel):
 
 class ProductOut(Product):
     id: int
+    # URL thumbnail WebP; `gambar` berisi URL gambar asli
+    gambar_thumbnail: Optional[str] = None
 
 # CartItems (Pivot)
 class CartItem(BaseModel):
@@ -123,6 +125,15 @@ class Order(BaseModel):
     class Config:
         orm_mode = True
 
+class StaffInboxOrder(Order):
+    # Hanya diisi jika ?include_items=true: item milik staff yang login
+    items: Optional[List[OrderItem]] = None
+
+class InboxTombstone(BaseModel):
+    table: str  # "orders" atau "order_items"
+    id: int
+    order_id: int
+
 class OrderCreate(BaseModel):
     catatan: Optional[str] = None
     payment_method: str
@@ -153,4 +164,24 @@ class Payment(BaseModel):
     signature_key: Optional[str]
 
 class FcmTokenCreate(BaseModel):
-    token: str
\ No newline at end of file
+    token: str
+
+
+# Model parsial untuk respons `?fields=`: semua field opsional, dan route memakai
+# `response_model_exclude_unset=True` sehingga hanya kolom yang diminta yang dikirim.
+def partial_model(model: Type[BaseModel]) -> Type[BaseModel]:
+    fields = {name: (Optional[field.annotation], None) for name, field in model.model_fields.items()}
+    return create_model(f"{model.__name__}Partial", **fields)
+
+ProductOutPartial = partial_model(ProductOut)
+OrderPartial = partial_model(Order)
+StaffInboxOrderPartial = partial_model(StaffInboxOrder)
+
+# Delta inbox staff (GET /orders/staff/inbox?since=...)
+class StaffInboxChanges(BaseModel):
+    cursor: int
+    # True jika perubahan terlalu banyak: client perlu memuat ulang inbox penuh
+    reset: bool = False
+    orders: List[OrderPartial] = []
+    items: List[OrderItem] = []
+    deleted: List[InboxTombstone] = []
@@ -8,9 +8,9 @@ from ..config import supabase
 router = APIRouter(prefix="/carts", tags=["Carts"])
 
 @router.get("/", response_model=List[CartItemOut])
-def get_cart_items(current_user=Depends(get_current_user)):
+async def get_cart_items(current_user=Depends(get_current_user)):
     """Ambil semua item keranjang milik user yang login."""
-    return [CartItemOut(**item) for item in fetch_carts({"user_id": current_user.id})]
+    return [CartItemOut(**item) for item in await fetch_carts({"user_id": current_user.id})]
 
 @router.post("/", response_model=CartItemOut)
 def add_cart_item(item: CartItemCreate, current_user=Depends(get_current_user)):
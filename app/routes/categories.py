@@ -1,43 +1,48 @@
 from fastapi import APIRouter, HTTPException, status
 from typing import List
 from ..models import Category, CategoryCreate, CategoryOut
-from ..crud import fetch_categories, insert_category, update, delete
+from ..crud import insert_category, update, delete
+from ..services.catalogue_cache import get_categories as get_cached_categories
+from .websockets import invalidate_catalogue_everywhere
 
 router = APIRouter(prefix="/categories", tags=["Categories"])
 
 @router.get("/", response_model=List[CategoryOut])
-def get_categories():
-    """Mendapatkan daftar semua kategori."""
-    return fetch_categories()
+async def get_categories():
+    """Mendapatkan daftar semua kategori (dari cache katalog)."""
+    return await get_cached_categories()
 
 @router.get("/{kategori_id}", response_model=CategoryOut)
-def get_category_detail(kategori_id: int):
+async def get_category_detail(kategori_id: int):
     """Mendapatkan detail satu kategori."""
-    res = fetch_categories({"id": kategori_id})
+    res = next((c for c in await get_cached_categories() if c["id"] == kategori_id), None)
     if not res:
         raise HTTPException(status_code=404, detail="Kategori tidak ditemukan")
-    return res[0]
+    return res
 
 @router.post("/", response_model=CategoryOut)
-def create_category(kategori: CategoryCreate):
+async def create_category(kategori: CategoryCreate):
     """Membuat kategori baru."""
-    res = insert_category(kategori)
+    res = await insert_category(kategori)
     if not res:
         raise HTTPException(status_code=500, detail="Database error")
+    await invalidate_catalogue_everywhere()
     return res
 
 @router.put("/{kategori_id}", response_model=CategoryOut)
-def update_category(kategori_id: int, kategori: CategoryCreate):
+async def update_category(kategori_id: int, kategori: CategoryCreate):
     """Memperbarui kategori."""
-    res = update('categories', kategori_id, kategori.dict(exclude_unset=True))
+    res = await update('categories', kategori_id, kategori.dict(exclude_unset=True))
     if not res:
         raise HTTPException(status_code=404, detail="Kategori tidak ditemukan")
+    await invalidate_catalogue_everywhere()
     return res
 
 @router.delete("/{kategori_id}")
-def remove_category(kategori_id: int):
+async def remove_category(kategori_id: int):
     """Menghapus kategori."""
-    res = delete('categories', kategori_id)
+    res = await delete('categories', kategori_id)
     if not res:
         raise HTTPException(status_code=404, detail="Kategori tidak ditemukan")
+    await invalidate_catalogue_everywhere()
     return {"message": f"Kategori dengan ID {kategori_id} berhasil dihapus."}
\ No newline at end of file
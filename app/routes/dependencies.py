@@ -1,9 +1,11 @@
 import os
-from fastapi import Depends, HTTPException, status, Query
+from fastapi import Depends, HTTPException, status, Query, Response
 from fastapi.security import OAuth2PasswordBearer
-from typing import Optional
+from typing import Optional, Dict, Any, List, Type
 from jose import JWTError, jwt
+from pydantic import BaseModel
 from ..models import UserOut
+from ..crud import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
 # Anda tidak perlu mengimpor `supabase` di sini jika hanya untuk validasi token
 
 # ✅ PERBAIKAN 1: Muat kunci rahasia dari environment variable
@@ -68,4 +70,54 @@ def get_user_from_ws_token(token: Optional[str] = Query(None)) -> UserOut:
             detail="Token tidak ditemukan"
         )
     # Gunakan kembali logika validasi yang sudah ada
-    return verify_token(token)
\ No newline at end of file
+    return verify_token(token)
+
+# --- PAGINATION UNTUK ENDPOINT LIST ---
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+def get_pagination(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Jumlah maksimal item per halaman"),
+    after: Optional[int] = Query(None, description="Cursor dari header X-Next-Cursor halaman sebelumnya"),
+) -> Dict[str, Any]:
+    """
+    Dependency untuk keyset pagination. Cursor halaman berikutnya dikirim lewat
+    header `X-Next-Cursor` (kosong jika sudah halaman terakhir), sehingga body
+    respons tetap berupa list seperti sebelumnya.
+    """
+    return {"limit": limit, "after": after}
+
+def set_next_cursor(response: Response, next_cursor: Optional[int]):
+    if next_cursor is not None:
+        response.headers[NEXT_CURSOR_HEADER] = str(next_cursor)
+
+# --- SPARSE FIELDSET (?fields=) ---
+def field_selector(model: Type[BaseModel], derived: Optional[Dict[str, str]] = None):
+    """
+    Membuat dependency `?fields=a,b,c` yang divalidasi terhadap field `model`.
+    Hasilnya daftar kolom untuk `select()` (None = semua kolom). Kolom `id` selalu
+    ikut karena dipakai sebagai cursor pagination. `derived` memetakan field yang
+    dihitung di server (mis. gambar_thumbnail) ke kolom sumbernya.
+    """
+    derived = derived or {}
+    allowed = set(model.model_fields)
+
+    def get_fields(
+        fields: Optional[str] = Query(None, description="Daftar field dipisah koma, mis. id,nama_produk,harga"),
+    ) -> Optional[List[str]]:
+        if not fields:
+            return None
+        requested = [f.strip() for f in fields.split(",") if f.strip()]
+        unknown = sorted(set(requested) - allowed)
+        if unknown:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Field tidak dikenal: {', '.join(unknown)}"
+            )
+        columns = ["id"]
+        for field in requested:
+            column = derived.get(field, field)
+            if column not in columns:
+                columns.append(column)
+        return columns
+
+    return get_fields
@@ -0,0 +1,35 @@
+import os
+from fastapi import APIRouter, HTTPException, Request, Response
+from fastapi.responses import FileResponse
+from ..services.image_store import IMAGE_URL_PREFIX, image_path, is_servable_image
+from ..services.versioning import etag_matches
+
+router = APIRouter(prefix=f"/{IMAGE_URL_PREFIX}", tags=["Images"])
+
+# Nama file = hash isi, jadi isi file di URL yang sama tidak pernah berubah
+# dan browser/CDN boleh menyimpannya selamanya tanpa revalidasi.
+IMAGE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+@router.api_route("/{filename}", methods=["GET", "HEAD"])
+async def get_product_image(filename: str, request: Request):
+    """
+    Menyajikan gambar produk dan thumbnail-nya. ETag diambil dari hash isi file,
+    sehingga client yang sudah punya gambarnya cukup mendapat 304. Header Range
+    (dan If-Range) ditangani oleh FileResponse.
+    """
+    if not is_servable_image(filename):
+        raise HTTPException(status_code=404, detail="Gambar tidak ditemukan.")
+
+    headers = {
+        "ETag": f'"{filename.rsplit(".", 1)[0]}"',
+        "Cache-Control": IMAGE_CACHE_CONTROL,
+    }
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag_matches(if_none_match, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+
+    path = image_path(filename)
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="Gambar tidak ditemukan.")
+    return FileResponse(path, headers=headers)
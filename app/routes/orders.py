@@ -1,16 +1,19 @@
-from fastapi import APIRouter, Depends, HTTPException, status, WebSocket, Query
-from typing import List, Dict, Any, Optional
-from ..models import Order, OrderItem, Order as OrderModel, UserOut, ProductSalesSummary, OrderCreate, OrderStatus
-from ..crud import fetch_orders, is_product_owner, hitung_harga_jual
-from .dependencies import get_current_user
-from ..config import supabase
+from fastapi import APIRouter, Depends, HTTPException, status, WebSocket, Query, Header, Request, Response
+from typing import List, Dict, Any, Optional, Union
+from ..models import Order, OrderItem, Order as OrderModel, OrderPartial, StaffInboxOrderPartial, StaffInboxChanges, UserOut, ProductSalesSummary, OrderCreate, OrderStatus
+from ..crud import fetch_page, fetch_orders, paginate_query, split_page, is_product_owner, latest_change_xid
+from .dependencies import get_current_user, get_pagination, set_next_cursor, field_selector
+from ..config import async_supabase
 from datetime import datetime
 from pydantic import BaseModel
-from .websockets import manager
+from .websockets import queue_broadcast
+from ..services.versioning import check_not_modified
+from ..services.payment_gateway import get_order_snap_link, queue_snap_warmup, EmptyOrderError, PaymentGatewayError
+from ..services.order_state import (
+    ORDER_STATUSES, CUSTOMER_TARGETS, can_transition, transition_order, derive_fulfilment_status,
+    get_item_status_counts, get_order_status as get_current_order_status,
+)
 import json
-import os
-import midtransclient
-import uuid
 # ✅ Import hanya untuk notifikasi pesanan siap (bukan pesanan baru)
 from ..services.notification_service import send_order_ready_notification, send_custom_notification, send_order_confirmed_notification
 
@@ -20,20 +23,81 @@ class SalesSummary(BaseModel):
 
 router = APIRouter(prefix="/orders", tags=["Orders"])
 
-@router.get("/", response_model=List[Order])
-async def get_orders(current_user=Depends(get_current_user)):
-    """Ambil semua order milik user yang login."""
-    orders = fetch_orders({"user_id": current_user.id})
+order_fields = field_selector(Order)
+
+# Cursor delta inbox staff; kirim kembali sebagai `?since=` untuk mengambil perubahan saja
+CHANGE_CURSOR_HEADER = "X-Change-Cursor"
+
+
+async def apply_order_transition(
+    order_id: int,
+    target: str,
+    action: str,
+    expected: Optional[List[str]] = None,
+    extra: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    """
+    Transisi status order lewat services/order_state.py (satu UPDATE bersyarat).
+    Jika gagal, status saat ini dibaca hanya untuk pesan error.
+    """
+    order = await transition_order(order_id, target, expected=expected, extra=extra)
+    if order is None:
+        current = await get_current_order_status(order_id)
+        if current is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Pesanan tidak ditemukan")
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Pesanan tidak dapat {action} karena statusnya adalah '{current}'"
+        )
+    return order
+
+
+@router.get("/", response_model=List[OrderPartial], response_model_exclude_unset=True)
+async def get_orders(
+    request: Request,
+    response: Response,
+    page: dict = Depends(get_pagination),
+    fields: Optional[List[str]] = Depends(order_fields),
+    current_user=Depends(get_current_user),
+):
+    """
+    Ambil order milik user yang login, terbaru lebih dulu (dipaginasi dengan `limit`/`after`).
+    Gunakan `?fields=id,status,total_harga` untuk mengambil kolom tertentu saja.
+    Mendukung If-None-Match: respons 304 jika daftar order belum berubah.
+    """
+    not_modified = check_not_modified(request, "orders", f"user:{current_user.id}?{request.url.query}")
+    if not_modified:
+        return not_modified
+
+    orders, next_cursor = await fetch_page("orders", {"user_id": current_user.id}, **page, descending=True, columns=fields)
+    set_next_cursor(response, next_cursor)
     return orders
 
-@router.get("/staff/inbox", response_model=List[Order])
+@router.get(
+    "/staff/inbox",
+    response_model=Union[List[StaffInboxOrderPartial], StaffInboxChanges],
+    response_model_exclude_unset=True,
+)
 async def fetch_staff_order_inbox(
+    response: Response,
     order_status: str = Query(None, alias="status", description="Filter by order status"),
     include_items: bool = False,
+    since: Optional[int] = Query(None, description="Cursor dari header X-Change-Cursor / event WebSocket"),
+    page: dict = Depends(get_pagination),
+    fields: Optional[List[str]] = Depends(order_fields),
     current_user: UserOut = Depends(get_current_user)
 ):
     """
-    Mengambil semua pesanan yang produknya dimiliki oleh Staff yang login.
+    Mengambil pesanan yang produknya dimiliki oleh Staff yang login,
+    terbaru lebih dulu (dipaginasi dengan `limit`/`after`).
+    Dengan `include_items=true`, setiap order menyertakan `items` milik staff ini.
+    Semua join dilakukan oleh fungsi SQL `get_staff_inbox` dalam satu panggilan
+    (lihat supabase/migrations/20261017000200_staff_inbox.sql).
+
+    Header `X-Change-Cursor` berisi cursor untuk delta berikutnya. Dengan `?since=<cursor>`,
+    yang dikembalikan hanya order, item, dan tombstone (`deleted`) yang berubah sejak
+    cursor tersebut, beserta cursor baru (`status`, `after`, `limit` diabaikan).
+    Jika `reset` bernilai true, muat ulang inbox penuh.
     """
     if current_user.role != "staff":
         raise HTTPException(
@@ -42,62 +106,28 @@ async def fetch_staff_order_inbox(
         )
 
     try:
-        # Re-implement the logic of the broken RPC function
-        # 1. Get product_ids for the staff
-        staff_products_response = supabase.table("product_users").select("product_id").eq("user_id", current_user.id).execute()
-        staff_product_ids = [p['product_id'] for p in staff_products_response.data]
-
-        if not staff_product_ids:
-            return []
-
-        # 2. Get unique order_ids containing these products
-        order_items_response = supabase.table("order_items").select("order_id").in_("product_id", staff_product_ids).execute()
-        order_ids = list(set(item['order_id'] for item in order_items_response.data))
-
-        if not order_ids:
-            return []
-
-        # 3. Get the orders, with optional status filtering
-        orders_query = supabase.table("orders").select("*").in_("id", order_ids)
-        if order_status:
-            orders_query = orders_query.eq("status", order_status)
-        
-        inbox_orders_query = orders_query.execute()
-
-        if not inbox_orders_query.data:
-            return []
-
-        orders_list = inbox_orders_query.data
-
-        # Include items if requested
-        if include_items:
-            order_ids = [order['id'] for order in orders_list]
-            
-            staff_products = supabase.table("product_users")\
-                .select("product_id")\
-                .eq("user_id", current_user.id)\
-                .execute()
-            
-            staff_product_ids = [p['product_id'] for p in staff_products.data]
-            
-            if staff_product_ids:
-                items = supabase.table("order_items")\
-                    .select("*")\
-                    .in_("order_id", order_ids)\
-                    .in_("product_id", staff_product_ids)\
-                    .execute()
-                
-                items_by_order = {}
-                for item in items.data:
-                    order_id = item['order_id']
-                    if order_id not in items_by_order:
-                        items_by_order[order_id] = []
-                    items_by_order[order_id].append(item)
-                
-                for order in orders_list:
-                    order['items'] = items_by_order.get(order['id'], [])
-
-        return [Order(**order) for order in orders_list]
+        if since is not None:
+            changes = (await async_supabase.rpc("get_staff_inbox_changes", {
+                "p_staff_id": current_user.id,
+                "p_since": since,
+                "p_fields": fields,
+            }).execute()).data
+            response.headers[CHANGE_CURSOR_HEADER] = str(changes["cursor"])
+            return changes
+
+        inbox = (await async_supabase.rpc("get_staff_inbox", {
+            "p_staff_id": current_user.id,
+            "p_status": order_status,
+            "p_after": page["after"],
+            "p_limit": page["limit"] + 1,
+            "p_include_items": include_items,
+            "p_fields": fields,
+        }).execute()).data
+
+        orders_list, next_cursor = split_page(inbox["orders"], page["limit"])
+        set_next_cursor(response, next_cursor)
+        response.headers[CHANGE_CURSOR_HEADER] = str(inbox["cursor"])
+        return orders_list
 
     except Exception as e:
         print(f"Error fetching staff inbox: {str(e)}")
@@ -115,15 +145,13 @@ async def update_order_status(order_id: int, status_update: dict, current_user:
     if not new_status:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Status baru harus disediakan.")
 
-    updated_order = supabase.table("orders").update({"status": new_status}).eq("id", order_id).execute()
-
-    if not updated_order.data:
-        raise HTTPException(status_code=404, detail="Order tidak ditemukan atau gagal diupdate.")
+    if new_status not in ORDER_STATUSES:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Status '{new_status}' tidak dikenal.")
 
-    return updated_order.data[0]
+    return await apply_order_transition(order_id, new_status, action=f"diubah menjadi '{new_status}'")
 
 @router.get("/staff/sales-summary", response_model=List[SalesSummary])
-def get_staff_sales_summary(current_user: UserOut = Depends(get_current_user)):
+async def get_staff_sales_summary(current_user: UserOut = Depends(get_current_user)):
     """
     Mengambil rekap penjualan harian untuk staff yang login.
     Hanya menghitung dari pesanan yang berstatus 'completed'.
@@ -134,14 +162,14 @@ def get_staff_sales_summary(current_user: UserOut = Depends(get_current_user)):
             detail="Akses ditolak. Hanya untuk staff."
         )
     
-    sales_data = supabase.rpc(
+    sales_data = await async_supabase.rpc(
         "get_staff_daily_sales", {"p_staff_id": current_user.id}
     ).execute()
 
     return sales_data.data or []
 
 @router.get("/staff/product-summary", response_model=List[ProductSalesSummary], tags=["Staff Actions"])
-def get_staff_product_summary(current_user: UserOut = Depends(get_current_user)):
+async def get_staff_product_summary(current_user: UserOut = Depends(get_current_user)):
     """
     Mengambil rekap penjualan per produk untuk staff yang login.
     Hanya menghitung dari pesanan yang berstatus 'completed'.
@@ -152,7 +180,7 @@ def get_staff_product_summary(current_user: UserOut = Depends(get_current_user))
             detail="Akses ditolak. Hanya untuk staff."
         )
     
-    summary_data = supabase.rpc(
+    summary_data = await async_supabase.rpc(
         "get_staff_product_summary", {"p_staff_id": current_user.id}
     ).execute()
 
@@ -161,92 +189,64 @@ def get_staff_product_summary(current_user: UserOut = Depends(get_current_user))
 @router.get("/{order_id}", response_model=Order)
 async def get_order_by_id(order_id: int, current_user=Depends(get_current_user)):
     """Ambil detail order milik user yang login."""
-    order = supabase.table("orders").select("*").eq("id", order_id).single().execute().data
+    order = (await async_supabase.table("orders").select("*").eq("id", order_id).single().execute()).data
     if not order or order["user_id"] != current_user.id:
         raise HTTPException(status_code=404, detail="Order tidak ditemukan atau bukan milik Anda")
     return order
 
 @router.post("/", response_model=Order)
-async def create_order(order_details: OrderCreate, current_user: UserOut = Depends(get_current_user)):
+async def create_order(
+    order_details: OrderCreate,
+    idempotency_key: Optional[str] = Header(
+        None, alias="Idempotency-Key", max_length=255,
+        description="Kunci unik per checkout; request ulang dengan kunci yang sama mengembalikan order yang sama",
+    ),
+    current_user: UserOut = Depends(get_current_user),
+):
     """
     Membuat order baru dari semua item di keranjang user dengan metode pembayaran.
     Status awal order: 'awaiting_confirmation'
     Status awal setiap item: 'awaiting_confirmation'
+    Seluruh checkout (order, item, pengosongan keranjang, daftar staff) dilakukan oleh
+    RPC `create_order_from_cart` dalam satu transaksi dan satu round trip.
     """
-    cart_items_resp = supabase.table("cart_items").select("*, products(*)").eq("user_id", current_user.id).execute()
-    cart_items = cart_items_resp.data
-    
-    if not cart_items:
-        raise HTTPException(status_code=400, detail="Keranjang belanja kosong")
-    
-    total_harga = sum(item['products']['harga'] * item['jumlah'] for item in cart_items)
-    
-    status_order = "awaiting_confirmation"
-    current_time_str = datetime.now().isoformat()
-    
     order_data = {
         "user_id": current_user.id,
-        "status": status_order,
-        "total_harga": total_harga,
-        "tanggal_pesanan": current_time_str,
+        "status": "awaiting_confirmation",
+        "tanggal_pesanan": datetime.now().isoformat(),
         "catatan": order_details.catatan,
         "payment_method": order_details.payment_method,
     }
-    
-    order_insert_resp = supabase.table("orders").insert(order_data).execute()
-    
-    if not order_insert_resp.data:
-        raise HTTPException(status_code=500, detail="Gagal membuat pesanan")
-    
-    order = order_insert_resp.data[0]
-    new_order_id = order['id']
-    
-    # Create order items with status 'awaiting_confirmation'
-    order_items_to_create = [
-        {
-            "order_id": new_order_id,
-            "product_id": item['product_id'],
-            "jumlah": item['jumlah'],
-            "harga_unit": item['products']['harga'],
-            "subtotal": item['products']['harga'] * item['jumlah'],
-            "status": "awaiting_confirmation",  # ✅ Tambahkan status
-        }
-        for item in cart_items
-    ]
+    result = (await async_supabase.rpc("create_order_from_cart", {
+        "p_order": order_data,
+        "p_idempotency_key": idempotency_key,
+    }).execute()).data
 
-    supabase.table("order_items").insert(order_items_to_create).execute()
-    supabase.table("cart_items").delete().eq("user_id", current_user.id).execute()
+    order = result["order"] if result else None
+    if not order:
+        raise HTTPException(status_code=400, detail="Keranjang belanja kosong")
 
-    product_ids_in_order = [item['product_id'] for item in cart_items]
+    new_order_id = order['id']
+    staff_ids = result["staff_ids"]
 
-    if product_ids_in_order:
-        # 2. Cari semua staff (user_id) yang memiliki produk-produk tersebut
-        staff_query = supabase.table("product_users")\
-            .select("user_id")\
-            .in_("product_id", product_ids_in_order)\
-            .execute()
+    # Request ulang dengan Idempotency-Key yang sama: order sudah ada dan staff sudah diberi tahu
+    if result["created"] and staff_ids:
+        notification_payload = json.dumps({
+            "type": "new_order",
+            "order_id": new_order_id,
+            "message": f"Pesanan baru #{new_order_id} telah masuk!",
+            # Cursor inbox: cukup ambil delta `?since=` jika cursor client lebih kecil
+            "cursor": latest_change_xid([order], result["items"]),
+        })
+        
+        print(f"\n--- 🖥️  BACKEND: MEMPROSES NOTIFIKASI PESANAN BARU ---")
+        print(f"Pesanan Dibuat: #{new_order_id}")
+        print(f"Staff yang relevan ditemukan: {staff_ids}")
 
-        if staff_query.data:
-            # 3. Dapatkan daftar ID staff yang unik (menghindari duplikat notif)
-            staff_ids = list(set(staff['user_id'] for staff in staff_query.data))
-            
-            # 4. Siapkan payload notifikasi
-            notification_payload = json.dumps({
-                "type": "new_order",
-                "order_id": new_order_id,
-                "message": f"Pesanan baru #{new_order_id} telah masuk!"
-            })
-            
-            print(f"\n--- 🖥️  BACKEND: MEMPROSES NOTIFIKASI PESANAN BARU ---")
-            print(f"Pesanan Dibuat: #{new_order_id}")
-            print(f"Staff yang relevan ditemukan: {staff_ids}")
-
-            # 5. Kirim notifikasi ke setiap staff yang relevan
-            for staff_id in staff_ids:
-                print(f">>> Mengirim payload ke staff ID #{staff_id}...")
-                await manager.broadcast_to_user(staff_id, notification_payload)
-            
-            print(f"--- ✅ BACKEND: Selesai mengirim notifikasi ---\n")
+        # Antrekan notifikasi ke setiap staff yang relevan (dikirim oleh worker outbox)
+        await queue_broadcast(staff_ids, notification_payload)
+        
+        print(f"--- ✅ BACKEND: Notifikasi masuk antrean ---\n")
    
     return Order(**order)
 
@@ -266,7 +266,7 @@ async def check_staff_confirmation_status(
         )
 
     # Get order
-    order_query = supabase.table("orders").select("*").eq("id", order_id).single().execute()
+    order_query = await async_supabase.table("orders").select("*").eq("id", order_id).single().execute()
     if not order_query.data:
         return {
             "has_confirmed": False,
@@ -275,7 +275,7 @@ async def check_staff_confirmation_status(
         }
 
     # Get ALL order items for this order
-    all_items_query = supabase.table("order_items")\
+    all_items_query = await async_supabase.table("order_items")\
         .select("product_id, status")\
         .eq("order_id", order_id)\
         .execute()
@@ -293,7 +293,7 @@ async def check_staff_confirmation_status(
     product_ids = list(set(item['product_id'] for item in all_items))
     
     # Get staff for each product
-    product_staff_query = supabase.table("product_users")\
+    product_staff_query = await async_supabase.table("product_users")\
         .select("product_id, user_id")\
         .in_("product_id", product_ids)\
         .execute()
@@ -348,7 +348,7 @@ async def confirm_order(
 ):
     """
     Staff confirms or rejects an order.
-    - action="accept": Changes status to "awaiting_payment" and auto-generates Snap URL for QRIS
+    - action="accept": Changes status to "awaiting_payment" (Snap URL for QRIS is created by generate-snap)
     - action="reject": Changes status to "cancelled"
     """
     if current_user.role != "staff":
@@ -366,37 +366,14 @@ async def confirm_order(
             detail='Action harus "accept" atau "reject"'
         )
 
-    # Get order data
-    order_query = supabase.table("orders").select("*").eq("id", order_id).single().execute()
-    
-    if not order_query.data:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND, 
-            detail="Pesanan tidak ditemukan"
-        )
-
-    order = order_query.data
-    
-    if order['status'] != 'awaiting_confirmation':
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Pesanan tidak dapat dikonfirmasi karena statusnya adalah '{order['status']}'"
-        )
-
     # If reject, just update status and send notification
     if action == "reject":
-        updated_order = supabase.table("orders").update({
-            "status": "cancelled"
-        }).eq("id", order_id).execute()
-
-        if not updated_order.data:
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Gagal memperbarui status pesanan"
-            )
+        order = await apply_order_transition(
+            order_id, "cancelled", action="dikonfirmasi", expected=["awaiting_confirmation"]
+        )
 
         customer_id = order['user_id']
-        send_custom_notification(
+        await send_custom_notification(
             user_id=customer_id,
             title="Pesanan Dibatalkan ❌",
             body=f"Maaf, pesanan #{order_id} tidak dapat diproses dan telah dibatalkan.",
@@ -406,154 +383,26 @@ async def confirm_order(
             }
         )
 
-        return updated_order.data[0]
-
-    # If accept, update status and generate Snap URL for QRIS
-    update_data = {"status": "awaiting_payment"}
-    snap_redirect_url = None
+        return order
 
-    # Check if payment method is QRIS
-    payment_method = order.get('payment_method', '').lower()
-    
-    if payment_method == 'qris':
-        try:
-            # Step 1: Fetch order items
-            order_items_query = supabase.table("order_items")\
-                .select("product_id, jumlah, harga_unit")\
-                .eq("order_id", order_id)\
-                .execute()
-            
-            if not order_items_query.data:
-                print(f"⚠️ No order items found for order {order_id}")
-                raise Exception("Tidak ada item dalam pesanan ini")
-            
-            order_items = order_items_query.data
-            
-            # Step 2: Fetch product details for each item
-            product_ids = [item['product_id'] for item in order_items]
-            products_query = supabase.table("products")\
-                .select("id, nama_produk, harga")\
-                .in_("id", product_ids)\
-                .execute()
-            
-            if not products_query.data:
-                print(f"⚠️ No products found for order items")
-                raise Exception("Produk tidak ditemukan")
-            
-            # Create a map of product_id to product data
-            products_map = {p['id']: p for p in products_query.data}
-
-            # Calculate prices
-            fee_qris = 0.7
-            biaya_tetap = 500
-            ppn_persen = 11
-
-            item_details = []
-            subtotal_harga_awal = 0
-            
-            for item in order_items:
-                product_id = item['product_id']
-                product = products_map.get(product_id)
-                
-                if not product:
-                    print(f"⚠️ Product {product_id} not found in products_map")
-                    continue
-                
-                # Use harga_unit from order_item (harga saat order dibuat)
-                harga_awal = int(item['harga_unit'])
-                jumlah = int(item['jumlah'])
-                
-                item_details.append({
-                    "id": str(product_id),
-                    "price": harga_awal,
-                    "quantity": jumlah,
-                    "name": product['nama_produk']
-                })
-                subtotal_harga_awal += harga_awal * jumlah
-
-            if not item_details:
-                raise Exception("Tidak ada item valid untuk diproses")
-
-            # Calculate final price with service fees
-            harga_jual_akhir = hitung_harga_jual(subtotal_harga_awal, biaya_tetap, fee_qris, ppn_persen)
-            biaya_layanan = harga_jual_akhir - subtotal_harga_awal
-            
-            if biaya_layanan > 0:
-                item_details.append({
-                    "id": "SERVICE_FEE",
-                    "price": biaya_layanan,
-                    "quantity": 1,
-                    "name": "Biaya Layanan & Pajak"
-                })
-
-            # Create unique Midtrans order ID
-            unique_midtrans_order_id = f"{order_id}-{uuid.uuid4().hex[:6]}"
-
-            # Get customer data
-            customer_query = supabase.table("users")\
-                .select("nama_pengguna, nomor_telepon")\
-                .eq("id", order['user_id'])\
-                .single()\
-                .execute()
-            
-            customer = customer_query.data if customer_query.data else {}
-
-            # Initialize Midtrans Snap
-            snap = midtransclient.Snap(
-                is_production=False,
-                server_key=os.getenv("MIDTRANS_SERVER_KEY")
-            )
-
-            # Prepare transaction parameters
-            param = {
-                "transaction_details": {
-                    "order_id": unique_midtrans_order_id,
-                    "gross_amount": harga_jual_akhir
-                },
-                "item_details": item_details,
-                "enabled_payments": ["gopay"],
-                "customer_details": {
-                    "first_name": customer.get('nama_pengguna', 'Customer'),
-                    "phone": customer.get('nomor_telepon', '')
-                }
-            }
-
-            # Create Snap transaction
-            transaction = snap.create_transaction(param)
-            snap_redirect_url = transaction.get('redirect_url')
-
-            if snap_redirect_url:
-                update_data["snap_redirect_url"] = snap_redirect_url
-                update_data["total_harga"] = harga_jual_akhir
-
-            print(f"✅ Snap URL generated for order {order_id}: {snap_redirect_url}")
-
-        except Exception as e:
-            print(f"❌ Error generating Snap URL for order {order_id}: {str(e)}")
-            import traceback
-            traceback.print_exc()
-            # Continue with order confirmation even if Snap URL generation fails
-            # Staff can generate it manually later if needed
-
-    # Update order with new status (and Snap URL if QRIS)
-    updated_order = supabase.table("orders").update(update_data).eq("id", order_id).execute()
-
-    if not updated_order.data:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Gagal memperbarui status pesanan"
-        )
+    # If accept, update status. Link Snap untuk QRIS dibuat saat customer membuka
+    # generate-snap (atau di background jika SNAP_PREWARM aktif), bukan di sini.
+    order = await apply_order_transition(
+        order_id, "awaiting_payment", action="dikonfirmasi", expected=["awaiting_confirmation"]
+    )
+    payment_method = (order.get('payment_method') or '').lower()
 
     # Send notification to customer
     customer_id = order['user_id']
     
-    if payment_method == 'qris' and snap_redirect_url:
-        send_order_confirmed_notification(
+    if payment_method == 'qris':
+        await queue_snap_warmup(order_id)
+        await send_order_confirmed_notification(
             user_id=customer_id,
             order_id=order_id
         )
     elif payment_method == 'cash':
-        send_custom_notification(
+        await send_custom_notification(
             user_id=customer_id,
             title="Pesanan Dikonfirmasi ✅",
             body=f"Pesanan #{order_id} telah dikonfirmasi. Silakan selesaikan pembayaran tunai.",
@@ -563,8 +412,8 @@ async def confirm_order(
             }
         )
     else:
-        # QRIS but failed to generate Snap URL
-        send_custom_notification(
+        # Metode pembayaran tidak dikenal
+        await send_custom_notification(
             user_id=customer_id,
             title="Pesanan Dikonfirmasi ✅",
             body=f"Pesanan #{order_id} telah dikonfirmasi. Mohon hubungi staff untuk pembayaran.",
@@ -574,7 +423,7 @@ async def confirm_order(
             }
         )
 
-    return updated_order.data[0]
+    return order
 
 # Tambahkan endpoint baru untuk konfirmasi per-item oleh staff
 
@@ -602,7 +451,7 @@ async def confirm_order_items(
             detail='Action harus "accept" atau "reject"'
         )
 
-    order_query = supabase.table("orders").select("*").eq("id", order_id).single().execute()
+    order_query = await async_supabase.table("orders").select("*").eq("id", order_id).single().execute()
     if not order_query.data:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Pesanan tidak ditemukan")
     order = order_query.data
@@ -613,12 +462,12 @@ async def confirm_order_items(
             detail=f"Pesanan tidak dapat dikonfirmasi karena statusnya adalah '{order['status']}'"
         )
 
-    staff_products_query = supabase.table("product_users").select("product_id").eq("user_id", current_user.id).execute()
+    staff_products_query = await async_supabase.table("product_users").select("product_id").eq("user_id", current_user.id).execute()
     staff_product_ids = [p['product_id'] for p in staff_products_query.data]
     if not staff_product_ids:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Anda tidak memiliki produk dalam pesanan ini")
 
-    staff_items_query = supabase.table("order_items").select("id, status").eq("order_id", order_id).in_("product_id", staff_product_ids).execute()
+    staff_items_query = await async_supabase.table("order_items").select("id, status").eq("order_id", order_id).in_("product_id", staff_product_ids).execute()
     staff_items = staff_items_query.data
     if not staff_items:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Tidak ada item Anda dalam pesanan ini")
@@ -631,22 +480,22 @@ async def confirm_order_items(
     # 1. Update status untuk semua item milik staff ini
     new_item_status = "confirmed" if action == "accept" else "rejected"
     staff_item_ids = [item['id'] for item in staff_items]
-    updated_items = supabase.table("order_items").update({"status": new_item_status}).in_("id", staff_item_ids).execute()
+    # Hanya item yang masih menunggu; request ganda dari staff yang sama tidak mengubah apa pun
+    updated_items = await async_supabase.table("order_items").update({"status": new_item_status}).in_("id", staff_item_ids).eq("status", "awaiting_confirmation").execute()
     if not updated_items.data:
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Gagal memperbarui status item")
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Anda sudah mengkonfirmasi item Anda untuk pesanan ini")
 
-    # 2. Ambil status SEMUA item untuk order ini setelah di-update
-    all_items_query = supabase.table("order_items").select("status").eq("order_id", order_id).execute()
-    all_items_statuses = [item['status'] for item in all_items_query.data]
+    # 2. Ambil jumlah item per status untuk order ini setelah di-update (satu baris order)
+    item_counts = await get_item_status_counts(order_id) or {}
 
     # 3. Cek apakah masih ada item yang menunggu konfirmasi dari staff lain
-    if 'awaiting_confirmation' in all_items_statuses:
+    if item_counts.get('awaiting_confirmation'):
         # Kirim notifikasi progres ke customer
-        confirmed_count = all_items_statuses.count('confirmed')
-        rejected_count = all_items_statuses.count('rejected')
-        total_items = len(all_items_statuses)
+        confirmed_count = item_counts.get('confirmed', 0)
+        rejected_count = item_counts.get('rejected', 0)
+        total_items = sum(item_counts.values())
         
-        send_custom_notification(
+        await send_custom_notification(
             user_id=order['user_id'],
             title="Update Konfirmasi Pesanan ⏳",
             body=f"Pesanan #{order_id}: {confirmed_count + rejected_count}/{total_items} staff telah merespon.",
@@ -657,125 +506,33 @@ async def confirm_order_items(
     # 4. Jika SEMUA staff sudah merespon (tidak ada lagi 'awaiting_confirmation')
     else:
         # Skenario A: ADA SATU SAJA item yang ditolak, batalkan seluruh pesanan
-        if 'rejected' in all_items_statuses:
-            updated_order_q = supabase.table("orders").update({
-                "status": "cancelled",
-                "total_harga": 0
-            }).eq("id", order_id).execute()
-            
-            send_custom_notification(
+        if item_counts.get('rejected'):
+            cancelled_order = await transition_order(
+                order_id, "cancelled", expected=["awaiting_confirmation"], extra={"total_harga": 0}
+            )
+            if cancelled_order is None:
+                # Staff lain yang merespon bersamaan sudah memproses order ini
+                return (await fetch_orders({"id": order_id}))[0]
+
+            await send_custom_notification(
                 user_id=order['user_id'],
                 title="Pesanan Dibatalkan ❌",
                 body=f"Maaf, pesanan #{order_id} tidak dapat diproses karena sebagian item tidak tersedia.",
                 data={"order_id": str(order_id), "type": "order_cancelled"}
             )
-            return updated_order_q.data[0]
+            return cancelled_order
 
         # Skenario B: SEMUA item diterima (tidak ada 'rejected' dan tidak ada 'awaiting_confirmation')
         else:
-            update_data = {"status": "awaiting_payment"}
-            snap_redirect_url = None
-            payment_method = order.get('payment_method', '').lower()
-            
-            if payment_method == 'qris':
-                try:
-                    # Logika generate Snap URL Anda sudah benar, kita gunakan lagi di sini
-                    # Fetch order items with product details
-                    order_items_query = supabase.table("order_items").select("product_id, jumlah, harga_unit").eq("order_id", order_id).execute()
-                    order_items = order_items_query.data
-                    
-                    product_ids = [item['product_id'] for item in order_items]
-                    products_query = supabase.table("products").select("id, nama_produk, harga").in_("id", product_ids).execute()
-                    products_map = {p['id']: p for p in products_query.data}
-
-                    fee_qris = 0.7
-                    biaya_tetap = 500
-                    ppn_persen = 11
-
-                    item_details = []
-                    subtotal_harga_awal = 0
-                    
-                    for item in order_items:
-                        product_id = item['product_id']
-                        product = products_map.get(product_id)
-                        
-                        if not product:
-                            continue
-                        
-                        harga_awal = int(item['harga_unit'])
-                        jumlah = int(item['jumlah'])
-                        
-                        item_details.append({
-                            "id": str(product_id),
-                            "price": harga_awal,
-                            "quantity": jumlah,
-                            "name": product['nama_produk']
-                        })
-                        subtotal_harga_awal += harga_awal * jumlah
-
-                    if not item_details:
-                        raise Exception("Tidak ada item valid untuk diproses")
-
-                    # Calculate final price with service fees
-                    harga_jual_akhir = hitung_harga_jual(subtotal_harga_awal, biaya_tetap, fee_qris, ppn_persen)
-                    biaya_layanan = harga_jual_akhir - subtotal_harga_awal
-                    
-                    if biaya_layanan > 0:
-                        item_details.append({
-                            "id": "SERVICE_FEE",
-                            "price": biaya_layanan,
-                            "quantity": 1,
-                            "name": "Biaya Layanan & Pajak"
-                        })
-
-                    # Create unique Midtrans order ID
-                    unique_midtrans_order_id = f"{order_id}-{uuid.uuid4().hex[:6]}"
-
-                    # Get customer data
-                    customer_query = supabase.table("users")\
-                        .select("nama_pengguna, nomor_telepon")\
-                        .eq("id", order['user_id'])\
-                        .single()\
-                        .execute()
-                    
-                    customer = customer_query.data if customer_query.data else {}
-
-                    # Initialize Midtrans Snap
-                    snap = midtransclient.Snap(
-                        is_production=False,
-                        server_key=os.getenv("MIDTRANS_SERVER_KEY")
-                    )
-
-                    # Prepare transaction parameters
-                    param = {
-                        "transaction_details": {
-                            "order_id": unique_midtrans_order_id,
-                            "gross_amount": harga_jual_akhir
-                        },
-                        "item_details": item_details,
-                        "enabled_payments": ["gopay"],
-                        "customer_details": {
-                            "first_name": customer.get('nama_pengguna', 'Customer'),
-                            "phone": customer.get('nomor_telepon', '')
-                        }
-                    }
-
-                    # Create Snap transaction
-                    transaction = snap.create_transaction(param)
-                    snap_redirect_url = transaction.get('redirect_url')
-
-                    if snap_redirect_url:
-                        update_data["snap_redirect_url"] = snap_redirect_url
-                        update_data["total_harga"] = harga_jual_akhir
-
-                    print(f"✅ Snap URL generated for order {order_id}: {snap_redirect_url}")
-
-                except Exception as e:
-                    print(f"❌ Error generating Snap URL for fully confirmed order {order_id}: {str(e)}")
-
-            # Update order ke status awaiting_payment
-            final_updated_order_q = supabase.table("orders").update(update_data).eq("id", order_id).execute()
-            send_order_confirmed_notification(user_id=order['user_id'], order_id=order_id)
+            # Link Snap untuk QRIS dibuat saat customer membuka generate-snap
+            confirmed_order = await transition_order(order_id, "awaiting_payment", expected=["awaiting_confirmation"])
+            if confirmed_order is None:
+                # Staff lain yang merespon bersamaan sudah memproses order ini
+                return (await fetch_orders({"id": order_id}))[0]
+
+            if (order.get('payment_method') or '').lower() == 'qris':
+                await queue_snap_warmup(order_id)
+            await send_order_confirmed_notification(user_id=order['user_id'], order_id=order_id)
 
             customer_id = order['user_id']
             notification_payload = json.dumps({
@@ -784,9 +541,9 @@ async def confirm_order_items(
                 "new_status": "awaiting_payment" # Status baru
             })
             print(f"📢 Mengirim notifikasi WebSocket 'order_status_update' ke user #{customer_id}")
-            await manager.broadcast_to_user(customer_id, notification_payload)
+            await queue_broadcast([customer_id], notification_payload)
 
-            return final_updated_order_q.data[0]
+            return confirmed_order
         
 @router.put("/{order_id}/mark-as-paid", response_model=Order, tags=["Staff Actions"])
 async def mark_order_as_paid(
@@ -803,42 +560,21 @@ async def mark_order_as_paid(
             detail="Hanya staff yang dapat menandai pesanan sebagai dibayar"
         )
 
-    # Get order data first
-    order_query = supabase.table("orders").select("*").eq("id", order_id).single().execute()
-    if not order_query.data:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Pesanan tidak ditemukan"
-        )
-
-    order = order_query.data
-    if order['status'] != 'awaiting_payment':
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Pesanan tidak dapat ditandai sebagai dibayar karena statusnya adalah '{order['status']}'"
-        )
-
-    # 1. Update status order utama menjadi "paid"
-    updated_order_q = supabase.table("orders").update({
-        "status": "paid"
-    }).eq("id", order_id).execute()
+    # 1. Update status order utama menjadi "paid" (hanya dari awaiting_payment)
+    order = await apply_order_transition(
+        order_id, "paid", action="ditandai sebagai dibayar", expected=["awaiting_payment"]
+    )
 
-    if not updated_order_q.data:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Gagal memperbarui status pesanan"
-        )
-    
     # ✅ --- LOGIKA BARU DITAMBAHKAN DI SINI ---
     # 2. Update semua item yang 'confirmed' di dalam order ini menjadi 'paid'
-    supabase.table("order_items").update({
+    await async_supabase.table("order_items").update({
         "status": "paid"
     }).eq("order_id", order_id).eq("status", "confirmed").execute()
     # ---------------------------------------------
 
     # 3. Kirim notifikasi ke customer
     customer_id = order['user_id']
-    send_custom_notification(
+    await send_custom_notification(
         user_id=customer_id,
         title="Pembayaran Diterima ✅",
         body=f"Pembayaran untuk pesanan #{order_id} telah diterima. Pesanan Anda sedang diproses.",
@@ -854,9 +590,9 @@ async def mark_order_as_paid(
         "new_status": "paid" # Status baru
     })
     print(f"📢 Mengirim notifikasi WebSocket 'order_status_update' (paid) ke user #{customer_id}")
-    await manager.broadcast_to_user(customer_id, notification_payload)
+    await queue_broadcast([customer_id], notification_payload)
 
-    return updated_order_q.data[0]
+    return order
 
 @router.post("/{order_id}/generate-snap", response_model=Dict[str, Optional[str]], tags=["Payments"])
 async def generate_snap_url(
@@ -866,9 +602,11 @@ async def generate_snap_url(
     """
     Membuat Snap Redirect URL dari Midtrans untuk pesanan yang sudah ada.
     Hanya untuk pesanan dengan status 'awaiting_payment'.
+    Link dibuat saat pertama kali diminta lalu disimpan di order, jadi
+    permintaan berikutnya tidak memanggil Midtrans lagi selama link masih berlaku.
     """
     # 1. Ambil data pesanan dan validasi
-    order_query = supabase.table("orders").select("*").eq("id", order_id).single().execute()
+    order_query = await async_supabase.table("orders").select("*").eq("id", order_id).single().execute()
     if not order_query.data:
         raise HTTPException(status_code=404, detail="Pesanan tidak ditemukan")
 
@@ -882,85 +620,30 @@ async def generate_snap_url(
             detail=f"Link pembayaran hanya bisa dibuat untuk pesanan dengan status 'awaiting_payment'. Status saat ini: '{order['status']}'"
         )
 
-    # 2. Ambil detail item pesanan
-    order_items_query = supabase.table("order_items").select("*, products(nama_produk, harga)").eq("order_id", order_id).execute()
-    if not order_items_query.data:
-        raise HTTPException(status_code=404, detail="Item untuk pesanan ini tidak ditemukan")
-
-    order_items = order_items_query.data
-
-    # 3. Hitung total harga dan siapkan item_details untuk Midtrans
-    fee_qris = 0.7
-    biaya_tetap = 500
-    ppn_persen = 11
-
-    item_details = []
-    subtotal_harga_awal = 0
-    for item in order_items:
-        harga_awal = int(item["products"]["harga"])
-        jumlah = int(item["jumlah"])
-        item_details.append({
-            "id": str(item["product_id"]),
-            "price": harga_awal,
-            "quantity": jumlah,
-            "name": item["products"]["nama_produk"]
-        })
-        subtotal_harga_awal += harga_awal * jumlah
-
-    # 4. Hitung harga jual akhir termasuk biaya layanan
-    harga_jual_akhir = hitung_harga_jual(subtotal_harga_awal, biaya_tetap, fee_qris, ppn_persen)
-    biaya_layanan = harga_jual_akhir - subtotal_harga_awal
-    if biaya_layanan > 0:
-        item_details.append({"id": "SERVICE_FEE", "price": biaya_layanan, "quantity": 1, "name": "Biaya Layanan & Pajak"})
-
-    # 5. Buat order_id unik untuk Midtrans untuk menghindari error duplicate
-    unique_midtrans_order_id = f"{order_id}-{uuid.uuid4().hex[:6]}"
-
-    # 6. Inisialisasi Midtrans Snap client
-    snap = midtransclient.Snap(
-        is_production=False,
-        server_key=os.getenv("MIDTRANS_SERVER_KEY")
-    )
-
-    # 7. Siapkan parameter untuk Midtrans
-    param = {
-        "transaction_details": {
-            "order_id": unique_midtrans_order_id,
-            "gross_amount": harga_jual_akhir
-        },
-        "item_details": item_details,
-        "enabled_payments": ["gopay"], # Sesuaikan dengan metode pembayaran yang Anda inginkan
-        "customer_details": {
-            "first_name": current_user.nama_pengguna,
-            "phone": current_user.nomor_telepon
-        }
-    }
-
-    # 8. Buat transaksi Snap
+    # 2. Pakai link yang tersimpan di order jika masih berlaku; jika belum ada,
+    #    buat transaksi Snap (harga produk saat ini + biaya layanan) dan simpan di order
     try:
-        transaction = snap.create_transaction(param)
-    except Exception as e:
+        redirect_url = await get_order_snap_link(order)
+    except EmptyOrderError:
+        raise HTTPException(status_code=404, detail="Item untuk pesanan ini tidak ditemukan")
+    except PaymentGatewayError as e:
         raise HTTPException(status_code=500, detail=f"Gagal membuat transaksi Midtrans: {e}")
 
-    redirect_url = transaction.get('redirect_url')
-
-    # 9. Simpan redirect_url dan total harga baru ke database
-    if redirect_url:
-        supabase.table("orders").update({
-            "snap_redirect_url": redirect_url,
-            "total_harga": harga_jual_akhir # Update total harga jika ada biaya layanan
-        }).eq("id", order_id).execute()
-
-    # 10. Kembalikan URL ke client
+    # 3. Kembalikan URL ke client
     return {"snap_url": redirect_url}
 
 @router.get("/{order_id}/status", response_model=OrderStatus)
-async def get_order_status(order_id: int, current_user: UserOut = Depends(get_current_user)):
+async def get_order_status(order_id: int, request: Request, current_user: UserOut = Depends(get_current_user)):
     """
     Mendapatkan status pesanan saat ini.
     Dapat diakses oleh pemilik pesanan atau staff.
+    Mendukung If-None-Match: respons 304 tanpa query DB jika status belum berubah.
     """
-    order_resp = supabase.table("orders").select("status, user_id").eq("id", order_id).single().execute()
+    not_modified = check_not_modified(request, "orders", f"{order_id}/status:user:{current_user.id}")
+    if not_modified:
+        return not_modified
+
+    order_resp = await async_supabase.table("orders").select("status, user_id").eq("id", order_id).single().execute()
 
     if not order_resp.data:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Pesanan tidak ditemukan")
@@ -974,55 +657,75 @@ async def get_order_status(order_id: int, current_user: UserOut = Depends(get_cu
 
 @router.put("/{order_id}", response_model=Order)
 async def update_order(order_id: int, order_update: Order, current_user=Depends(get_current_user)):
-    """Update status atau total_harga order milik user yang login."""
-    order = supabase.table("orders").select("*").eq("id", order_id).single().execute().data
+    """
+    Update status atau total_harga order milik user yang login.
+    Perubahan status lewat state machine (compare-and-set dari status yang dibaca);
+    pemilik order hanya boleh membatalkan, transisi yang tidak sah dijawab 409.
+    """
+    order = (await async_supabase.table("orders").select("*").eq("id", order_id).single().execute()).data
     if not order or order["user_id"] != current_user.id:
         raise HTTPException(status_code=404, detail="Order tidak ditemukan atau bukan milik Anda")
     
     update_data = {}
-    if order_update.status:
-        update_data["status"] = order_update.status
     if order_update.total_harga:
         update_data["total_harga"] = order_update.total_harga
-    if not update_data:
+    target = order_update.status if order_update.status and order_update.status != order["status"] else None
+    if target is None and not update_data:
         raise HTTPException(status_code=400, detail="Tidak ada data yang diupdate")
-    updated = supabase.table("orders").update(update_data).eq("id", order_id).execute().data[0]
+    if target is None:
+        return (await async_supabase.table("orders").update(update_data).eq("id", order_id).execute()).data[0]
+
+    if target not in ORDER_STATUSES:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Status tidak valid: '{target}'")
+    if target not in CUSTOMER_TARGETS:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=f"Status '{target}' tidak dapat diubah oleh pemesan")
+    if not can_transition(order["status"], target):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Pesanan tidak dapat diubah dari '{order['status']}' ke '{target}'"
+        )
+    updated = await transition_order(order_id, target, expected=[order["status"]], extra=update_data)
+    if updated is None:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Status pesanan sudah berubah, muat ulang pesanan")
     return updated
 
 @router.delete("/{order_id}")
 async def delete_order(order_id: int, current_user=Depends(get_current_user)):
     """Hapus order milik user yang login (beserta order_items-nya)."""
-    order = supabase.table("orders").select("*").eq("id", order_id).single().execute().data
+    order = (await async_supabase.table("orders").select("*").eq("id", order_id).single().execute()).data
     if not order or order["user_id"] != current_user.id:
         raise HTTPException(status_code=404, detail="Order tidak ditemukan atau bukan milik Anda")
     
-    supabase.table("order_items").delete().eq("order_id", order_id).execute()
-    supabase.table("orders").delete().eq("id", order_id).execute()
+    await async_supabase.table("order_items").delete().eq("order_id", order_id).execute()
+    await async_supabase.table("orders").delete().eq("id", order_id).execute()
     return {"message": f"Order {order_id} berhasil dihapus"}
 
 @router.get("/items/me", response_model=List[OrderItem])
-async def get_my_order_items(current_user=Depends(get_current_user)):
+async def get_my_order_items(response: Response, page: dict = Depends(get_pagination), current_user=Depends(get_current_user)):
     """
-    Ambil semua order_items milik customer yang login.
+    Ambil order_items milik customer yang login, terbaru lebih dulu (dipaginasi dengan `limit`/`after`).
     Staff hanya bisa melihat order_items dari produk yang memang dipesan customer.
     """
     if current_user.role == "customer":
-        orders = supabase.table("orders").select("id").eq("user_id", current_user.id).execute().data
-        order_ids = [order["id"] for order in orders]
-        if not order_ids:
-            return []
-        items = supabase.table("order_items").select("*").in_("order_id", order_ids).execute().data
-        return items
+        # Filter lewat inner join ke orders, bukan daftar id order (bisa sangat panjang).
+        # Kolom embed `orders` dibuang oleh response_model.
+        items_query = async_supabase.table("order_items")\
+            .select("*, orders!inner(user_id)")\
+            .eq("orders.user_id", current_user.id)
     elif current_user.role == "staff":
-        product_users = supabase.table("product_users").select("product_id").eq("user_id", current_user.id).execute().data
+        product_users = (await async_supabase.table("product_users").select("product_id").eq("user_id", current_user.id).execute()).data
         product_ids = [pu["product_id"] for pu in product_users]
         if not product_ids:
             return []
-        items = supabase.table("order_items").select("*").in_("product_id", product_ids).execute().data
-        return items
+        items_query = async_supabase.table("order_items").select("*").in_("product_id", product_ids)
     else:
         raise HTTPException(status_code=403, detail="Role tidak diizinkan untuk melihat order items.")
 
+    items = (await paginate_query(items_query, **page, descending=True).execute()).data
+    items, next_cursor = split_page(items, page["limit"])
+    set_next_cursor(response, next_cursor)
+    return items
+
 @router.get("/{order_id}/items", response_model=List[OrderItem])
 async def get_order_items(order_id: int, current_user=Depends(get_current_user)):
     """
@@ -1030,7 +733,7 @@ async def get_order_items(order_id: int, current_user=Depends(get_current_user))
     - Customer hanya bisa melihat item dari order miliknya.
     - Staff bisa melihat item dari order jika order tersebut mengandung produk miliknya.
     """
-    order_query = supabase.table("orders").select("*").eq("id", order_id).execute()
+    order_query = await async_supabase.table("orders").select("*").eq("id", order_id).execute()
     if not order_query.data:
         raise HTTPException(status_code=404, detail="Order tidak ditemukan")
 
@@ -1040,20 +743,20 @@ async def get_order_items(order_id: int, current_user=Depends(get_current_user))
         if order["user_id"] != current_user.id:
             raise HTTPException(status_code=403, detail="Anda tidak memiliki akses ke pesanan ini.")
     elif current_user.role == "staff":
-        staff_products_query = supabase.table("product_users").select("product_id").eq("user_id", current_user.id).execute()
+        staff_products_query = await async_supabase.table("product_users").select("product_id").eq("user_id", current_user.id).execute()
         staff_product_ids = [p['product_id'] for p in staff_products_query.data]
 
         if not staff_product_ids:
              raise HTTPException(status_code=403, detail="Anda tidak memiliki produk untuk melihat pesanan ini.")
 
-        items_in_order_query = supabase.table("order_items").select("id").eq("order_id", order_id).in_("product_id", staff_product_ids).execute()
+        items_in_order_query = await async_supabase.table("order_items").select("id").eq("order_id", order_id).in_("product_id", staff_product_ids).execute()
         
         if not items_in_order_query.data:
             raise HTTPException(status_code=403, detail="Anda tidak memiliki akses ke item pesanan ini.")
     else:
         raise HTTPException(status_code=403, detail="Akses ditolak.")
 
-    items = supabase.table("order_items").select("*").eq("order_id", order_id).execute().data
+    items = (await async_supabase.table("order_items").select("*").eq("order_id", order_id).execute()).data
     return items
 
 @router.put("/{order_id}/update-overall-status", response_model=Order, tags=["Staff Actions"])
@@ -1069,31 +772,24 @@ async def update_overall_order_status(
     if current_user.role != "staff":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Hanya staff yang bisa melakukan aksi ini.")
 
-    order_query = supabase.table("orders").select("*").eq("id", order_id).single().execute()
+    order_query = await async_supabase.table("orders").select("*").eq("id", order_id).single().execute()
     if not order_query.data:
         raise HTTPException(status_code=404, detail="Order tidak ditemukan")
 
     db_order = order_query.data
 
-    order_items_query = supabase.table("order_items").select("status").eq("order_id", order_id).execute()
-    order_items = order_items_query.data
-    if not order_items:
+    # Status diturunkan dari orders.item_status_counts, bukan dari semua baris item
+    item_counts = db_order.get('item_status_counts') or {}
+    if not item_counts:
         return Order(**db_order)
 
-    item_statuses = {item['status'] for item in order_items}
-    
-    new_order_status = db_order['status']
-
-    if all(s == 'completed' for s in item_statuses):
-        new_order_status = 'completed'
-    elif all(s in ['ready_for_pickup', 'completed'] for s in item_statuses):
-        new_order_status = 'ready_for_pickup'
-    elif all(s in ['cooking', 'ready_for_pickup', 'completed'] for s in item_statuses):
-        new_order_status = 'cooking'
+    new_order_status = derive_fulfilment_status(item_counts) or db_order['status']
 
-    if db_order['status'] != new_order_status:
-        updated_order_query = supabase.table("orders").update({"status": new_order_status}).eq("id", order_id).execute()
-        updated_order_data = updated_order_query.data[0]
+    if db_order['status'] != new_order_status and can_transition(db_order['status'], new_order_status):
+        updated_order_data = await transition_order(order_id, new_order_status, expected=[db_order['status']])
+        if updated_order_data is None:
+            # Status berubah sejak dibaca; kembalikan status terbaru tanpa notifikasi
+            return Order(**(await fetch_orders({"id": order_id}))[0])
 
         customer_id = updated_order_data['user_id']
         notification_payload = json.dumps({
@@ -1101,7 +797,7 @@ async def update_overall_order_status(
             "order_id": order_id, 
             "new_status": new_order_status
         })
-        await manager.broadcast_to_user(customer_id, notification_payload)
+        await queue_broadcast([customer_id], notification_payload)
         
         return Order(**updated_order_data)
 
@@ -1122,7 +818,7 @@ async def update_order_item_status(
     if current_user.role != "staff":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Hanya staff yang bisa mengubah status item.")
 
-    item_query = supabase.table("order_items").select("*").eq("id", item_id).single().execute()
+    item_query = await async_supabase.table("order_items").select("*").eq("id", item_id).single().execute()
     if not item_query.data:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Item pesanan tidak ditemukan.")
     
@@ -1130,14 +826,14 @@ async def update_order_item_status(
     order_id = order_item['order_id']
     product_id = order_item['product_id']
 
-    if not is_product_owner(current_user.id, product_id):
+    if not await is_product_owner(current_user.id, product_id):
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Anda tidak memiliki hak untuk mengubah status item ini.")
 
     new_status = status_update.get("status")
     if not new_status:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Status baru harus disediakan dalam body request, contoh: {'status': 'cooking'}")
 
-    updated_item_query = supabase.table("order_items").update({"status": new_status}).eq("id", item_id).execute()
+    updated_item_query = await async_supabase.table("order_items").update({"status": new_status}).eq("id", item_id).execute()
 
     if not updated_item_query.data:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Gagal memperbarui status item.")
@@ -1145,7 +841,7 @@ async def update_order_item_status(
     updated_item_data = updated_item_query.data[0]
 
     # --- WEBSOCKET NOTIFICATION ---
-    order_query = supabase.table("orders").select("user_id, status").eq("id", order_id).single().execute()
+    order_query = await async_supabase.table("orders").select("user_id, status, item_status_counts").eq("id", order_id).single().execute()
     if order_query.data:
         customer_id = order_query.data['user_id']
         notification_payload = json.dumps({
@@ -1154,18 +850,19 @@ async def update_order_item_status(
             "order_id": order_id,
             "new_status": new_status
         })
-        await manager.broadcast_to_user(customer_id, notification_payload)
+        await queue_broadcast([customer_id], notification_payload)
         
         # --- PUSH NOTIFICATION (Pesanan Siap) ---
-        if new_status == 'completed' and order_query.data['status'] != 'completed':
-            all_items_query = supabase.table("order_items").select("status").eq("order_id", order_id).execute()
-            if all_items_query.data:
-                all_statuses = [item['status'] for item in all_items_query.data]
-                
-                if all(s == 'completed' for s in all_statuses):
-                    supabase.table("orders").update({"status": "completed"}).eq("id", order_id).execute()
-                    
-                    print(f"✅ Semua item untuk order {order_id} completed. Mengirim notifikasi ke user {customer_id}.")
-                    send_order_ready_notification(user_id=customer_id, order_id=order_id)
+        # Jumlah item per status sudah termasuk perubahan di atas (trigger order_items)
+        item_counts = order_query.data.get('item_status_counts') or {}
+        if (
+            new_status == 'completed'
+            and order_query.data['status'] != 'completed'
+            and derive_fulfilment_status(item_counts) == 'completed'
+        ):
+            # Hanya request yang berhasil memindahkan order ke 'completed' yang mengirim notifikasi
+            if await transition_order(order_id, "completed"):
+                print(f"✅ Semua item untuk order {order_id} completed. Mengirim notifikasi ke user {customer_id}.")
+                await send_order_ready_notification(user_id=customer_id, order_id=order_id)
     
     return OrderItem(**updated_item_data)
\ No newline at end of file
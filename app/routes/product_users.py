@@ -1,14 +1,16 @@
 # file: misal, routers/product_users.py
 
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends, Response
 from typing import List
-from ..config import supabase
+from ..crud import fetch_page
+from .dependencies import get_pagination, set_next_cursor
 from ..models import ProductUser # Asumsi Anda punya model Pydantic untuk ini
 
 router = APIRouter(prefix="/product-users", tags=["Product Users"])
 
 @router.get("/", response_model=List[ProductUser])
-def get_all_product_users():
-    """Mengambil semua relasi antara produk dan user."""
-    query = supabase.table("product_users").select("*").execute()
-    return query.data
\ No newline at end of file
+async def get_all_product_users(response: Response, page: dict = Depends(get_pagination)):
+    """Mengambil semua relasi antara produk dan user (dipaginasi dengan `limit`/`after`)."""
+    product_users, next_cursor = await fetch_page("product_users", **page)
+    set_next_cursor(response, next_cursor)
+    return product_users
\ No newline at end of file
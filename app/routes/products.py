@@ -1,133 +1,161 @@
 from fastapi import APIRouter, HTTPException, status, Depends, UploadFile, File, Form, Request, Response
 from typing import List, Optional
 import base64
-from .dependencies import get_current_user
-from ..models import ProductCreate, ProductOut, UserOut
-from ..crud import fetch, insert_product, update, delete, is_product_owner, fetch_products
-from ..config import supabase
+from .dependencies import get_current_user, get_pagination, set_next_cursor, field_selector
+from ..models import ProductCreate, ProductOut, ProductOutPartial, UserOut
+from ..crud import fetch, fetch_page, insert_product, update, delete, is_product_owner
+from ..config import async_supabase
 from .websockets import notify_all_staff_of_product_change
+from ..services.catalogue_cache import get_products_page, get_products_by_owner, select_fields
+from ..services.versioning import check_not_modified
+from ..services.image_store import (
+    IMAGE_URL_PREFIX, InvalidImageError, image_reference, store_image_async, thumbnail_filename,
+)
 
 router = APIRouter(prefix="/products", tags=["Products"])
 
-IMAGE_STORAGE_PATH = "static/images/products"
-import os
-os.makedirs(IMAGE_STORAGE_PATH, exist_ok=True)
-
 # Helper untuk membuat URL penuh (dari pembahasan sebelumnya)
 def _create_full_image_url(request: Request, filename: Optional[str]) -> Optional[str]:
     if not filename:
         return None
     # URL gambar akan menjadi http://.../static/images/products/namafile.jpg
-    return str(request.base_url) + f"static/images/products/{filename}"
+    return str(request.base_url) + f"{IMAGE_URL_PREFIX}/{filename}"
+
+# `?fields=gambar_thumbnail` cukup mengambil kolom `gambar`
+product_fields = field_selector(ProductOut, derived={"gambar_thumbnail": "gambar"})
 
-@router.get("/", response_model=List[ProductOut])
-def get_products(include_inactive: bool = False):
+def _to_product_out(request: Request, product: dict) -> dict:
+    """
+    Mengganti nama file gambar di kolom `gambar` dengan URL gambar dan thumbnail.
+    Base64 lama yang belum dimigrasi (lihat app/scripts/migrate_product_images.py)
+    tidak ikut dikirim. Baris parsial (tanpa kolom `gambar`) dikembalikan apa adanya.
+    """
+    if "gambar" not in product:
+        return product
+    filename = image_reference(product.get("gambar"))
+    return {
+        **product,
+        "gambar": _create_full_image_url(request, filename),
+        "gambar_thumbnail": _create_full_image_url(request, thumbnail_filename(filename)) if filename else None,
+    }
+
+async def _store_product_image(gambar: Optional[str]) -> Optional[str]:
+    """Menyimpan gambar base64 dari client dan mengembalikan nama filenya."""
+    if not gambar:
+        return None
+    # Client boleh mengirim balik URL/nama file yang sudah ada (gambar tidak diganti)
+    filename = image_reference(gambar)
+    if filename:
+        return filename
+    try:
+        return await store_image_async(gambar)
+    except InvalidImageError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+@router.get("/", response_model=List[ProductOutPartial], response_model_exclude_unset=True)
+async def get_products(
+    request: Request,
+    response: Response,
+    include_inactive: bool = False,
+    page: dict = Depends(get_pagination),
+    fields: Optional[List[str]] = Depends(product_fields),
+):
     """
     Mengambil semua produk. Secara default hanya mengambil produk yang aktif.
     Gunakan query parameter `?include_inactive=true` untuk mengambil semua produk
-    termasuk yang tidak aktif.
+    termasuk yang tidak aktif. Hasil dipaginasi dengan `limit`/`after`.
+    Gunakan `?fields=id,nama_produk,harga` untuk mengambil kolom tertentu saja.
+    Tanpa `fields`, data dibaca dari cache katalog (lihat services/catalogue_cache.py).
+    Dengan `fields`, kolom diteruskan ke select() PostgREST tanpa cache, jadi
+    gambar/deskripsi yang tidak diminta tidak ikut ditransfer dari database.
+    Mendukung If-None-Match: respons 304 jika katalog belum berubah.
     """
-    filters = None
-    if not include_inactive:
-        # Jika tidak ada permintaan untuk menyertakan yang tidak aktif,
-        # maka filter hanya yang aktif.
-        filters = {"is_active": True}
-    
-    # Jika include_inactive=true, filters akan None, dan fetch_products akan mengambil semua.
-    products_data = fetch_products(filters=filters) 
+    not_modified = check_not_modified(request, "catalogue", f"products?{request.url.query}")
+    if not_modified:
+        return not_modified
+
+    if fields:
+        filters = None if include_inactive else {"is_active": True}
+        products_data, next_cursor = await fetch_page("products", filters, columns=fields, **page)
+    else:
+        # View produk aktif sudah dihitung di cache; include_inactive=true memakai semua produk.
+        products_data, next_cursor = await get_products_page(include_inactive, **page)
+    set_next_cursor(response, next_cursor)
     
     products = []
-    for p in products_data:
-        products.append(ProductOut(**p))
+    for p in select_fields(products_data, fields):
+        products.append(_to_product_out(request, p))
     return products
 
-@router.get("/my-products", response_model=List[ProductOut])
-async def get_my_products(current_user: UserOut = Depends(get_current_user)):
-    product_users = fetch("product_users", filters={"user_id": current_user.id})
-    product_ids = [pu["product_id"] for pu in product_users]
-    if not product_ids:
-        return []
-    products = []
-    for pid in product_ids:
-        res = fetch("products", filters={"id": pid})
-        if res:
-            products.append(ProductOut(**res[0]))  # langsung tanpa konversi
-    return products
+@router.get("/my-products", response_model=List[ProductOutPartial], response_model_exclude_unset=True)
+async def get_my_products(
+    request: Request,
+    fields: Optional[List[str]] = Depends(product_fields),
+    current_user: UserOut = Depends(get_current_user),
+):
+    products_data = await get_products_by_owner(current_user.id)
+    return [_to_product_out(request, p) for p in select_fields(products_data, fields)]
 
-@router.get("/filter-by-user", response_model=List[ProductOut])
-def filter_products_by_user(
+@router.get("/filter-by-user", response_model=List[ProductOutPartial], response_model_exclude_unset=True)
+async def filter_products_by_user(
+    request: Request,
     user_id: int, 
     # FIX: Terima is_active sebagai query parameter opsional
-    is_active: Optional[bool] = None 
+    is_active: Optional[bool] = None,
+    fields: Optional[List[str]] = Depends(product_fields),
 ):
     """Mengambil produk berdasarkan user ID, dengan opsi filter status aktif."""
-    
-    # 1. Temukan product_ids milik staff
-    product_users = fetch("product_users", filters={"user_id": user_id})
-    product_ids = [pu["product_id"] for pu in product_users]
-    
-    if not product_ids:
-        return []
-        
-    products = []
-    
-    # 2. Siapkan filter tambahan (hanya jika is_active dikirim)
-    product_filter = {}
-    if is_active is not None:
-        # Jika is_active=True, filter hanya yang aktif.
-        # Jika is_active=False, filter hanya yang non-aktif.
-        product_filter['is_active'] = is_active
-        
-    for pid in product_ids:
-        # 3. Gabungkan filter ID dan filter status aktif
-        combined_filter = {"id": pid}
-        combined_filter.update(product_filter) # Tambahkan is_active jika ada
-        
-        # Ambil detail produk dengan filter gabungan
-        res = fetch("products", filters=combined_filter) 
-        
-        if res:
-            products.append(ProductOut(**res[0]))
-            
-    return products
+    # Kepemilikan produk dan katalog dibaca dari cache, dengan filter is_active jika dikirim.
+    # Jika is_active=True, filter hanya yang aktif.
+    # Jika is_active=False, filter hanya yang non-aktif.
+    products_data = await get_products_by_owner(user_id, is_active=is_active)
+    return [_to_product_out(request, p) for p in select_fields(products_data, fields)]
 
 
 @router.get("/{product_id}", response_model=ProductOut)
 async def get_product_by_id(
+    request: Request,
     product_id: int,
     current_user: UserOut = Depends(get_current_user)
 ):
-    if not is_product_owner(current_user.id, product_id):
+    if not await is_product_owner(current_user.id, product_id):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Anda tidak memiliki hak untuk mengakses produk ini."
         )
-    res = fetch("products", filters={"id": product_id})
+    res = await fetch("products", filters={"id": product_id})
     if not res:
         raise HTTPException(status_code=404, detail="Produk tidak ditemukan.")
-    return res[0]
+    return _to_product_out(request, res[0])
 
 @router.post("/", response_model=ProductOut)
 async def create_product(
+    request: Request,
     product: ProductCreate,  # Gambar dikirim sebagai string base64
     current_user: UserOut = Depends(get_current_user)
 ):
-    """Membuat produk baru dengan gambar base64."""
+    """
+    Membuat produk baru dengan gambar base64. Gambar di-decode sekali dan
+    disimpan sebagai file; kolom `gambar` hanya berisi nama filenya.
+    """
     if current_user.role != "staff":
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Hanya staff yang bisa membuat produk."
         )
+
+    product = product.model_copy(update={"gambar": await _store_product_image(product.gambar)})
     
     try:
-        result = insert_product(product, current_user.id)
+        result = await insert_product(product, current_user.id)
         await notify_all_staff_of_product_change()
-        return result
+        return _to_product_out(request, result.model_dump())
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Database error: {e}")
 
 @router.put("/{product_id}", response_model=ProductOut)
 async def update_product(
+    request: Request,
     product_id: int,
     # FIX: Ubah dari Pydantic model langsung ke Form Data jika Anda menggunakan Form()
     # TAPI: Karena Anda menggunakan product: ProductCreate, kita harus memastikan
@@ -140,7 +168,7 @@ async def update_product(
     """
     Memperbarui produk, termasuk status is_active.
     """
-    if not is_product_owner(current_user.id, product_id):
+    if not await is_product_owner(current_user.id, product_id):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Anda tidak memiliki hak untuk mengubah produk ini."
@@ -148,14 +176,16 @@ async def update_product(
     
     # FIX: Dapatkan data dalam bentuk dictionary, termasuk is_active
     update_data = product.dict(exclude_unset=True)
+    if "gambar" in update_data:
+        update_data["gambar"] = await _store_product_image(update_data["gambar"])
     
     # Perbarui hanya field yang ada (ini akan mencakup is_active jika dikirim)
-    res = update('products', product_id, update_data)
+    res = await update('products', product_id, update_data)
     
     if not res:
         raise HTTPException(status_code=404, detail='Produk tidak ditemukan.')
     await notify_all_staff_of_product_change()
-    return res
+    return _to_product_out(request, res)
 
 @router.delete("/{product_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_product(
@@ -167,14 +197,14 @@ async def delete_product(
     Hanya pemilik produk yang dapat menghapusnya.
     """
     # 1. Otorisasi: Pastikan user adalah pemilik produk
-    if not is_product_owner(current_user.id, product_id):
+    if not await is_product_owner(current_user.id, product_id):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Anda tidak memiliki hak untuk menghapus produk ini."
         )
 
     # 2. Cek apakah produk ada di dalam keranjang pengguna lain
-    cart_item_query = supabase.table("cart_items").select("id", count='exact').eq("product_id", product_id).limit(1).execute()
+    cart_item_query = await async_supabase.table("cart_items").select("id", count='exact').eq("product_id", product_id).limit(1).execute()
     
     if cart_item_query.count > 0:
         # Jika ada, jangan hapus, kirim error 409 Conflict
@@ -183,10 +213,10 @@ async def delete_product(
             detail="Produk tidak dapat dihapus karena masih ada di keranjang pengguna."
         )
 
-    supabase.table("product_users").delete().eq("product_id", product_id).execute()
+    await async_supabase.table("product_users").delete().eq("product_id", product_id).execute()
 
     # 3. Lanjutkan proses penghapusan menggunakan Supabase client
-    delete_result = supabase.table("products").delete().eq("id", product_id).execute()
+    delete_result = await async_supabase.table("products").delete().eq("id", product_id).execute()
 
     # 4. Cek apakah ada data yang dihapus. Jika tidak, produk tidak ditemukan.
     if not delete_result.data:
@@ -1,38 +1,41 @@
-from fastapi import APIRouter, HTTPException, status
+from fastapi import APIRouter, HTTPException, status, Depends, Response
 from typing import List
 from ..models import UserLogin, UserOut, UserCreate
-from ..crud import fetch, insert, update, delete
-from passlib.context import CryptContext
+from ..crud import fetch_page, insert, update, delete, fetch_user_credentials
+from .dependencies import get_pagination, set_next_cursor
+from ..services.password_service import hash_password, verify_and_update
 
 router = APIRouter(prefix="/users", tags=["Users"])
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 @router.get("/", response_model=List[UserOut])
-def get_users():
-    return fetch("users")
+async def get_users(response: Response, page: dict = Depends(get_pagination)):
+    users, next_cursor = await fetch_page("users", **page)
+    set_next_cursor(response, next_cursor)
+    return users
 
 @router.post("/login", response_model=UserOut)
-def login_user(user_login: UserLogin):
-    users = fetch("users")
-    for user in users:
-        if (user["nama_pengguna"] == user_login.nama_pengguna and
-            user["nomor_telepon"] == user_login.nomor_telepon and
-            pwd_context.verify(user_login.password, user["password"])):
-            
+async def login_user(user_login: UserLogin):
+    user = await fetch_user_credentials(user_login.nama_pengguna, user_login.nomor_telepon)
+    if user:
+        is_valid, new_hash = await verify_and_update(user_login.password, user["password"])
+        if is_valid:
+            if new_hash:
+                # Hash lama memakai parameter usang, simpan hash baru
+                await update('users', user["id"], {"password": new_hash})
             # Jika kredensial cocok, kembalikan data user tanpa password
-            return user
-            
+            return UserOut(**user)
+
     raise HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Nama, nomor telepon, atau password salah"
     )
 
 @router.post("/", response_model=UserOut)
-def create_user(user: UserCreate):
-    hashed_password = pwd_context.hash(user.password)
+async def create_user(user: UserCreate):
+    hashed_password = await hash_password(user.password)
     user_data = user.dict()
     user_data["password"] = hashed_password
-    result = insert(UserCreate(**user_data))
+    result = await insert(UserCreate(**user_data))
     if result is None:
         raise HTTPException(status_code=500, detail="Database error")
     return result
@@ -41,15 +44,15 @@ def create_user(user: UserCreate):
 async def edit_user(user_id: int, user: UserCreate):
     user_data = user.dict(exclude_unset=True)
     if "password" in user_data:
-        user_data["password"] = pwd_context.hash(user_data["password"])
-    res = update('users', user_id, user_data)
+        user_data["password"] = await hash_password(user_data["password"])
+    res = await update('users', user_id, user_data)
     if not res:
         raise HTTPException(404, 'User not found')
     return res
 
 @router.delete("/{user_id}")
 async def remove_user(user_id: int):
-    res = delete('users', user_id)
+    res = await delete('users', user_id)
     if not res:
         raise HTTPException(404, 'User not found')
     return {"message": f"User dengan id {user_id} telah berhasil dihapus."}
\ No newline at end of file
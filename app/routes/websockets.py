@@ -1,47 +1,219 @@
 # file: routers/websockets.py
 
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Query, Depends, status
-from typing import List, Dict
+from typing import List, Dict, Optional, Set
 
 # Import dependency untuk validasi token
 from .dependencies import get_user_from_ws_token 
 from ..models import UserOut
+import os
 import json
-from ..config import supabase
+import asyncio
+from ..services.outbox import outbox
+from ..services.catalogue_cache import invalidate_catalogue
+from ..services.broadcast import BroadcastBackend, InMemoryBroadcastBackend, create_broadcast_backend
+
+# Batas antrean pesan keluar per koneksi dan batas waktu satu kali send.
+# Koneksi yang lambat (misalnya HP dengan Wi-Fi kantin yang buruk) tidak boleh
+# menahan pengiriman ke user lain.
+WS_QUEUE_SIZE: int = int(os.getenv("WS_QUEUE_SIZE", "100"))
+WS_SEND_TIMEOUT: float = float(os.getenv("WS_SEND_TIMEOUT", "5"))
+# "disconnect": tutup koneksi saat antreannya penuh (client akan reconnect dan refetch)
+# "drop": buang pesan baru dan pertahankan koneksi
+WS_SLOW_CONSUMER_POLICY: str = os.getenv("WS_SLOW_CONSUMER_POLICY", "disconnect")
+
+
+class ClientConnection:
+    """Satu koneksi WebSocket dengan antrean keluar terbatas dan writer task sendiri."""
+
+    def __init__(self, manager: "ConnectionManager", websocket: WebSocket, user_id: int):
+        self.manager = manager
+        self.websocket = websocket
+        self.user_id = user_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=WS_QUEUE_SIZE)
+        self.writer = asyncio.create_task(self._write_loop())
+
+    def enqueue(self, message: str):
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.manager.metrics["dropped_messages"] += 1
+            if WS_SLOW_CONSUMER_POLICY == "disconnect":
+                print(f"🐢 WS Lambat: antrean user #{self.user_id} penuh, koneksi ditutup.")
+                self.manager.metrics["slow_consumer_disconnects"] += 1
+                self.manager.disconnect(self.websocket, self.user_id)
+
+    async def _write_loop(self):
+        while True:
+            message = await self.queue.get()
+            try:
+                await asyncio.wait_for(self.websocket.send_text(message), timeout=WS_SEND_TIMEOUT)
+                self.manager.metrics["messages_sent"] += 1
+            except asyncio.TimeoutError:
+                print(f"⏱️ WS Timeout: pengiriman ke user #{self.user_id} melebihi {WS_SEND_TIMEOUT} detik.")
+                self.manager.metrics["send_timeouts"] += 1
+                self.manager.disconnect(self.websocket, self.user_id)
+                return
+            except Exception:
+                self.manager.disconnect(self.websocket, self.user_id)
+                return
+
+    def close(self):
+        """Menghentikan writer dan menutup socket tanpa menunggu client yang lambat."""
+        if self.writer is not asyncio.current_task():
+            self.writer.cancel()
+        asyncio.create_task(self._close_socket())
+
+    async def _close_socket(self):
+        try:
+            await asyncio.wait_for(self.websocket.close(code=status.WS_1013_TRY_AGAIN_LATER), timeout=WS_SEND_TIMEOUT)
+        except Exception:
+            pass
+
 
 # ... (Kode ConnectionManager Anda tetap sama) ...
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[int, List[WebSocket]] = {}
+    """
+    Menyimpan koneksi WebSocket milik proses ini. Pengiriman pesan selalu lewat
+    broadcast backend (lihat services/broadcast.py) supaya pesan juga sampai ke
+    user yang terhubung ke worker uvicorn lain.
+    """
+    def __init__(self, backend: Optional[BroadcastBackend] = None):
+        self.active_connections: Dict[int, List[ClientConnection]] = {}
+        # Role tiap user diambil dari JWT saat connect, jadi tidak perlu query DB
+        self.user_roles: Dict[int, str] = {}
+        # Index topic -> user_id lokal, misalnya "staff", "order:12", "kitchen:5"
+        self.topics: Dict[str, Set[int]] = {}
+        self.backend: BroadcastBackend = backend or InMemoryBroadcastBackend()
+        self.metrics = {
+            "messages_sent": 0,
+            "dropped_messages": 0,
+            "send_timeouts": 0,
+            "slow_consumer_disconnects": 0,
+        }
+
+    async def start(self):
+        await self.backend.start(self._deliver_local)
+
+    async def stop(self):
+        await self.backend.stop()
 
-    async def connect(self, websocket: WebSocket, user_id: int):
+    async def connect(self, websocket: WebSocket, user_id: int, role: Optional[str] = None):
         await websocket.accept()
         if user_id not in self.active_connections:
             self.active_connections[user_id] = []
-        self.active_connections[user_id].append(websocket)
+        self.active_connections[user_id].append(ClientConnection(self, websocket, user_id))
+        if role:
+            self.user_roles[user_id] = role
+            # Setiap user otomatis berlangganan topic sesuai role-nya
+            self.subscribe(user_id, role)
         print(f"✅ WS Terhubung: User #{user_id} terkoneksi. Total koneksi: {len(self.active_connections[user_id])}")
 
     def disconnect(self, websocket: WebSocket, user_id: int):
-        if user_id in self.active_connections:
-            if websocket in self.active_connections[user_id]:
-                self.active_connections[user_id].remove(websocket)
-                if not self.active_connections[user_id]:
+        connections = self.active_connections.get(user_id, [])
+        for connection in connections:
+            if connection.websocket is websocket:
+                connections.remove(connection)
+                connection.close()
+                if not connections:
                     del self.active_connections[user_id]
-        print(f"🔌 WS Terputus: User #{user_id} disconnect.")
+                    self.user_roles.pop(user_id, None)
+                    self._unsubscribe_all(user_id)
+                print(f"🔌 WS Terputus: User #{user_id} disconnect.")
+                break
 
     async def broadcast_to_user(self, user_id: int, message: str):
-        if user_id in self.active_connections:
-            connections = self.active_connections[user_id][:]
-            for connection in connections:
-                try:
-                    await connection.send_text(message)
-                except Exception:
-                    self.disconnect(connection, user_id)
-
-manager = ConnectionManager()
+        """Mem-publish pesan untuk user ke semua worker melalui backend."""
+        await self.broadcast_to_users([user_id], message)
+
+    async def broadcast_to_users(self, user_ids: List[int], message: str):
+        """Mem-publish satu pesan untuk banyak user sekaligus (satu envelope)."""
+        if user_ids:
+            await self.backend.publish({"user_ids": list(user_ids), "message": message})
+
+    async def broadcast_to_topic(self, topic: str, message: str, invalidate: Optional[str] = None):
+        """
+        Mem-publish pesan ke semua user yang berlangganan topic, di semua worker.
+        `invalidate="catalogue"` sekaligus menghapus cache katalog di setiap worker.
+        """
+        envelope = {"topic": topic, "message": message}
+        if invalidate:
+            envelope["invalidate"] = invalidate
+        await self.backend.publish(envelope)
+
+    async def broadcast_invalidation(self, cache: str):
+        """Meminta semua worker menghapus cache (saat ini hanya "catalogue")."""
+        await self.backend.publish({"invalidate": cache})
+
+    def subscribe(self, user_id: int, topic: str):
+        self.topics.setdefault(topic, set()).add(user_id)
+
+    def unsubscribe(self, user_id: int, topic: str):
+        subscribers = self.topics.get(topic)
+        if subscribers is not None:
+            subscribers.discard(user_id)
+            if not subscribers:
+                del self.topics[topic]
+
+    def _unsubscribe_all(self, user_id: int):
+        for topic in [t for t, subscribers in self.topics.items() if user_id in subscribers]:
+            self.unsubscribe(user_id, topic)
+
+    def user_ids_with_role(self, role: str) -> List[int]:
+        """User lokal yang sedang terhubung dengan role tertentu (tanpa query DB)."""
+        return list(self.topics.get(role, ()))
+
+    async def _deliver_local(self, envelope: dict):
+        """Dipanggil backend untuk setiap pesan; kirim ke socket yang ada di proses ini."""
+        if envelope.get("invalidate") == "catalogue":
+            invalidate_catalogue()
+        if "message" not in envelope:
+            return
+        if "topic" in envelope:
+            user_ids = list(self.topics.get(envelope["topic"], ()))
+        else:
+            user_ids = envelope["user_ids"]
+        for user_id in user_ids:
+            self.send_to_local_user(user_id, envelope["message"])
+
+    def send_to_local_user(self, user_id: int, message: str):
+        # Hanya memasukkan ke antrean tiap koneksi; pengiriman dilakukan writer
+        # masing-masing secara paralel, jadi tidak ada yang saling menunggu.
+        for connection in self.active_connections.get(user_id, [])[:]:
+            connection.enqueue(message)
+
+    def stats(self) -> dict:
+        depths = [c.queue.qsize() for conns in self.active_connections.values() for c in conns]
+        return {
+            **self.metrics,
+            "connected_users": len(self.active_connections),
+            "connected_staff": len(self.user_ids_with_role("staff")),
+            "topics": len(self.topics),
+            "connections": len(depths),
+            "queue_depth_total": sum(depths),
+            "queue_depth_max": max(depths, default=0),
+        }
+
+manager = ConnectionManager(create_broadcast_backend())
 router = APIRouter()
 
 
+async def _handle_ws_broadcast(payload: dict):
+    """Handler outbox untuk pesan WebSocket."""
+    await manager.broadcast_to_users(payload["user_ids"], payload["message"])
+
+outbox.register_handler("ws", _handle_ws_broadcast)
+
+
+async def queue_broadcast(user_ids: List[int], message: str):
+    """
+    Memasukkan pesan WebSocket ke outbox agar dikirim oleh worker di background,
+    sehingga route tidak perlu menunggu pengiriman ke setiap socket.
+    """
+    if user_ids:
+        await outbox.enqueue("ws", {"user_ids": list(user_ids), "message": message})
+
+
 # ✅ --- INI ADALAH FUNGSI YANG DIPERBAIKI ---
 @router.websocket("/ws/{user_id}")
 async def websocket_endpoint(
@@ -62,7 +234,7 @@ async def websocket_endpoint(
         return
 
     # Jika kode sampai di sini, user sudah pasti terotentikasi.
-    await manager.connect(websocket, user.id)
+    await manager.connect(websocket, user.id, user.role)
     
     try:
         # Loop ini menjaga koneksi tetap hidup
@@ -76,30 +248,24 @@ async def websocket_endpoint(
 
 async def notify_all_staff_of_product_change():
     """
-    Finds all connected users with the 'staff' role and sends them
-    a product update notification.
+    Mengirim notifikasi perubahan produk ke semua staff yang terhubung.
+    Memakai topic "staff" dari registry koneksi, jadi tidak ada query ke DB
+    dan staff di worker lain juga ikut menerima. Cache katalog ikut dihapus:
+    langsung di proses ini, dan di worker lain saat envelope-nya diterima,
+    karena semua penulisan produk melewati fungsi ini.
     """
-    # Get all user IDs that are currently connected via WebSocket
-    connected_user_ids = list(manager.active_connections.keys())
+    invalidate_catalogue()
+    try:
+        payload = json.dumps({"type": "product_update"})
+        await manager.broadcast_to_topic("staff", payload, invalidate="catalogue")
+    except Exception as e:
+        print(f"❌ Error during staff notification broadcast: {e}")
 
-    if not connected_user_ids:
-        return # No one is connected, do nothing
 
-    # From the connected users, find out which ones are staff
+async def invalidate_catalogue_everywhere():
+    """Menghapus cache katalog di proses ini dan di semua worker lain (perubahan kategori)."""
+    invalidate_catalogue()
     try:
-        staff_query = supabase.table("users")\
-            .select("id")\
-            .in_("id", connected_user_ids)\
-            .eq("role", "staff")\
-            .execute()
-
-        staff_ids = [user['id'] for user in staff_query.data]
-        
-        if staff_ids:
-            print(f"📢 Notifying staff of product update: {staff_ids}")
-            payload = json.dumps({"type": "product_update"})
-            for staff_id in staff_ids:
-                await manager.broadcast_to_user(staff_id, payload)
-
+        await manager.broadcast_invalidation("catalogue")
     except Exception as e:
-        print(f"❌ Error during staff notification broadcast: {e}")
\ No newline at end of file
+        print(f"❌ Error saat broadcast invalidasi katalog: {e}")
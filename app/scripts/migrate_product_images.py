@@ -0,0 +1,59 @@
+"""
+Memindahkan gambar produk lama (base64 di kolom products.gambar) ke image store.
+
+Jalankan dari root project:
+    python -m app.scripts.migrate_product_images [--dry-run] [--batch-size 100]
+
+Aman dijalankan berulang kali: baris yang sudah berisi nama file dilewati.
+"""
+import argparse
+import logging
+from ..config import supabase
+from ..services.image_store import InvalidImageError, image_reference, store_image
+
+logger = logging.getLogger(__name__)
+
+
+def migrate(batch_size: int = 100, dry_run: bool = False):
+    last_id = 0
+    migrated = skipped = failed = 0
+    while True:
+        rows = (
+            supabase.table("products")
+            .select("id, gambar")
+            .gt("id", last_id)
+            .order("id")
+            .limit(batch_size)
+            .execute()
+            .data
+        )
+        if not rows:
+            break
+        last_id = rows[-1]["id"]
+
+        for row in rows:
+            gambar = row.get("gambar")
+            if not gambar or image_reference(gambar):
+                skipped += 1
+                continue
+            try:
+                filename = store_image(gambar)
+            except InvalidImageError as e:
+                logger.warning(f"Produk {row['id']}: gambar tidak bisa dimigrasi ({e})")
+                failed += 1
+                continue
+            if not dry_run:
+                supabase.table("products").update({"gambar": filename}).eq("id", row["id"]).execute()
+            migrated += 1
+
+    logger.info(f"Migrasi gambar selesai: {migrated} dimigrasi, {skipped} dilewati, {failed} gagal"
+                + (" (dry run)" if dry_run else ""))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Migrasi gambar produk base64 ke image store.")
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--dry-run", action="store_true", help="Simpan file gambar tanpa mengubah database")
+    args = parser.parse_args()
+    migrate(batch_size=args.batch_size, dry_run=args.dry_run)
@@ -0,0 +1,110 @@
+import os
+import json
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# URL backend pub/sub untuk WebSocket. Kosong / "memory://" berarti in-memory
+# (cukup untuk satu proses). Gunakan "redis://host:6379/0" saat menjalankan
+# `uvicorn --workers N` atau beberapa instance, agar setiap worker menerima
+# pesan dan meneruskannya ke socket lokalnya masing-masing.
+BROADCAST_URL: str = os.getenv("BROADCAST_URL", "memory://")
+BROADCAST_CHANNEL: str = os.getenv("BROADCAST_CHANNEL", "kantinku:ws")
+
+MessageHandler = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+class BroadcastBackend(ABC):
+    """
+    Antarmuka backend broadcast. `publish()` mengirim envelope ke semua worker,
+    dan setiap worker memanggil `on_message` untuk envelope yang diterimanya.
+    """
+
+    @abstractmethod
+    async def start(self, on_message: MessageHandler):
+        ...
+
+    @abstractmethod
+    async def publish(self, envelope: Dict[str, Any]):
+        ...
+
+    async def stop(self):
+        pass
+
+
+class InMemoryBroadcastBackend(BroadcastBackend):
+    """Backend untuk satu proses: envelope langsung diteruskan ke handler lokal."""
+
+    def __init__(self):
+        self._on_message: Optional[MessageHandler] = None
+
+    async def start(self, on_message: MessageHandler):
+        self._on_message = on_message
+
+    async def publish(self, envelope: Dict[str, Any]):
+        if self._on_message is not None:
+            await self._on_message(envelope)
+
+
+class RedisBroadcastBackend(BroadcastBackend):
+    """
+    Backend Redis pub/sub. Setiap worker berlangganan ke channel yang sama,
+    termasuk worker yang mem-publish, sehingga pengiriman ke socket lokal
+    selalu lewat jalur yang sama.
+    """
+
+    def __init__(self, url: str, channel: str = BROADCAST_CHANNEL, client=None):
+        if client is None:
+            try:
+                import redis.asyncio as redis_asyncio
+            except ImportError as e:
+                raise RuntimeError("Paket 'redis' diperlukan untuk BROADCAST_URL redis://") from e
+            client = redis_asyncio.from_url(url)
+        self.client = client
+        self.channel = channel
+        self._pubsub = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self, on_message: MessageHandler):
+        self._pubsub = self.client.pubsub()
+        await self._pubsub.subscribe(self.channel)
+        self._task = asyncio.create_task(self._listen(on_message))
+        logger.info(f"Broadcast backend Redis berlangganan ke channel '{self.channel}'")
+
+    async def _listen(self, on_message: MessageHandler):
+        while True:
+            try:
+                message = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                if message is None:
+                    continue
+                await on_message(json.loads(message["data"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error saat membaca pesan broadcast dari Redis: {e}")
+                await asyncio.sleep(1)
+
+    async def publish(self, envelope: Dict[str, Any]):
+        await self.client.publish(self.channel, json.dumps(envelope))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._pubsub is not None:
+            await self._pubsub.unsubscribe(self.channel)
+            await self._pubsub.aclose()
+            self._pubsub = None
+        await self.client.aclose()
+
+
+def create_broadcast_backend(url: str = BROADCAST_URL) -> BroadcastBackend:
+    if url.startswith(("redis://", "rediss://")):
+        return RedisBroadcastBackend(url)
+    if url in ("", "memory://"):
+        return InMemoryBroadcastBackend()
+    raise ValueError(f"BROADCAST_URL tidak dikenali: {url}")
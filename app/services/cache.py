@@ -0,0 +1,87 @@
+import time
+import asyncio
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+# Cache in-memory per proses, dipakai bersama oleh katalog (catalogue_cache.py)
+# dan transaksi Snap (payment_gateway.py). Setiap pemakai menentukan TTL sendiri.
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    Cache in-process dengan TTL dan batas jumlah entri (LRU). Miss untuk key yang
+    sama digabung: hanya satu request yang memanggil loader, sisanya menunggu.
+    """
+
+    def __init__(self, ttl: float, max_entries: int = 1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._locks: Dict[Hashable, asyncio.Lock] = {}
+        # Naik setiap invalidate; hasil loader yang mulai sebelum invalidate tidak disimpan
+        self._generation = 0
+        self.metrics = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def _lookup(self, key: Hashable) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            return _MISSING
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self._drop_lock(key)
+            return _MISSING
+        self._entries.move_to_end(key)
+        return value
+
+    def _drop_lock(self, key: Hashable):
+        # Lock yang sedang dipegang loader tetap disimpan agar miss tetap digabung
+        lock = self._locks.get(key)
+        if lock is not None and not lock.locked():
+            del self._locks[key]
+
+    def _store(self, key: Hashable, value: Any):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            evicted, _ = self._entries.popitem(last=False)
+            self._drop_lock(evicted)
+            self.metrics["evictions"] += 1
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        value = self._lookup(key)
+        if value is not _MISSING:
+            self.metrics["hits"] += 1
+            return value
+
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            # Mungkin sudah dimuat oleh request lain selama menunggu lock
+            value = self._lookup(key)
+            if value is not _MISSING:
+                self.metrics["hits"] += 1
+                return value
+            self.metrics["misses"] += 1
+            generation = self._generation
+            value = await loader()
+            if generation == self._generation:
+                self._store(key, value)
+            return value
+
+    def invalidate(self):
+        self._entries.clear()
+        for key in list(self._locks):
+            self._drop_lock(key)
+        self._generation += 1
+        self.metrics["invalidations"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.metrics["hits"] + self.metrics["misses"]
+        return {
+            **self.metrics,
+            "entries": len(self._entries),
+            "locks": len(self._locks),
+            "hit_ratio": round(self.metrics["hits"] / lookups, 3) if lookups else None,
+        }
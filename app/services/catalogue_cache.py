@@ -0,0 +1,98 @@
+import os
+from bisect import bisect_right
+from typing import Any, Dict, List, Optional, Tuple
+from ..config import async_supabase
+from ..crud import fetch_products_by_ids, split_page
+from .cache import TTLCache
+
+# Katalog (produk + kategori) jarang berubah, jadi dibaca dari memori selama
+# CATALOGUE_CACHE_TTL detik. Setiap penulisan langsung menghapus cache di proses
+# ini dan, lewat broadcast backend (routes/websockets.py), di worker lain.
+# Baris yang dikembalikan dipakai bersama oleh semua request: jangan diubah in-place.
+CATALOGUE_CACHE_TTL: float = float(os.getenv("CATALOGUE_CACHE_TTL", "60"))
+CATALOGUE_CACHE_MAX_ENTRIES: int = int(os.getenv("CATALOGUE_CACHE_MAX_ENTRIES", "256"))
+
+catalogue_cache = TTLCache(ttl=CATALOGUE_CACHE_TTL, max_entries=CATALOGUE_CACHE_MAX_ENTRIES)
+
+
+# --- Loader (langsung ke Supabase; error tidak pernah di-cache) ------------
+
+async def _load_products() -> Dict[str, List]:
+    result = await async_supabase.table("products").select("*").order("id").execute()
+    rows = result.data or []
+    active = [row for row in rows if row.get("is_active")]
+    # View is_active dihitung sekali per pemuatan, bukan per request
+    return {
+        "all": rows,
+        "all_ids": [row["id"] for row in rows],
+        "active": active,
+        "active_ids": [row["id"] for row in active],
+    }
+
+
+async def _load_categories() -> List[Dict[str, Any]]:
+    result = await async_supabase.table("categories").select("*").order("id").execute()
+    return result.data or []
+
+
+async def _load_owner_product_ids(user_id: int) -> List[int]:
+    result = await async_supabase.table("product_users").select("product_id").eq("user_id", user_id).execute()
+    return [row["product_id"] for row in result.data or []]
+
+
+# --- API untuk route -------------------------------------------------------
+
+async def get_products_page(
+    include_inactive: bool, limit: int, after: Optional[int] = None
+) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+    """Satu halaman katalog produk (keyset by id) dari cache. Mengembalikan (baris, next_cursor)."""
+    try:
+        catalogue = await catalogue_cache.get_or_load("products", _load_products)
+    except Exception as e:
+        print(f"Error saat memuat katalog produk: {e}")
+        return [], None
+    key = "all" if include_inactive else "active"
+    rows, ids = catalogue[key], catalogue[f"{key}_ids"]
+    start = bisect_right(ids, after) if after is not None else 0
+    return split_page(rows[start:start + limit + 1], limit)
+
+
+async def get_products_by_owner(user_id: int, is_active: Optional[bool] = None) -> List[Dict[str, Any]]:
+    """
+    Produk milik seorang staff: id produk dari product_users, lalu satu query
+    `fetch_products_by_ids` (filter is_active di database). Hasilnya di-cache per
+    (user, is_active) dan ikut terhapus saat katalog di-invalidate.
+    """
+    async def load() -> List[Dict[str, Any]]:
+        product_ids = await _load_owner_product_ids(user_id)
+        return await fetch_products_by_ids(product_ids, is_active=is_active)
+
+    try:
+        return await catalogue_cache.get_or_load(("products_by_owner", user_id, is_active), load)
+    except Exception as e:
+        print(f"Error saat memuat produk milik user {user_id}: {e}")
+        return []
+
+
+async def get_categories() -> List[Dict[str, Any]]:
+    try:
+        return await catalogue_cache.get_or_load("categories", _load_categories)
+    except Exception as e:
+        print(f"Error saat memuat kategori: {e}")
+        return []
+
+
+def select_fields(rows: List[Dict[str, Any]], fields: Optional[List[str]]) -> List[Dict[str, Any]]:
+    """Padanan `?fields=` untuk data dari cache: hanya kolom yang diminta yang diteruskan."""
+    if not fields:
+        return rows
+    return [{field: row[field] for field in fields if field in row} for row in rows]
+
+
+def invalidate_catalogue():
+    """Dipanggil setiap kali produk, kepemilikan produk, atau kategori berubah."""
+    catalogue_cache.invalidate()
+
+
+def get_catalogue_cache_stats() -> Dict[str, Any]:
+    return catalogue_cache.stats()
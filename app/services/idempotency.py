@@ -0,0 +1,320 @@
+import os
+import re
+import json
+import time
+import hashlib
+import sqlite3
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Pattern, Tuple
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+# Respons untuk request dengan header Idempotency-Key disimpan di SQLite lokal
+# (dipakai bersama oleh semua worker di host yang sama) selama IDEMPOTENCY_TTL_SECONDS.
+IDEMPOTENCY_DB_PATH: str = os.getenv("IDEMPOTENCY_DB_PATH", "idempotency.sqlite3")
+IDEMPOTENCY_TTL_SECONDS: float = float(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+# Request yang sedang diproses dianggap mati (worker crash) setelah lock ini habis.
+# Selama route masih berjalan lock diperpanjang setiap sepertiga durasinya, jadi
+# request lambat (timeout Supabase + retry Midtrans) tidak diambil alih duplikatnya.
+IDEMPOTENCY_LOCK_SECONDS: float = float(os.getenv("IDEMPOTENCY_LOCK_SECONDS", "120"))
+# Lama request duplikat menunggu request aslinya selesai sebelum dijawab 409
+IDEMPOTENCY_WAIT_SECONDS: float = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "30"))
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotency-Replayed"
+# Selain 2xx, hanya 4xx yang pasti sama untuk isi request yang sama yang disimpan.
+# 400/401/403/409 dll. bisa bergantung pada state (token, stok, status order),
+# jadi klaimnya dilepas dan request ulang diproses lagi.
+STORED_CLIENT_ERRORS = frozenset({422})
+
+# Endpoint yang membuat order / transaksi Midtrans
+IDEMPOTENT_ROUTES: List[Tuple[str, Pattern]] = [
+    ("POST", re.compile(r"^/orders/?$")),
+    ("POST", re.compile(r"^/orders/\d+/generate-snap$")),
+    ("POST", re.compile(r"^/payments/snap-token$")),
+]
+
+_SCHEMA = """
+create table if not exists idempotency_keys (
+    key text primary key,
+    fingerprint text not null,
+    status text not null default 'in_progress',
+    status_code integer,
+    headers text,
+    body blob,
+    locked_until real not null,
+    expires_at real not null,
+    created_at real not null
+);
+create index if not exists idempotency_keys_expires_at_idx on idempotency_keys (expires_at);
+"""
+
+
+class IdempotencyStore:
+    """
+    Menyimpan fingerprint request dan respons per idempotency key.
+
+    Status: in_progress -> done. Request pertama "mengklaim" key dengan insert;
+    request berikutnya dengan key yang sama mendapat respons yang tersimpan,
+    menunggu jika masih in_progress, atau ditolak jika isi request-nya berbeda.
+    """
+
+    def __init__(self, db_path: str = IDEMPOTENCY_DB_PATH, ttl: float = IDEMPOTENCY_TTL_SECONDS):
+        self.db_path = db_path
+        self.ttl = ttl
+        self._conn: Optional[sqlite3.Connection] = None
+        self._last_purge = 0.0
+        # Semua akses SQLite lewat satu thread khusus: busy_timeout saat worker lain
+        # memegang lock database tidak boleh menahan event loop.
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="idempotency")
+
+    async def run(self, func, *args):
+        """Menjalankan method store (begin/refresh/complete/release) di thread SQLite."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_path, isolation_level=None, check_same_thread=False)
+            self._conn.row_factory = sqlite3.Row
+            self._conn.execute("pragma journal_mode=wal")
+            self._conn.execute("pragma synchronous=normal")
+            self._conn.execute("pragma busy_timeout=5000")
+            self._conn.executescript(_SCHEMA)
+        return self._conn
+
+    def _purge_expired(self, now: float):
+        if now - self._last_purge > 600:
+            self.conn.execute("delete from idempotency_keys where expires_at < ?", (now,))
+            self._last_purge = now
+
+    def begin(self, key: str, fingerprint: str) -> Tuple[str, Optional[sqlite3.Row]]:
+        """
+        Mengembalikan salah satu dari:
+        ("new", None)          : request ini pemilik key, lanjutkan ke route
+        ("replay", row)        : respons sudah tersimpan
+        ("in_progress", row)   : request yang sama sedang diproses
+        ("mismatch", row)      : key sudah dipakai untuk request yang berbeda
+        """
+        now = time.time()
+        self._purge_expired(now)
+        self.conn.execute("delete from idempotency_keys where key = ? and expires_at < ?", (key, now))
+        try:
+            self.conn.execute(
+                "insert into idempotency_keys (key, fingerprint, locked_until, expires_at, created_at) values (?, ?, ?, ?, ?)",
+                (key, fingerprint, now + IDEMPOTENCY_LOCK_SECONDS, now + self.ttl, now),
+            )
+            return "new", None
+        except sqlite3.IntegrityError:
+            pass
+
+        row = self.conn.execute("select * from idempotency_keys where key = ?", (key,)).fetchone()
+        if row is None:
+            return self.begin(key, fingerprint)
+        if row["fingerprint"] != fingerprint:
+            return "mismatch", row
+        if row["status"] == "done":
+            return "replay", row
+        if row["locked_until"] < now:
+            # Pemilik sebelumnya tidak pernah selesai (crash); ambil alih
+            taken = self.conn.execute(
+                "update idempotency_keys set locked_until = ? where key = ? and status = 'in_progress' and locked_until < ?",
+                (now + IDEMPOTENCY_LOCK_SECONDS, key, now),
+            ).rowcount
+            if taken:
+                return "new", None
+        return "in_progress", row
+
+    def refresh(self, key: str):
+        """Memperpanjang lock request yang masih berjalan."""
+        self.conn.execute(
+            "update idempotency_keys set locked_until = ? where key = ? and status = 'in_progress'",
+            (time.time() + IDEMPOTENCY_LOCK_SECONDS, key),
+        )
+
+    def complete(self, key: str, status_code: int, headers: List[Tuple[bytes, bytes]], body: bytes):
+        stored_headers = json.dumps([[name.decode("latin-1"), value.decode("latin-1")] for name, value in headers])
+        self.conn.execute(
+            "update idempotency_keys set status = 'done', status_code = ?, headers = ?, body = ? where key = ?",
+            (status_code, stored_headers, body, key),
+        )
+
+    def release(self, key: str):
+        """Menghapus klaim agar request ulang bisa diproses (respons yang tidak disimpan)."""
+        self.conn.execute("delete from idempotency_keys where key = ? and status = 'in_progress'", (key,))
+
+
+def _is_storable(status_code: int) -> bool:
+    return 200 <= status_code < 300 or status_code in STORED_CLIENT_ERRORS
+
+
+def _request_fingerprint(scope: Scope, body: bytes) -> str:
+    digest = hashlib.sha256()
+    digest.update(scope["method"].encode())
+    digest.update(scope["path"].encode())
+    digest.update(scope.get("query_string", b""))
+    digest.update(body)
+    return digest.hexdigest()
+
+
+class IdempotencyMiddleware:
+    """
+    Untuk request ke IDEMPOTENT_ROUTES yang membawa header Idempotency-Key:
+    - request pertama diproses normal dan responsnya disimpan jika 2xx atau
+      4xx yang deterministik (STORED_CLIENT_ERRORS); selain itu klaim dilepas;
+    - request ulang dengan key dan isi yang sama mendapat respons tersimpan
+      (header Idempotency-Replayed: true) tanpa menyentuh route;
+    - duplikat yang datang saat request pertama masih berjalan menunggu
+      hasilnya, bukan ikut membuat order/transaksi baru;
+    - key yang sama dengan isi request berbeda ditolak dengan 422.
+    Key dipisahkan per header Authorization, jadi user berbeda tidak saling bentrok.
+    """
+
+    def __init__(self, app: ASGIApp, store: Optional[IdempotencyStore] = None, routes=IDEMPOTENT_ROUTES):
+        self.app = app
+        self.store = store or IdempotencyStore()
+        self.routes = routes
+        # Request yang sedang diproses di worker ini, agar duplikat lokal tidak perlu polling
+        self._inflight: Dict[str, asyncio.Event] = {}
+        self.metrics = {"stored": 0, "replayed": 0, "coalesced": 0, "conflicts": 0}
+        idempotency_middlewares.append(self)
+
+    def _matches(self, scope: Scope) -> bool:
+        return any(scope["method"] == method and pattern.match(scope["path"]) for method, pattern in self.routes)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not self._matches(scope):
+            await self.app(scope, receive, send)
+            return
+        headers = Headers(scope=scope)
+        idempotency_key = headers.get(IDEMPOTENCY_HEADER)
+        if not idempotency_key:
+            await self.app(scope, receive, send)
+            return
+        if len(idempotency_key) > 255:
+            await JSONResponse({"detail": "Idempotency-Key terlalu panjang."}, status_code=400)(scope, receive, send)
+            return
+
+        body = await self._read_body(receive)
+        owner = hashlib.sha256(headers.get("authorization", "").encode()).hexdigest()[:16]
+        key = f"{owner}:{idempotency_key}"
+        fingerprint = _request_fingerprint(scope, body)
+
+        deadline = time.monotonic() + IDEMPOTENCY_WAIT_SECONDS
+        waited = False
+        while True:
+            outcome, row = await self.store.run(self.store.begin, key, fingerprint)
+            if outcome == "new":
+                await self._run_and_store(key, scope, body, receive, send)
+                return
+            if outcome == "replay":
+                self.metrics["replayed"] += 1
+                if waited:
+                    self.metrics["coalesced"] += 1
+                await self._send_stored(row, send)
+                return
+            if outcome == "mismatch":
+                self.metrics["conflicts"] += 1
+                response = JSONResponse(
+                    {"detail": "Idempotency-Key sudah dipakai untuk request yang berbeda."}, status_code=422
+                )
+                await response(scope, receive, send)
+                return
+            if time.monotonic() >= deadline:
+                response = JSONResponse(
+                    {"detail": "Request dengan Idempotency-Key ini masih diproses."}, status_code=409
+                )
+                await response(scope, receive, send)
+                return
+            # in_progress: tunggu request asli selesai, lalu cek lagi
+            waited = True
+            event = self._inflight.get(key)
+            if event is not None:
+                try:
+                    await asyncio.wait_for(event.wait(), timeout=max(deadline - time.monotonic(), 0))
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                await asyncio.sleep(0.1)
+
+    @staticmethod
+    async def _read_body(receive: Receive) -> bytes:
+        chunks = []
+        while True:
+            message = await receive()
+            if message["type"] != "http.request":
+                break
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                break
+        return b"".join(chunks)
+
+    async def _run_and_store(self, key: str, scope: Scope, body: bytes, receive: Receive, send: Send):
+        event = self._inflight[key] = asyncio.Event()
+        body_sent = False
+        response_start: Optional[Message] = None
+        response_body = []
+        stored = False
+
+        async def replay_receive() -> Message:
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        async def capture_send(message: Message):
+            nonlocal response_start, stored
+            if message["type"] == "http.response.start":
+                response_start = message
+            elif message["type"] == "http.response.body":
+                response_body.append(message.get("body", b""))
+                if not message.get("more_body", False) and _is_storable(response_start["status"]):
+                    await self.store.run(
+                        self.store.complete, key, response_start["status"], response_start["headers"], b"".join(response_body)
+                    )
+                    self.metrics["stored"] += 1
+                    stored = True
+            await send(message)
+
+        async def heartbeat():
+            while True:
+                await asyncio.sleep(IDEMPOTENCY_LOCK_SECONDS / 3)
+                await self.store.run(self.store.refresh, key)
+
+        heartbeat_task = asyncio.create_task(heartbeat())
+        try:
+            await self.app(scope, replay_receive, capture_send)
+        finally:
+            heartbeat_task.cancel()
+            if not stored:
+                await self.store.run(self.store.release, key)
+            self._inflight.pop(key, None)
+            event.set()
+
+    @staticmethod
+    async def _send_stored(row: sqlite3.Row, send: Send):
+        headers = [(name.encode("latin-1"), value.encode("latin-1")) for name, value in json.loads(row["headers"])]
+        headers.append((REPLAYED_HEADER.lower().encode("latin-1"), b"true"))
+        await send({"type": "http.response.start", "status": row["status_code"], "headers": headers})
+        await send({"type": "http.response.body", "body": row["body"]})
+
+    def stats(self) -> Dict[str, int]:
+        return {**self.metrics, "inflight": len(self._inflight)}
+
+
+# Instance middleware yang dibuat Starlette (untuk /metrics)
+idempotency_middlewares: List[IdempotencyMiddleware] = []
+
+
+def get_idempotency_stats() -> Dict[str, int]:
+    totals: Dict[str, int] = {}
+    for middleware in idempotency_middlewares:
+        for name, value in middleware.stats().items():
+            totals[name] = totals.get(name, 0) + value
+    return totals
@@ -0,0 +1,117 @@
+import os
+import re
+import io
+import base64
+import asyncio
+import hashlib
+import binascii
+import logging
+from typing import Optional
+from PIL import Image, UnidentifiedImageError
+
+logger = logging.getLogger(__name__)
+
+# Gambar produk disimpan di disk dengan nama berdasarkan hash isinya (content-addressed),
+# sehingga upload yang sama tidak disimpan dua kali dan file tidak pernah berubah isi.
+IMAGE_STORAGE_PATH = os.getenv("IMAGE_STORAGE_PATH", "static/images/products")
+IMAGE_URL_PREFIX = "static/images/products"
+THUMBNAIL_MAX_SIZE = int(os.getenv("THUMBNAIL_MAX_SIZE", "320"))
+THUMBNAIL_QUALITY = int(os.getenv("THUMBNAIL_QUALITY", "80"))
+MAX_IMAGE_BYTES = int(os.getenv("MAX_IMAGE_BYTES", str(5 * 1024 * 1024)))
+
+_FORMAT_EXTENSIONS = {"JPEG": "jpg", "PNG": "png", "WEBP": "webp", "GIF": "gif"}
+_STORED_IMAGE_RE = re.compile(r"^[0-9a-f]{64}\.(jpg|png|webp|gif)$")
+_SERVABLE_IMAGE_RE = re.compile(r"^[0-9a-f]{64}(_thumb\.webp|\.(jpg|png|webp|gif))$")
+
+os.makedirs(IMAGE_STORAGE_PATH, exist_ok=True)
+
+
+class InvalidImageError(ValueError):
+    """Data gambar bukan base64 yang valid atau bukan format gambar yang didukung."""
+
+
+def is_stored_image(value: Optional[str]) -> bool:
+    """True jika value adalah nama file hasil `store_image` (bukan base64 lama)."""
+    return bool(value) and bool(_STORED_IMAGE_RE.match(value))
+
+
+def is_servable_image(filename: str) -> bool:
+    """True untuk gambar asli maupun thumbnail yang boleh diakses lewat URL publik."""
+    return bool(_SERVABLE_IMAGE_RE.match(filename))
+
+
+def image_reference(value: Optional[str]) -> Optional[str]:
+    """
+    Mengambil nama file gambar dari value yang dikirim client: bisa nama file
+    langsung atau URL lengkap yang sebelumnya dikembalikan oleh API.
+    """
+    if not value:
+        return None
+    filename = value.rsplit("/", 1)[-1]
+    return filename if is_stored_image(filename) else None
+
+
+def thumbnail_filename(filename: str) -> str:
+    return f"{filename.rsplit('.', 1)[0]}_thumb.webp"
+
+
+def image_path(filename: str) -> str:
+    return os.path.join(IMAGE_STORAGE_PATH, filename)
+
+
+def _decode_base64(data: str) -> bytes:
+    # Terima juga format data URI: "data:image/png;base64,...."
+    if data.startswith("data:") and "," in data:
+        data = data.split(",", 1)[1]
+    try:
+        raw = base64.b64decode(data, validate=False)
+    except (binascii.Error, ValueError) as e:
+        raise InvalidImageError("Gambar bukan base64 yang valid.") from e
+    if not raw:
+        raise InvalidImageError("Gambar kosong.")
+    if len(raw) > MAX_IMAGE_BYTES:
+        raise InvalidImageError(f"Ukuran gambar melebihi {MAX_IMAGE_BYTES // 1024} KB.")
+    return raw
+
+
+def _write_atomic(path: str, content: bytes):
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+def store_image(data: str) -> str:
+    """
+    Decode gambar base64 satu kali, simpan dengan nama `<sha256>.<ext>`, dan buat
+    thumbnail WebP `<sha256>_thumb.webp`. Mengembalikan nama file gambar asli.
+    Bersifat blocking (decode + resize), gunakan `store_image_async` dari handler async.
+    """
+    raw = _decode_base64(data)
+    try:
+        with Image.open(io.BytesIO(raw)) as image:
+            image_format = image.format
+            image.load()
+            extension = _FORMAT_EXTENSIONS.get(image_format)
+            if extension is None:
+                raise InvalidImageError(f"Format gambar {image_format} tidak didukung.")
+
+            filename = f"{hashlib.sha256(raw).hexdigest()}.{extension}"
+            if not os.path.exists(image_path(filename)):
+                _write_atomic(image_path(filename), raw)
+
+            thumb_path = image_path(thumbnail_filename(filename))
+            if not os.path.exists(thumb_path):
+                thumbnail = image.convert("RGBA" if image.mode in ("RGBA", "LA", "P") else "RGB")
+                thumbnail.thumbnail((THUMBNAIL_MAX_SIZE, THUMBNAIL_MAX_SIZE))
+                buffer = io.BytesIO()
+                thumbnail.save(buffer, format="WEBP", quality=THUMBNAIL_QUALITY)
+                _write_atomic(thumb_path, buffer.getvalue())
+    except (UnidentifiedImageError, OSError) as e:
+        raise InvalidImageError("Data bukan gambar yang valid.") from e
+
+    return filename
+
+
+async def store_image_async(data: str) -> str:
+    return await asyncio.to_thread(store_image, data)
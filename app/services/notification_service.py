@@ -1,6 +1,10 @@
+import time
+import asyncio
 import firebase_admin
 from firebase_admin import credentials, messaging
+from firebase_admin import exceptions as firebase_exceptions
 from ..config import supabase
+from .outbox import outbox
 import logging
 
 # Setup logging
@@ -19,90 +23,183 @@ except ValueError:
 except Exception as e:
     logger.error(f"Error saat inisialisasi Firebase: {e}")
 
-def send_order_confirmed_notification(user_id: int, order_id: int):
+async def send_order_confirmed_notification(user_id: int, order_id: int):
     """
     Mengirim notifikasi bahwa pesanan sudah dikonfirmasi dan siap bayar.
     """
     logger.info(f"Menyiapkan notifikasi 'pesanan dikonfirmasi' untuk user_id: {user_id} (order_id: {order_id})")
-    _send_notification_to_users(
+    await _enqueue_push(
         user_ids=[user_id],
         title='Pesanan Dikonfirmasi! ✅',
         body=f'Semua item untuk pesanan #{order_id} telah dikonfirmasi. Silakan lanjutkan ke pembayaran.',
         data={'order_id': str(order_id), 'type': 'order_confirmed'}
     )
 
-def send_order_updated_notification(user_id: int, order_id: int):
+async def send_order_updated_notification(user_id: int, order_id: int):
     """
     Mengirim notifikasi bahwa ada update (penolakan item) pada pesanan.
     """
     logger.info(f"Menyiapkan notifikasi 'pesanan diperbarui' untuk user_id: {user_id} (order_id: {order_id})")
-    _send_notification_to_users(
+    await _enqueue_push(
         user_ids=[user_id],
         title='Ada Pembaruan Pada Pesananmu 📝',
         body=f'Beberapa item untuk pesanan #{order_id} tidak tersedia. Silakan cek detail pesanan untuk melanjutkan.',
         data={'order_id': str(order_id), 'type': 'order_updated'}
     )
 
-def _send_notification_to_users(user_ids: list[int], title: str, body: str, data: dict = None):
+# Batas token per panggilan send_each_for_multicast dari FCM
+FCM_BATCH_SIZE = 500
+
+# Error FCM yang menandakan token sudah tidak valid dan boleh dihapus
+_INVALID_TOKEN_ERRORS = (
+    messaging.UnregisteredError,
+    messaging.SenderIdMismatchError,
+    firebase_exceptions.InvalidArgumentError,
+)
+
+_stats = {
+    "jobs_sent": 0,
+    "batches_sent": 0,
+    "messages_success": 0,
+    "messages_failed": 0,
+    "invalid_tokens_removed": 0,
+    "last_batch_latency_ms": None,
+    "total_batch_latency_ms": 0.0,
+}
+
+
+def _chunks(items: list, size: int):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _send_batch(tokens: list[str], title: str, body: str, data: dict = None) -> list[str]:
+    """
+    Mengirim satu batch (maks. FCM_BATCH_SIZE token) via send_each_for_multicast.
+    Mengembalikan daftar token yang tidak valid.
+    """
+    message = messaging.MulticastMessage(
+        notification=messaging.Notification(title=title, body=body),
+        data=data,
+        tokens=tokens,
+    )
+    started = time.perf_counter()
+    response = messaging.send_each_for_multicast(message)
+    latency_ms = (time.perf_counter() - started) * 1000
+
+    _stats["batches_sent"] += 1
+    _stats["messages_success"] += response.success_count
+    _stats["messages_failed"] += response.failure_count
+    _stats["last_batch_latency_ms"] = round(latency_ms, 2)
+    _stats["total_batch_latency_ms"] += latency_ms
+    logger.info(
+        f"Batch FCM {len(tokens)} token: {response.success_count} sukses, "
+        f"{response.failure_count} gagal, {latency_ms:.1f} ms"
+    )
+
+    invalid_tokens = []
+    for token, result in zip(tokens, response.responses):
+        if result.success:
+            continue
+        logger.error(f"Gagal mengirim ke token {token[:10]}...: {result.exception}")
+        if isinstance(result.exception, _INVALID_TOKEN_ERRORS):
+            invalid_tokens.append(token)
+    return invalid_tokens
+
+
+def _remove_invalid_tokens(invalid_tokens: list[str]):
+    """Hapus semua token tidak valid dalam satu query. Gagal di sini tidak menggagalkan job."""
+    if not invalid_tokens:
+        return
+    logger.warning(f"Menghapus {len(invalid_tokens)} token yang tidak valid.")
+    try:
+        supabase.table("fcm_tokens").delete().in_("token", invalid_tokens).execute()
+        _stats["invalid_tokens_removed"] += len(invalid_tokens)
+    except Exception as e:
+        logger.error(f"Gagal menghapus token FCM tidak valid: {e}")
+
+
+def _send_notification_to_users(user_ids: list[int], title: str, body: str, data: dict = None, job: dict = None):
     """
     Fungsi generik untuk mengirim notifikasi ke daftar user ID.
     Ini adalah fungsi inti yang akan digunakan oleh fungsi notifikasi lainnya.
+    Bersifat blocking (HTTP ke Supabase dan FCM), jadi dijalankan oleh
+    worker outbox di thread terpisah, bukan di request handler. Error dilempar
+    ulang agar outbox bisa mencoba lagi dengan backoff.
+
+    `job` adalah payload outbox: token yang belum terkirim disimpan di
+    job["pending_tokens"] setelah setiap batch, jadi percobaan ulang hanya
+    mengirim batch yang gagal dan sesudahnya, bukan mengulang yang sudah sukses.
     """
     if not user_ids:
         logger.info("Tidak ada user ID, notifikasi dilewati.")
         return
+    job = job if job is not None else {}
 
+    invalid_tokens = []
     try:
-        response = supabase.table("fcm_tokens").select("token").in_("user_id", user_ids).execute()
-        
-        if not response.data:
-            logger.warning(f"Tidak ada token FCM untuk user_ids: {user_ids}")
-            return
-
-        registration_tokens = [item['token'] for item in response.data]
-        if not registration_tokens:
-            return
-        
-        logger.info(f"Ditemukan {len(registration_tokens)} token FCM untuk user_ids: {user_ids}")
-
-        # ========================================================================
-        # PERBAIKAN: Mengganti send_multicast dengan loop send() satu per satu
-        # Ini untuk kompatibilitas dengan library firebase-admin versi lama.
-        # ========================================================================
-        success_count = 0
-        failed_tokens = []
-
-        for token in registration_tokens:
-            try:
-                message = messaging.Message(
-                    notification=messaging.Notification(title=title, body=body),
-                    data=data,
-                    token=token,
-                )
-                messaging.send(message)
-                success_count += 1
-            except Exception as e:
-                # Jika token tidak valid, Firebase akan memberikan error.
-                # Kita kumpulkan token yang gagal ini.
-                logger.error(f"Gagal mengirim ke token {token[:10]}...: {e}")
-                failed_tokens.append(token)
-        
-        logger.info(f'Berhasil mengirim notifikasi ke {success_count} perangkat untuk users {user_ids}.')
-
-        if failed_tokens:
-            logger.warning(f"Menghapus {len(failed_tokens)} token yang tidak valid.")
-            supabase.table("fcm_tokens").delete().in_("token", failed_tokens).execute()
+        if "pending_tokens" in job:
+            registration_tokens = job["pending_tokens"]
+        else:
+            response = supabase.table("fcm_tokens").select("token").in_("user_id", user_ids).execute()
+
+            if not response.data:
+                logger.warning(f"Tidak ada token FCM untuk user_ids: {user_ids}")
+                return
+
+            registration_tokens = sorted({item['token'] for item in response.data})
+            logger.info(f"Ditemukan {len(registration_tokens)} token FCM untuk user_ids: {user_ids}")
+            job["pending_tokens"] = registration_tokens
+
+        for batch in list(_chunks(registration_tokens, FCM_BATCH_SIZE)):
+            invalid_tokens.extend(_send_batch(batch, title, body, data))
+            job["pending_tokens"] = job["pending_tokens"][len(batch):]
+        _stats["jobs_sent"] += 1
 
     except Exception as e:
         logger.error(f"Error saat mengirim notifikasi ke users {user_ids}: {e}")
+        raise
+    finally:
+        _remove_invalid_tokens(invalid_tokens)
+
+
+async def _handle_push(payload: dict):
+    """
+    Handler outbox untuk pesan push; dijalankan di thread karena SDK FCM blocking.
+    Progres batch dicatat di `payload`, yang disimpan outbox saat handler gagal.
+    """
+    await asyncio.to_thread(
+        _send_notification_to_users,
+        payload["user_ids"], payload["title"], payload["body"], payload.get("data"), payload,
+    )
+
+
+outbox.register_handler("push", _handle_push)
+
+
+async def _enqueue_push(user_ids: list[int], title: str, body: str, data: dict = None):
+    """Memasukkan notifikasi push ke outbox; pengiriman dilakukan oleh worker outbox."""
+    if not user_ids:
+        logger.info("Tidak ada user ID, notifikasi dilewati.")
+        return
+    await outbox.enqueue("push", {"user_ids": user_ids, "title": title, "body": body, "data": data})
+
+
+def get_notification_stats() -> dict:
+    batches = _stats["batches_sent"]
+    return {
+        **_stats,
+        "total_batch_latency_ms": round(_stats["total_batch_latency_ms"], 2),
+        "avg_batch_latency_ms": round(_stats["total_batch_latency_ms"] / batches, 2) if batches else None,
+    }
 
 
-def send_order_ready_notification(user_id: int, order_id: int):
+async def send_order_ready_notification(user_id: int, order_id: int):
     """
     Mengirim notifikasi "Pesanan Siap" ke seorang pengguna.
     """
     logger.info(f"Menyiapkan notifikasi 'pesanan siap' untuk user_id: {user_id} (order_id: {order_id})")
-    _send_notification_to_users(
+    await _enqueue_push(
         user_ids=[user_id],
         title='Pesananmu Sudah Siap! 🍜',
         # Perbarui body notifikasi agar lebih informatif
@@ -112,7 +209,7 @@ def send_order_ready_notification(user_id: int, order_id: int):
     )
 
 
-def send_new_order_notification_to_staff(staff_ids: list[int], order_id: int):
+async def send_new_order_notification_to_staff(staff_ids: list[int], order_id: int):
     """
     Mengirim notifikasi "Pesanan Baru" ke daftar staff.
     """
@@ -120,7 +217,7 @@ def send_new_order_notification_to_staff(staff_ids: list[int], order_id: int):
         return
     
     logger.info(f"Menyiapkan notifikasi 'pesanan baru' untuk staff_ids: {staff_ids} (order_id: {order_id})")
-    _send_notification_to_users(
+    await _enqueue_push(
         user_ids=staff_ids,
         title='Pesanan Baru Masuk! 🛎️',
         body=f'Ada pesanan baru (ID: {order_id}) yang perlu disiapkan. Segera cek inbox Anda.',
@@ -128,12 +225,12 @@ def send_new_order_notification_to_staff(staff_ids: list[int], order_id: int):
     )
 
 
-def send_custom_notification(user_id: int, title: str, body: str, data: dict = None):
+async def send_custom_notification(user_id: int, title: str, body: str, data: dict = None):
     """
     Mengirim notifikasi custom ke seorang pengguna.
     """
     logger.info(f"Menyiapkan notifikasi custom untuk user_id: {user_id}")
-    _send_notification_to_users(
+    await _enqueue_push(
         user_ids=[user_id],
         title=title,
         body=body,
@@ -0,0 +1,109 @@
+from typing import Any, Dict, Iterable, List, Optional
+from ..config import async_supabase
+
+# State machine status order. Setiap perubahan status dilakukan dengan satu
+# UPDATE bersyarat (compare-and-set): `... where id = ? and status in (<asal>)`
+# yang langsung mengembalikan baris baru. Jika dua request bersamaan mencoba
+# transisi yang sama, hanya satu yang mendapat baris; yang lain mendapat None
+# dan tidak mengirim notifikasi ganda.
+#
+#   pending                -> paid | cancelled              (checkout snap-token)
+#   awaiting_confirmation  -> awaiting_payment | cancelled  (konfirmasi staff)
+#   awaiting_payment       -> paid | cancelled
+#   paid                   -> cooking | ready_for_pickup | completed
+#   cooking                -> ready_for_pickup | completed
+#   ready_for_pickup       -> completed
+TRANSITIONS: Dict[str, frozenset] = {
+    "pending": frozenset({"paid", "cancelled"}),
+    "awaiting_confirmation": frozenset({"awaiting_payment", "cancelled"}),
+    "awaiting_payment": frozenset({"paid", "cancelled"}),
+    "paid": frozenset({"cooking", "ready_for_pickup", "completed"}),
+    "cooking": frozenset({"ready_for_pickup", "completed"}),
+    "ready_for_pickup": frozenset({"completed"}),
+    "completed": frozenset(),
+    "cancelled": frozenset(),
+}
+
+ORDER_STATUSES = frozenset(TRANSITIONS)
+
+# Status yang boleh diminta pemesan sendiri lewat PUT /orders/{id};
+# status lain hanya berubah lewat staff atau callback pembayaran.
+CUSTOMER_TARGETS = frozenset({"cancelled"})
+
+
+class InvalidTransitionError(ValueError):
+    """Transisi yang diminta tidak ada di TRANSITIONS."""
+
+
+def can_transition(current: str, target: str) -> bool:
+    return target in TRANSITIONS.get(current, ())
+
+
+def sources_for(target: str) -> List[str]:
+    """Semua status yang boleh berpindah ke `target`."""
+    if target not in ORDER_STATUSES:
+        raise InvalidTransitionError(f"Status order tidak dikenal: '{target}'")
+    return sorted(source for source, targets in TRANSITIONS.items() if target in targets)
+
+
+async def transition_order(
+    order_id: int,
+    target: str,
+    expected: Optional[Iterable[str]] = None,
+    extra: Optional[Dict[str, Any]] = None,
+) -> Optional[Dict[str, Any]]:
+    """
+    Memindahkan order ke `target` jika statusnya saat ini ada di `expected`
+    (default: semua status asal yang sah untuk `target`), sekaligus mengubah
+    kolom `extra`. Mengembalikan baris order yang baru, atau None jika order
+    tidak ada atau statusnya sudah berubah.
+    """
+    sources = sources_for(target)
+    if expected is not None:
+        expected = list(expected)
+        invalid = [source for source in expected if source not in sources]
+        if invalid:
+            raise InvalidTransitionError(f"Transisi {invalid} -> '{target}' tidak diizinkan")
+        sources = expected
+
+    update_data = {**(extra or {}), "status": target}
+    result = await async_supabase.table("orders")\
+        .update(update_data)\
+        .eq("id", order_id)\
+        .in_("status", sources)\
+        .execute()
+    return result.data[0] if result.data else None
+
+
+def derive_fulfilment_status(counts: Dict[str, int]) -> Optional[str]:
+    """
+    Status order dari jumlah item per status (kolom orders.item_status_counts,
+    dijaga trigger di order_items), tanpa membaca item satu per satu:
+    semua completed -> completed; semua ready_for_pickup/completed -> ready_for_pickup;
+    semua cooking/ready_for_pickup/completed -> cooking; selain itu None.
+    """
+    total = sum(counts.values())
+    if not total:
+        return None
+    completed = counts.get("completed", 0)
+    ready = completed + counts.get("ready_for_pickup", 0)
+    cooking = ready + counts.get("cooking", 0)
+    if completed == total:
+        return "completed"
+    if ready == total:
+        return "ready_for_pickup"
+    if cooking == total:
+        return "cooking"
+    return None
+
+
+async def get_item_status_counts(order_id: int) -> Optional[Dict[str, int]]:
+    """Jumlah item per status untuk satu order (satu baris), None jika order tidak ada."""
+    result = await async_supabase.table("orders").select("item_status_counts").eq("id", order_id).limit(1).execute()
+    return (result.data[0]["item_status_counts"] or {}) if result.data else None
+
+
+async def get_order_status(order_id: int) -> Optional[str]:
+    """Status order saat ini; dipakai untuk menjelaskan transisi yang gagal."""
+    result = await async_supabase.table("orders").select("status").eq("id", order_id).limit(1).execute()
+    return result.data[0]["status"] if result.data else None
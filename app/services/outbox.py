@@ -0,0 +1,236 @@
+import os
+import json
+import time
+import random
+import sqlite3
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Outbox disimpan di file SQLite lokal supaya pesan tidak hilang saat proses crash.
+OUTBOX_DB_PATH: str = os.getenv("OUTBOX_DB_PATH", "outbox.sqlite3")
+OUTBOX_CONCURRENCY: int = int(os.getenv("OUTBOX_CONCURRENCY", "4"))
+OUTBOX_MAX_ATTEMPTS: int = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_BASE_BACKOFF: float = float(os.getenv("OUTBOX_BASE_BACKOFF", "1.0"))
+OUTBOX_MAX_BACKOFF: float = float(os.getenv("OUTBOX_MAX_BACKOFF", "300"))
+OUTBOX_POLL_INTERVAL: float = float(os.getenv("OUTBOX_POLL_INTERVAL", "1.0"))
+# Lama "lease" sebuah pesan yang sedang diproses. Jika worker mati di tengah jalan,
+# pesan otomatis bisa diambil lagi setelah lease habis.
+OUTBOX_LEASE_SECONDS: float = float(os.getenv("OUTBOX_LEASE_SECONDS", "60"))
+# Pesan yang sudah terkirim disimpan sebentar untuk keperluan inspeksi
+OUTBOX_RETENTION_SECONDS: float = float(os.getenv("OUTBOX_RETENTION_SECONDS", "86400"))
+
+Handler = Callable[[Dict[str, Any]], Awaitable[None]]
+
+_SCHEMA = """
+create table if not exists outbox (
+    id integer primary key autoincrement,
+    kind text not null,
+    payload text not null,
+    status text not null default 'pending',
+    attempts integer not null default 0,
+    next_attempt_at real not null,
+    last_error text,
+    created_at real not null,
+    updated_at real not null
+);
+create index if not exists outbox_status_next_attempt_idx on outbox (status, next_attempt_at);
+"""
+
+
+class Outbox:
+    """
+    Antrian notifikasi yang tahan crash (pola transactional outbox).
+
+    Route cukup memanggil `await enqueue()` setelah perubahan di database berhasil,
+    lalu langsung mengembalikan respons. Worker di background mengambil pesan,
+    menjalankan handler sesuai `kind` dengan batas konkurensi, mengulang dengan
+    exponential backoff jika gagal, dan memindahkan pesan ke status 'dead'
+    setelah OUTBOX_MAX_ATTEMPTS percobaan.
+
+    Status pesan: pending -> processing -> done | pending (retry) | dead
+
+    Semua akses SQLite berjalan di satu thread khusus (lihat `_db`), jadi
+    busy_timeout saat worker lain memegang lock tidak menahan event loop.
+    """
+
+    def __init__(
+        self,
+        db_path: str = OUTBOX_DB_PATH,
+        concurrency: int = OUTBOX_CONCURRENCY,
+        max_attempts: int = OUTBOX_MAX_ATTEMPTS,
+    ):
+        self.db_path = db_path
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self._handlers: Dict[str, Handler] = {}
+        self._conn: Optional[sqlite3.Connection] = None
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._inflight: set = set()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="outbox-db")
+
+    # --- Penyimpanan -------------------------------------------------------
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_path, isolation_level=None, check_same_thread=False)
+            self._conn.row_factory = sqlite3.Row
+            self._conn.execute("pragma journal_mode=wal")
+            self._conn.execute("pragma synchronous=normal")
+            self._conn.execute("pragma busy_timeout=5000")
+            self._conn.executescript(_SCHEMA)
+        return self._conn
+
+    async def _db(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    def _insert(self, kind: str, payload: str) -> int:
+        now = time.time()
+        cursor = self.conn.execute(
+            "insert into outbox (kind, payload, next_attempt_at, created_at, updated_at) values (?, ?, ?, ?, ?)",
+            (kind, payload, now, now, now),
+        )
+        return cursor.lastrowid
+
+    async def enqueue(self, kind: str, payload: Dict[str, Any]) -> int:
+        """Menyimpan pesan baru ke outbox dan membangunkan worker."""
+        message_id = await self._db(self._insert, kind, json.dumps(payload))
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return message_id
+
+    def _claim(self, limit: int) -> List[sqlite3.Row]:
+        now = time.time()
+        return self.conn.execute(
+            """
+            update outbox
+               set status = 'processing', attempts = attempts + 1,
+                   next_attempt_at = ?, updated_at = ?
+             where id in (
+                select id from outbox
+                 where status in ('pending', 'processing') and next_attempt_at <= ?
+                 order by id
+                 limit ?
+             )
+            returning id, kind, payload, attempts
+            """,
+            (now + OUTBOX_LEASE_SECONDS, now, now, limit),
+        ).fetchall()
+
+    def _mark_done(self, message_id: int):
+        self.conn.execute(
+            "update outbox set status = 'done', last_error = null, updated_at = ? where id = ?",
+            (time.time(), message_id),
+        )
+
+    def _mark_failed(self, message_id: int, attempts: int, error: str, payload: str):
+        now = time.time()
+        if attempts >= self.max_attempts:
+            logger.error(f"Outbox #{message_id} dipindahkan ke dead-letter setelah {attempts} percobaan: {error}")
+            self.conn.execute(
+                "update outbox set status = 'dead', payload = ?, last_error = ?, updated_at = ? where id = ?",
+                (payload, error, now, message_id),
+            )
+            return
+        delay = min(OUTBOX_BASE_BACKOFF * (2 ** (attempts - 1)), OUTBOX_MAX_BACKOFF)
+        delay *= random.uniform(0.8, 1.2)
+        logger.warning(f"Outbox #{message_id} gagal (percobaan {attempts}), dicoba lagi dalam {delay:.1f} detik: {error}")
+        self.conn.execute(
+            "update outbox set status = 'pending', payload = ?, next_attempt_at = ?, last_error = ?, updated_at = ? where id = ?",
+            (payload, now + delay, error, now, message_id),
+        )
+
+    def _purge_done(self):
+        self.conn.execute(
+            "delete from outbox where status = 'done' and updated_at < ?",
+            (time.time() - OUTBOX_RETENTION_SECONDS,),
+        )
+
+    # --- Worker ------------------------------------------------------------
+
+    def register_handler(self, kind: str, handler: Handler):
+        self._handlers[kind] = handler
+
+    async def _process(self, row: sqlite3.Row):
+        # Handler boleh mengubah payload (mis. mencatat progres) sebelum gagal;
+        # payload itu yang disimpan dan dipakai pada percobaan berikutnya.
+        handler = self._handlers.get(row["kind"])
+        payload = json.loads(row["payload"])
+        try:
+            if handler is None:
+                raise RuntimeError(f"Tidak ada handler untuk kind '{row['kind']}'")
+            await handler(payload)
+        except Exception as e:
+            await self._db(self._mark_failed, row["id"], row["attempts"], str(e), json.dumps(payload))
+        else:
+            await self._db(self._mark_done, row["id"])
+
+    async def _run(self):
+        last_purge = 0.0
+        while True:
+            try:
+                if time.time() - last_purge > 3600:
+                    await self._db(self._purge_done)
+                    last_purge = time.time()
+
+                available = self.concurrency - len(self._inflight)
+                rows = await self._db(self._claim, available) if available > 0 else []
+                for row in rows:
+                    task = asyncio.create_task(self._process(row))
+                    self._inflight.add(task)
+                    task.add_done_callback(self._inflight.discard)
+
+                if rows and len(self._inflight) < self.concurrency:
+                    continue
+
+                self._wakeup.clear()
+                waiters = [asyncio.create_task(self._wakeup.wait()), *self._inflight]
+                await asyncio.wait(waiters, timeout=OUTBOX_POLL_INTERVAL, return_when=asyncio.FIRST_COMPLETED)
+                waiters[0].cancel()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error di worker outbox: {e}")
+                await asyncio.sleep(OUTBOX_POLL_INTERVAL)
+
+    async def start(self):
+        if self._task is not None:
+            return
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"Outbox worker berjalan ({self.db_path}, konkurensi {self.concurrency})")
+
+    async def stop(self, timeout: float = 10):
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        if self._inflight:
+            # Beri kesempatan pesan yang sedang dikirim untuk selesai
+            await asyncio.wait(list(self._inflight), timeout=timeout)
+
+    def _count_by_status(self) -> Dict[str, int]:
+        return {
+            row["status"]: row["total"]
+            for row in self.conn.execute("select status, count(*) as total from outbox group by status")
+        }
+
+    async def stats(self) -> Dict[str, Any]:
+        counts = await self._db(self._count_by_status)
+        return {
+            "pending": counts.get("pending", 0),
+            "processing": counts.get("processing", 0),
+            "done": counts.get("done", 0),
+            "dead": counts.get("dead", 0),
+            "inflight": len(self._inflight),
+        }
+
+
+outbox = Outbox()
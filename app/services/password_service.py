@@ -0,0 +1,48 @@
+import os
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+from passlib.context import CryptContext
+
+logger = logging.getLogger(__name__)
+
+# Cost bcrypt bisa diatur lewat env. Hash lama dengan cost berbeda akan
+# dianggap "needs_update" dan di-rehash otomatis saat login berhasil.
+BCRYPT_ROUNDS: int = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+# Jumlah thread khusus untuk bcrypt. Dibatasi supaya lonjakan login tidak
+# menghabiskan threadpool default Starlette yang dipakai endpoint lain.
+PASSWORD_HASH_WORKERS: int = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+
+
+async def _run_in_pool(func, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, func, *args)
+
+
+async def hash_password(password: str) -> str:
+    """Membuat hash bcrypt di worker pool tanpa memblokir event loop."""
+    return await _run_in_pool(pwd_context.hash, password)
+
+
+async def verify_and_update(password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """
+    Memverifikasi password dan, jika hash memakai parameter lama (lihat `needs_update`),
+    mengembalikan hash baru yang perlu disimpan. Hasil: (valid, hash_baru_atau_None).
+    """
+    try:
+        return await _run_in_pool(pwd_context.verify_and_update, password, hashed_password)
+    except ValueError:
+        # Hash di database tidak dikenali oleh passlib
+        logger.warning("Format hash password tidak dikenali.")
+        return False, None
+
+
+def shutdown_password_pool():
+    """Menghentikan worker pool saat aplikasi shutdown."""
+    _executor.shutdown(wait=False)
@@ -0,0 +1,302 @@
+import os
+import re
+import json
+import uuid
+import base64
+import asyncio
+import hmac
+import hashlib
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import httpx
+from ..config import async_supabase
+from ..crud import hitung_harga_jual
+from .cache import TTLCache
+from .outbox import outbox
+
+logger = logging.getLogger(__name__)
+
+# Client Midtrans Snap untuk semua route (checkout keranjang dan generate-snap).
+# Memakai satu httpx.AsyncClient dengan koneksi keep-alive, bukan midtransclient
+# yang membuat koneksi baru dan memblokir event loop di setiap panggilan.
+MIDTRANS_SERVER_KEY: Optional[str] = os.getenv("MIDTRANS_SERVER_KEY")
+MIDTRANS_IS_PRODUCTION: bool = os.getenv("MIDTRANS_IS_PRODUCTION", "false").lower() == "true"
+MIDTRANS_SNAP_URL: str = os.getenv(
+    "MIDTRANS_SNAP_URL",
+    "https://app.midtrans.com/snap/v1/transactions" if MIDTRANS_IS_PRODUCTION
+    else "https://app.sandbox.midtrans.com/snap/v1/transactions",
+)
+MIDTRANS_TIMEOUT_SECONDS: float = float(os.getenv("MIDTRANS_TIMEOUT_SECONDS", "10"))
+MIDTRANS_CONNECT_TIMEOUT_SECONDS: float = float(os.getenv("MIDTRANS_CONNECT_TIMEOUT_SECONDS", "3"))
+MIDTRANS_MAX_RETRIES: int = int(os.getenv("MIDTRANS_MAX_RETRIES", "2"))
+MIDTRANS_POOL_SIZE: int = int(os.getenv("MIDTRANS_POOL_SIZE", "10"))
+# Snap token berlaku 24 jam; generate-snap berulang untuk order yang tidak berubah
+# memakai transaksi yang sama selama SNAP_CACHE_TTL detik.
+SNAP_CACHE_TTL: float = float(os.getenv("SNAP_CACHE_TTL", "900"))
+# Link Snap yang disimpan di order dipakai ulang selama ini (Snap default kedaluwarsa 24 jam)
+SNAP_LINK_TTL_SECONDS: float = float(os.getenv("SNAP_LINK_TTL_SECONDS", str(23 * 3600)))
+# Buat link Snap di background segera setelah order QRIS dikonfirmasi staff,
+# bukan menunggu customer membuka generate-snap
+SNAP_PREWARM: bool = os.getenv("SNAP_PREWARM", "false").lower() == "true"
+
+# Biaya layanan QRIS yang dibebankan ke pembeli
+FEE_QRIS = 0.7
+BIAYA_TETAP = 500
+PPN_PERSEN = 11
+
+ENABLED_PAYMENTS = ["gopay"]
+
+# Status yang aman untuk diulang: Midtrans menolak sebelum memproses request.
+# 502/504 tidak diulang karena bisa dikirim setelah transaksi sudah dibuat;
+# mengulang POST akan membuat transaksi kedua untuk order yang sama.
+_RETRY_STATUS = {429, 503}
+
+
+class PaymentGatewayError(Exception):
+    """Gagal membuat transaksi di Midtrans (timeout, error jaringan, atau respons non-2xx)."""
+
+
+class EmptyOrderError(PaymentGatewayError):
+    """Order tidak punya item yang bisa ditagihkan."""
+
+
+def build_item_details(lines: Iterable[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Menyusun item_details Midtrans dari baris pesanan dan menambahkan biaya layanan.
+    Setiap baris berisi product_id, nama_produk, harga, jumlah.
+    Mengembalikan (item_details, gross_amount).
+    """
+    item_details = []
+    subtotal_harga_awal = 0
+    for line in lines:
+        harga_awal = int(line["harga"])
+        jumlah = int(line["jumlah"])
+        item_details.append({
+            "id": str(line["product_id"]),
+            "price": harga_awal,
+            "quantity": jumlah,
+            "name": line["nama_produk"],
+        })
+        subtotal_harga_awal += harga_awal * jumlah
+
+    harga_jual_akhir = hitung_harga_jual(subtotal_harga_awal, BIAYA_TETAP, FEE_QRIS, PPN_PERSEN)
+    biaya_layanan = harga_jual_akhir - subtotal_harga_awal
+    if biaya_layanan > 0:
+        item_details.append({"id": "SERVICE_FEE", "price": biaya_layanan, "quantity": 1, "name": "Biaya Layanan & Pajak"})
+    return item_details, harga_jual_akhir
+
+
+class SnapClient:
+    def __init__(self, snap_url: str = MIDTRANS_SNAP_URL, server_key: Optional[str] = MIDTRANS_SERVER_KEY):
+        self.snap_url = snap_url
+        self.server_key = server_key
+        self._client: Optional[httpx.AsyncClient] = None
+        self._cache = TTLCache(ttl=SNAP_CACHE_TTL, max_entries=1024)
+        self.metrics = {"transactions_created": 0, "retries": 0, "errors": 0}
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            auth = base64.b64encode(f"{self.server_key or ''}:".encode()).decode()
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(MIDTRANS_TIMEOUT_SECONDS, connect=MIDTRANS_CONNECT_TIMEOUT_SECONDS),
+                limits=httpx.Limits(max_connections=MIDTRANS_POOL_SIZE, max_keepalive_connections=MIDTRANS_POOL_SIZE),
+                headers={
+                    "Accept": "application/json",
+                    "Content-Type": "application/json",
+                    "Authorization": f"Basic {auth}",
+                },
+            )
+        return self._client
+
+    async def _post_transaction(self, param: Dict[str, Any]) -> Dict[str, Any]:
+        for attempt in range(MIDTRANS_MAX_RETRIES + 1):
+            try:
+                response = await self.client.post(self.snap_url, json=param)
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout) as e:
+                # Request belum sampai ke Midtrans, aman diulang
+                if attempt < MIDTRANS_MAX_RETRIES:
+                    self.metrics["retries"] += 1
+                    await asyncio.sleep(0.2 * 2 ** attempt)
+                    continue
+                self.metrics["errors"] += 1
+                raise PaymentGatewayError(f"Tidak dapat terhubung ke Midtrans: {e}") from e
+            except httpx.HTTPError as e:
+                self.metrics["errors"] += 1
+                raise PaymentGatewayError(f"Request ke Midtrans gagal: {e}") from e
+
+            if response.status_code in _RETRY_STATUS and attempt < MIDTRANS_MAX_RETRIES:
+                self.metrics["retries"] += 1
+                await asyncio.sleep(0.2 * 2 ** attempt)
+                continue
+            if response.status_code >= 300:
+                self.metrics["errors"] += 1
+                try:
+                    messages = response.json().get("error_messages")
+                except ValueError:
+                    messages = response.text
+                raise PaymentGatewayError(f"Midtrans {response.status_code}: {messages}")
+            self.metrics["transactions_created"] += 1
+            return response.json()
+
+    async def create_transaction(
+        self,
+        order_id: int,
+        item_details: List[Dict[str, Any]],
+        gross_amount: int,
+        customer: Dict[str, Any],
+    ) -> Dict[str, Any]:
+        """
+        Membuat transaksi Snap untuk order; mengembalikan {"token", "redirect_url"}.
+        Panggilan dengan isi order yang sama dalam SNAP_CACHE_TTL (termasuk yang
+        bersamaan) memakai transaksi yang sama.
+        """
+        customer_details = {
+            "first_name": customer.get("nama_pengguna") or "Customer",
+            "phone": customer.get("nomor_telepon") or "",
+        }
+        fingerprint = hashlib.sha256(
+            json.dumps([item_details, gross_amount, customer_details], sort_keys=True).encode()
+        ).hexdigest()
+
+        async def load() -> Dict[str, Any]:
+            # order_id Midtrans harus unik per transaksi
+            param = {
+                "transaction_details": {
+                    "order_id": f"{order_id}-{uuid.uuid4().hex[:6]}",
+                    "gross_amount": gross_amount,
+                },
+                "item_details": item_details,
+                "enabled_payments": ENABLED_PAYMENTS,
+                "customer_details": customer_details,
+            }
+            transaction = await self._post_transaction(param)
+            return {"token": transaction.get("token"), "redirect_url": transaction.get("redirect_url")}
+
+        return await self._cache.get_or_load((order_id, fingerprint), load)
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.metrics, "cache": self._cache.stats()}
+
+
+snap_client = SnapClient()
+
+
+async def create_snap_transaction(
+    order_id: int,
+    item_details: List[Dict[str, Any]],
+    gross_amount: int,
+    customer: Dict[str, Any],
+) -> Dict[str, Any]:
+    return await snap_client.create_transaction(order_id, item_details, gross_amount, customer)
+
+
+def verify_notification_signature(notification: Dict[str, Any], server_key: Optional[str] = MIDTRANS_SERVER_KEY) -> bool:
+    """
+    Memeriksa signature_key notifikasi Midtrans:
+    sha512(order_id + status_code + gross_amount + server_key).
+    """
+    signature = notification.get("signature_key")
+    if not server_key or not isinstance(signature, str):
+        return False
+    payload = f"{notification.get('order_id')}{notification.get('status_code')}{notification.get('gross_amount')}{server_key}"
+    expected = hashlib.sha512(payload.encode()).hexdigest()
+    return hmac.compare_digest(expected, signature)
+
+
+def _parse_timestamptz(value: str) -> Optional[datetime]:
+    """
+    Parse timestamptz dari PostgREST. datetime.fromisoformat di Python 3.10 hanya
+    menerima 0, 3 atau 6 digit pecahan detik dan tidak menerima akhiran "Z",
+    jadi keduanya dinormalkan dulu. Mengembalikan None jika tetap tidak bisa di-parse.
+    """
+    normalized = re.sub(r"\.(\d+)", lambda m: "." + m.group(1)[:6].ljust(6, "0"), value.strip())
+    if normalized.endswith(("Z", "z")):
+        normalized = normalized[:-1] + "+00:00"
+    try:
+        parsed = datetime.fromisoformat(normalized)
+    except ValueError:
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def _snap_link_valid(order: Dict[str, Any]) -> bool:
+    expires_at = order.get("snap_expires_at")
+    if not order.get("snap_redirect_url") or not expires_at:
+        return False
+    # Nilai yang tidak bisa di-parse dianggap kedaluwarsa: buat link baru
+    parsed = _parse_timestamptz(str(expires_at))
+    return parsed is not None and parsed > datetime.now(timezone.utc)
+
+
+async def get_order_snap_link(order: Dict[str, Any]) -> str:
+    """
+    Link pembayaran untuk order awaiting_payment. Link yang masih berlaku di order
+    dikembalikan langsung; jika belum ada, transaksi Snap dibuat dengan harga
+    produk saat ini dan disimpan di order (snap_redirect_url, total_harga
+    termasuk biaya layanan, snap_expires_at).
+    """
+    if _snap_link_valid(order):
+        return order["snap_redirect_url"]
+
+    items_res, customer_res = await asyncio.gather(
+        async_supabase.table("order_items")
+            .select("product_id, jumlah, products(nama_produk, harga)")
+            .eq("order_id", order["id"])
+            .execute(),
+        async_supabase.table("users").select("nama_pengguna, nomor_telepon").eq("id", order["user_id"]).limit(1).execute(),
+    )
+    lines = [
+        {
+            "product_id": item["product_id"],
+            "nama_produk": item["products"]["nama_produk"],
+            "harga": item["products"]["harga"],
+            "jumlah": item["jumlah"],
+        }
+        for item in items_res.data or []
+        if item.get("products")
+    ]
+    if not lines:
+        raise EmptyOrderError(f"Tidak ada item valid untuk order {order['id']}")
+
+    item_details, harga_jual_akhir = build_item_details(lines)
+    customer = customer_res.data[0] if customer_res.data else {}
+    transaction = await create_snap_transaction(order["id"], item_details, harga_jual_akhir, customer)
+    redirect_url = transaction["redirect_url"]
+    if redirect_url:
+        expires_at = datetime.now(timezone.utc) + timedelta(seconds=SNAP_LINK_TTL_SECONDS)
+        await async_supabase.table("orders").update({
+            "snap_redirect_url": redirect_url,
+            "total_harga": harga_jual_akhir,
+            "snap_expires_at": expires_at.isoformat(),
+        }).eq("id", order["id"]).execute()
+    return redirect_url
+
+
+async def _handle_snap_warmup(payload: dict):
+    """Handler outbox: membuat link Snap lebih awal untuk order yang baru dikonfirmasi."""
+    result = await async_supabase.table("orders").select("*").eq("id", payload["order_id"]).limit(1).execute()
+    order = result.data[0] if result.data else None
+    # Order bisa saja sudah dibatalkan/dibayar sebelum pesan ini diproses
+    if order and order["status"] == "awaiting_payment":
+        await get_order_snap_link(order)
+
+
+outbox.register_handler("snap_warmup", _handle_snap_warmup)
+
+
+async def queue_snap_warmup(order_id: int):
+    """Jika SNAP_PREWARM aktif, antrekan pembuatan link Snap untuk order ini."""
+    if SNAP_PREWARM:
+        await outbox.enqueue("snap_warmup", {"order_id": order_id})
+
+
+async def close_payment_gateway():
+    """Menutup pool koneksi ke Midtrans saat aplikasi shutdown."""
+    await snap_client.close()
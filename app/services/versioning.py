@@ -0,0 +1,193 @@
+import os
+import time
+import hashlib
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+from fastapi import Request, Response
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# ETag respons GET yang sering di-poll (katalog, daftar order, status order).
+# ETag dihitung dari isi body, jadi selalu akurat. Versi terakhir disimpan di
+# memori selama VERSION_CACHE_TTL detik agar request dengan If-None-Match yang
+# cocok bisa dijawab 304 tanpa query ke database. Penulisan lewat HTTP di proses
+# ini langsung menghapus versi namespace terkait; worker lain paling lama
+# memakai versi lama selama TTL.
+VERSION_CACHE_TTL: float = float(os.getenv("VERSION_CACHE_TTL", "10"))
+VERSION_CACHE_MAX_ENTRIES: int = int(os.getenv("VERSION_CACHE_MAX_ENTRIES", "10000"))
+
+# Prefix path untuk request tulis (POST/PUT/PATCH/DELETE) -> namespace versi yang dihapus
+VERSIONED_WRITE_PREFIXES: Dict[str, str] = {
+    "/products": "catalogue",
+    "/categories": "catalogue",
+    "/orders": "orders",
+    "/payments": "orders",
+}
+
+
+def etag_for(body: bytes) -> str:
+    return f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """Perbandingan weak sesuai RFC 9110 untuk header If-None-Match."""
+    if if_none_match.strip() == "*":
+        return True
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+class VersionStore:
+    """ETag terakhir per (namespace, key), dengan TTL dan batas entri per namespace."""
+
+    def __init__(self, ttl: float = VERSION_CACHE_TTL, max_entries: int = VERSION_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._namespaces: Dict[str, "OrderedDict[str, Tuple[float, str]]"] = {}
+        # Naik setiap invalidate; ETag dari respons yang dibaca sebelum invalidate tidak disimpan
+        self._generations: Dict[str, int] = {}
+        self.metrics = {"not_modified_cached": 0, "not_modified_computed": 0, "full_responses": 0}
+
+    def get(self, namespace: str, key: str) -> Optional[str]:
+        entries = self._namespaces.get(namespace)
+        entry = entries.get(key) if entries else None
+        if entry is None:
+            return None
+        expires_at, etag = entry
+        if expires_at <= time.monotonic():
+            del entries[key]
+            return None
+        return etag
+
+    def generation(self, namespace: str) -> int:
+        return self._generations.get(namespace, 0)
+
+    def set(self, namespace: str, key: str, etag: str, generation: Optional[int] = None):
+        if generation is not None and generation != self.generation(namespace):
+            return
+        entries = self._namespaces.setdefault(namespace, OrderedDict())
+        entries[key] = (time.monotonic() + self.ttl, etag)
+        entries.move_to_end(key)
+        while len(entries) > self.max_entries:
+            entries.popitem(last=False)
+
+    def invalidate(self, namespace: str):
+        self._namespaces.pop(namespace, None)
+        self._generations[namespace] = self.generation(namespace) + 1
+
+    def stats(self) -> Dict[str, int]:
+        return {**self.metrics, "entries": sum(len(e) for e in self._namespaces.values())}
+
+
+versions = VersionStore()
+
+
+def check_not_modified(request: Request, namespace: str, key: str) -> Optional[Response]:
+    """
+    Menandai respons route ini agar diberi ETag oleh ConditionalGetMiddleware, dan
+    mengembalikan 304 jika versi yang tersimpan cocok dengan If-None-Match client.
+    Panggil setelah otorisasi dan sebelum query database. `key` harus mencakup
+    semua hal yang membedakan isi respons (user, query string, dll.).
+    """
+    request.state.version_key = (namespace, key, versions.generation(namespace))
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return None
+    etag = versions.get(namespace, key)
+    if etag and etag_matches(if_none_match, etag):
+        versions.metrics["not_modified_cached"] += 1
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+    return None
+
+
+class ConditionalGetMiddleware:
+    """
+    - GET yang ditandai `check_not_modified`: body 200 di-buffer, diberi ETag dari
+      hash isinya, dan diganti 304 tanpa body jika cocok dengan If-None-Match.
+    - Request tulis yang berhasil: versi namespace terkait dihapus sebelum respons
+      dikirim, sehingga poll berikutnya pasti membaca data baru.
+    """
+
+    def __init__(self, app: ASGIApp, write_prefixes: Dict[str, str] = VERSIONED_WRITE_PREFIXES):
+        self.app = app
+        self.write_prefixes = write_prefixes
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        if scope["method"] == "GET":
+            await self._handle_read(scope, receive, send)
+        elif scope["method"] in ("HEAD", "OPTIONS"):
+            await self.app(scope, receive, send)
+        else:
+            await self._handle_write(scope, receive, send)
+
+    async def _handle_write(self, scope: Scope, receive: Receive, send: Send):
+        namespace = next(
+            (ns for prefix, ns in self.write_prefixes.items() if scope["path"].startswith(prefix)), None
+        )
+        if namespace is None:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_wrapper(message: Message):
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                versions.invalidate(namespace)
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+    async def _handle_read(self, scope: Scope, receive: Receive, send: Send):
+        state = scope.setdefault("state", {})
+        start_message: Optional[Message] = None
+        body = []
+
+        async def send_wrapper(message: Message):
+            nonlocal start_message
+            if message["type"] == "http.response.start":
+                if message["status"] == 200 and state.get("version_key"):
+                    start_message = message
+                    return
+                await send(message)
+                return
+            if start_message is None or message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body.append(message.get("body", b""))
+            if message.get("more_body", False):
+                return
+            await self._send_versioned(scope, state["version_key"], start_message, b"".join(body), send)
+
+        await self.app(scope, receive, send_wrapper)
+
+    async def _send_versioned(self, scope: Scope, version_key, start_message: Message, body: bytes, send: Send):
+        namespace, key, generation = version_key
+        etag = etag_for(body)
+        versions.set(namespace, key, etag, generation)
+
+        if_none_match = Headers(scope=scope).get("if-none-match")
+        if if_none_match and etag_matches(if_none_match, etag):
+            versions.metrics["not_modified_computed"] += 1
+            headers = MutableHeaders(raw=[
+                (name, value) for name, value in start_message["headers"]
+                if name not in (b"content-length", b"content-type")
+            ])
+            headers["etag"] = etag
+            headers.setdefault("cache-control", "no-cache")
+            await send({"type": "http.response.start", "status": 304, "headers": headers.raw})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        versions.metrics["full_responses"] += 1
+        headers = MutableHeaders(raw=start_message["headers"])
+        headers["etag"] = etag
+        headers.setdefault("cache-control", "no-cache")
+        await send(start_message)
+        await send({"type": "http.response.body", "body": body})
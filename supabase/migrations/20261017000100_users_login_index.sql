@@ -0,0 +1,5 @@
+-- Index untuk lookup kredensial di POST /users/login.
+-- Login mencari satu baris berdasarkan nama_pengguna + nomor_telepon,
+-- sehingga query tidak lagi memindai seluruh tabel users.
+create index if not exists users_nama_pengguna_nomor_telepon_idx
+    on public.users (nama_pengguna, nomor_telepon);
@@ -0,0 +1,66 @@
+-- Inbox staff (GET /orders/staff/inbox) dalam satu panggilan RPC.
+-- Sebelumnya route melakukan hingga lima query PostgREST berurutan dan
+-- menggabungkan hasilnya di Python dengan daftar in_() yang terus membesar.
+
+-- Cek "order ini berisi produk milik staff?" per order
+create index if not exists order_items_order_id_product_id_idx
+    on public.order_items (order_id, product_id);
+
+-- Daftar produk milik staff
+create index if not exists product_users_user_id_product_id_idx
+    on public.product_users (user_id, product_id);
+
+-- Mengembalikan satu halaman order (terbaru lebih dulu) yang berisi produk milik
+-- p_staff_id, masing-masing sebagai jsonb. Order dipindai mundur lewat primary key
+-- dan berhenti setelah p_limit baris, jadi biayanya tidak tumbuh dengan riwayat order.
+--   p_after         : cursor keyset (id order terakhir di halaman sebelumnya)
+--   p_limit         : jumlah baris (route mengirim limit + 1 untuk mendeteksi halaman berikutnya)
+--   p_include_items : tambahkan key "items" berisi item milik staff tersebut
+--   p_fields        : hanya kolom ini yang dikembalikan (null = semua kolom)
+create or replace function public.get_staff_inbox(
+    p_staff_id bigint,
+    p_status text default null,
+    p_after bigint default null,
+    p_limit integer default 50,
+    p_include_items boolean default false,
+    p_fields text[] default null
+)
+returns setof jsonb
+language sql
+stable
+as $$
+    with page as (
+        select o.*
+          from public.orders o
+         where (p_after is null or o.id < p_after)
+           and (p_status is null or o.status = p_status)
+           and exists (
+                select 1
+                  from public.order_items oi
+                  join public.product_users pu
+                    on pu.product_id = oi.product_id and pu.user_id = p_staff_id
+                 where oi.order_id = o.id
+           )
+         order by o.id desc
+         limit p_limit
+    )
+    select
+        case
+            when p_fields is null then to_jsonb(p)
+            else (select jsonb_object_agg(e.key, e.value)
+                    from jsonb_each(to_jsonb(p)) e
+                   where e.key = any(p_fields))
+        end
+        || case
+            when p_include_items then jsonb_build_object('items', coalesce((
+                select jsonb_agg(to_jsonb(oi) order by oi.id)
+                  from public.order_items oi
+                  join public.product_users pu
+                    on pu.product_id = oi.product_id and pu.user_id = p_staff_id
+                 where oi.order_id = p.id
+            ), '[]'::jsonb))
+            else '{}'::jsonb
+        end
+      from page p
+     order by p.id desc;
+$$;
@@ -0,0 +1,229 @@
+-- Delta feed untuk inbox staff (GET /orders/staff/inbox?since=<cursor>).
+--
+-- Setiap baris orders/order_items menyimpan id transaksi terakhir yang mengubahnya
+-- (change_xid). Cursor yang diberikan ke client adalah xmin snapshot saat data
+-- dibaca: semua transaksi dengan id < cursor sudah commit dan sudah terlihat,
+-- jadi permintaan berikutnya cukup membaca baris dengan change_xid >= cursor.
+-- Transaksi yang masih berjalan saat dibaca (id >= cursor) ikut terbaca di delta
+-- berikutnya; client menerapkan delta sebagai upsert sehingga pengiriman ulang aman.
+
+create or replace function public.current_change_xid()
+returns bigint
+language sql
+volatile
+as $$
+    select pg_current_xact_id()::text::bigint;
+$$;
+
+create or replace function public.current_change_cursor()
+returns bigint
+language sql
+stable
+as $$
+    select pg_snapshot_xmin(pg_current_snapshot())::text::bigint;
+$$;
+
+alter table public.orders
+    add column if not exists change_xid bigint not null default public.current_change_xid();
+alter table public.order_items
+    add column if not exists change_xid bigint not null default public.current_change_xid();
+
+create index if not exists orders_change_xid_idx on public.orders (change_xid);
+create index if not exists order_items_change_xid_idx on public.order_items (change_xid);
+
+create or replace function public.touch_change_xid()
+returns trigger
+language plpgsql
+as $$
+begin
+    new.change_xid := public.current_change_xid();
+    return new;
+end;
+$$;
+
+drop trigger if exists orders_touch_change_xid on public.orders;
+create trigger orders_touch_change_xid
+    before update on public.orders
+    for each row execute function public.touch_change_xid();
+
+drop trigger if exists order_items_touch_change_xid on public.order_items;
+create trigger order_items_touch_change_xid
+    before update on public.order_items
+    for each row execute function public.touch_change_xid();
+
+-- Tombstone untuk baris yang dihapus, supaya client bisa membuangnya dari cache lokal.
+create table if not exists public.inbox_tombstones (
+    id bigserial primary key,
+    table_name text not null,
+    row_id bigint not null,
+    order_id bigint not null,
+    product_id bigint,
+    change_xid bigint not null default public.current_change_xid(),
+    deleted_at timestamptz not null default now()
+);
+
+create index if not exists inbox_tombstones_change_xid_idx on public.inbox_tombstones (change_xid);
+
+create or replace function public.record_inbox_tombstone()
+returns trigger
+language plpgsql
+as $$
+begin
+    if tg_table_name = 'orders' then
+        insert into public.inbox_tombstones (table_name, row_id, order_id)
+        values ('orders', old.id, old.id);
+    else
+        insert into public.inbox_tombstones (table_name, row_id, order_id, product_id)
+        values ('order_items', old.id, old.order_id, old.product_id);
+    end if;
+    return old;
+end;
+$$;
+
+drop trigger if exists orders_inbox_tombstone on public.orders;
+create trigger orders_inbox_tombstone
+    after delete on public.orders
+    for each row execute function public.record_inbox_tombstone();
+
+drop trigger if exists order_items_inbox_tombstone on public.order_items;
+create trigger order_items_inbox_tombstone
+    after delete on public.order_items
+    for each row execute function public.record_inbox_tombstone();
+
+-- get_staff_inbox sekarang juga mengembalikan cursor untuk delta berikutnya:
+-- {"cursor": <bigint>, "orders": [...]}
+drop function if exists public.get_staff_inbox(bigint, text, bigint, integer, boolean, text[]);
+
+create or replace function public.get_staff_inbox(
+    p_staff_id bigint,
+    p_status text default null,
+    p_after bigint default null,
+    p_limit integer default 50,
+    p_include_items boolean default false,
+    p_fields text[] default null
+)
+returns jsonb
+language sql
+stable
+as $$
+    with page as (
+        select o.*
+          from public.orders o
+         where (p_after is null or o.id < p_after)
+           and (p_status is null or o.status = p_status)
+           and exists (
+                select 1
+                  from public.order_items oi
+                  join public.product_users pu
+                    on pu.product_id = oi.product_id and pu.user_id = p_staff_id
+                 where oi.order_id = o.id
+           )
+         order by o.id desc
+         limit p_limit
+    )
+    select jsonb_build_object(
+        'cursor', public.current_change_cursor(),
+        'orders', coalesce(jsonb_agg(
+            case
+                when p_fields is null then to_jsonb(p)
+                else (select jsonb_object_agg(e.key, e.value)
+                        from jsonb_each(to_jsonb(p)) e
+                       where e.key = any(p_fields))
+            end
+            || case
+                when p_include_items then jsonb_build_object('items', coalesce((
+                    select jsonb_agg(to_jsonb(oi) order by oi.id)
+                      from public.order_items oi
+                      join public.product_users pu
+                        on pu.product_id = oi.product_id and pu.user_id = p_staff_id
+                     where oi.order_id = p.id
+                ), '[]'::jsonb))
+                else '{}'::jsonb
+            end
+            order by p.id desc
+        ), '[]'::jsonb)
+    )
+      from page p;
+$$;
+
+-- Perubahan inbox staff sejak p_since:
+-- {"cursor", "reset", "orders": [...], "items": [...], "deleted": [{"table", "id", "order_id"}]}
+-- Jika perubahan lebih dari p_limit, hanya {"cursor", "reset": true} yang dikembalikan
+-- dan client sebaiknya memuat ulang inbox penuh.
+create or replace function public.get_staff_inbox_changes(
+    p_staff_id bigint,
+    p_since bigint,
+    p_limit integer default 500,
+    p_fields text[] default null
+)
+returns jsonb
+language sql
+stable
+as $$
+    with staff_products as (
+        select product_id from public.product_users where user_id = p_staff_id
+    ),
+    changed_orders as (
+        select o.*
+          from public.orders o
+         where o.change_xid >= p_since
+           and exists (
+                select 1
+                  from public.order_items oi
+                 where oi.order_id = o.id
+                   and oi.product_id in (select product_id from staff_products)
+           )
+    ),
+    changed_items as (
+        select oi.*
+          from public.order_items oi
+         where oi.change_xid >= p_since
+           and oi.product_id in (select product_id from staff_products)
+    ),
+    deleted as (
+        select t.*
+          from public.inbox_tombstones t
+         where t.change_xid >= p_since
+           and (
+                t.product_id in (select product_id from staff_products)
+                or (t.table_name = 'orders' and exists (
+                    select 1
+                      from public.inbox_tombstones ti
+                     where ti.table_name = 'order_items'
+                       and ti.order_id = t.order_id
+                       and ti.product_id in (select product_id from staff_products)
+                ))
+           )
+    ),
+    counts as (
+        select (select count(*) from changed_orders)
+             + (select count(*) from changed_items)
+             + (select count(*) from deleted) as total
+    )
+    select case
+        when (select total from counts) > p_limit then jsonb_build_object(
+            'cursor', public.current_change_cursor(),
+            'reset', true
+        )
+        else jsonb_build_object(
+            'cursor', public.current_change_cursor(),
+            'reset', false,
+            'orders', coalesce((
+                select jsonb_agg(
+                    case
+                        when p_fields is null then to_jsonb(o)
+                        else (select jsonb_object_agg(e.key, e.value)
+                                from jsonb_each(to_jsonb(o)) e
+                               where e.key = any(p_fields))
+                    end
+                    order by o.id desc)
+                  from changed_orders o
+            ), '[]'::jsonb),
+            'items', coalesce((select jsonb_agg(to_jsonb(i) order by i.id) from changed_items i), '[]'::jsonb),
+            'deleted', coalesce((
+                select jsonb_agg(jsonb_build_object('table', d.table_name, 'id', d.row_id, 'order_id', d.order_id) order by d.id)
+                  from deleted d
+            ), '[]'::jsonb)
+        )
+    end;
+$$;
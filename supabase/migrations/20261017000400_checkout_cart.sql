@@ -0,0 +1,38 @@
+-- Checkout keranjang (POST /payments/snap-token) dalam satu transaksi.
+-- Order, item, dan payment awal disimpan oleh satu panggilan RPC, sehingga
+-- jumlah round trip tidak bergantung pada jumlah item di keranjang dan tidak
+-- ada order setengah jadi jika salah satu insert gagal.
+--
+--   p_order   : {"user_id", "status", "total_harga", "tanggal_pesanan"}
+--   p_items   : [{"product_id", "jumlah", "harga_unit", "subtotal"}, ...]
+--   p_payment : {"transaction_status", "gross_amount", "payment_type"}
+--
+-- Tipe setiap nilai mengikuti kolom tabelnya (jsonb_populate_record).
+-- Mengembalikan baris order yang baru dibuat.
+create or replace function public.checkout_cart(
+    p_order jsonb,
+    p_items jsonb,
+    p_payment jsonb
+)
+returns jsonb
+language plpgsql
+as $$
+declare
+    v_order public.orders;
+begin
+    insert into public.orders (user_id, status, total_harga, tanggal_pesanan)
+    select r.user_id, r.status, r.total_harga, r.tanggal_pesanan
+      from jsonb_populate_record(null::public.orders, p_order) r
+    returning * into v_order;
+
+    insert into public.order_items (order_id, product_id, jumlah, harga_unit, subtotal)
+    select v_order.id, r.product_id, r.jumlah, r.harga_unit, r.subtotal
+      from jsonb_populate_recordset(null::public.order_items, p_items) r;
+
+    insert into public.payments (order_id, transaksi_id, transaction_status, gross_amount, payment_type)
+    select v_order.id, 'pending-' || v_order.id, r.transaction_status, r.gross_amount, r.payment_type
+      from jsonb_populate_record(null::public.payments, p_payment) r;
+
+    return to_jsonb(v_order);
+end;
+$$;
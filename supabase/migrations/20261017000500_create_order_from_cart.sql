@@ -0,0 +1,98 @@
+-- Pembuatan order dari keranjang (POST /orders/) dalam satu transaksi:
+-- baca keranjang + harga produk, insert order dan order_items, kosongkan
+-- keranjang, dan kumpulkan staff pemilik produk untuk notifikasi.
+-- Dengan idempotency key, request yang diulang (timeout, retry jaringan)
+-- mengembalikan order yang sama, bukan membuat order kedua.
+
+alter table public.orders
+    add column if not exists idempotency_key text;
+
+create unique index if not exists orders_user_id_idempotency_key_idx
+    on public.orders (user_id, idempotency_key)
+    where idempotency_key is not null;
+
+-- {"order", "items", "staff_ids", "created"} untuk satu order
+create or replace function public.order_checkout_result(p_order_id bigint, p_created boolean)
+returns jsonb
+language sql
+stable
+as $$
+    select jsonb_build_object(
+        'order', (select to_jsonb(o) from public.orders o where o.id = p_order_id),
+        'items', coalesce((
+            select jsonb_agg(to_jsonb(oi) order by oi.id)
+              from public.order_items oi
+             where oi.order_id = p_order_id
+        ), '[]'::jsonb),
+        'staff_ids', coalesce((
+            select jsonb_agg(distinct pu.user_id)
+              from public.product_users pu
+             where pu.product_id in (select product_id from public.order_items where order_id = p_order_id)
+        ), '[]'::jsonb),
+        'created', p_created
+    );
+$$;
+
+--   p_order : {"user_id", "status", "tanggal_pesanan", "catatan", "payment_method"}
+--             (total_harga dihitung dari harga produk saat ini)
+-- Mengembalikan hasil order_checkout_result, atau {"order": null} jika keranjang kosong.
+create or replace function public.create_order_from_cart(
+    p_order jsonb,
+    p_idempotency_key text default null
+)
+returns jsonb
+language plpgsql
+as $$
+declare
+    v_user_id bigint := (p_order ->> 'user_id')::bigint;
+    v_existing_id bigint;
+    v_total numeric;
+    v_order public.orders;
+begin
+    if p_idempotency_key is not null then
+        select id into v_existing_id
+          from public.orders
+         where user_id = v_user_id and idempotency_key = p_idempotency_key;
+        if found then
+            return public.order_checkout_result(v_existing_id, false);
+        end if;
+    end if;
+
+    -- Kunci baris keranjang agar dua checkout bersamaan tidak memakai keranjang yang sama
+    perform 1 from public.cart_items where user_id = v_user_id for update;
+
+    select sum(p.harga * ci.jumlah) into v_total
+      from public.cart_items ci
+      join public.products p on p.id = ci.product_id
+     where ci.user_id = v_user_id;
+
+    if v_total is null then
+        -- Keranjang kosong; bisa jadi karena request yang sama baru saja selesai
+        if p_idempotency_key is not null then
+            select id into v_existing_id
+              from public.orders
+             where user_id = v_user_id and idempotency_key = p_idempotency_key;
+            if found then
+                return public.order_checkout_result(v_existing_id, false);
+            end if;
+        end if;
+        return jsonb_build_object('order', null);
+    end if;
+
+    insert into public.orders (user_id, status, total_harga, tanggal_pesanan, catatan, payment_method, idempotency_key)
+    select r.user_id, r.status, v_total, r.tanggal_pesanan, r.catatan, r.payment_method, p_idempotency_key
+      from jsonb_populate_record(null::public.orders, p_order) r
+    returning * into v_order;
+
+    insert into public.order_items (order_id, product_id, jumlah, harga_unit, subtotal, status)
+    select v_order.id, ci.product_id, ci.jumlah, p.harga, p.harga * ci.jumlah, 'awaiting_confirmation'
+      from public.cart_items ci
+      join public.products p on p.id = ci.product_id
+     where ci.user_id = v_user_id
+     order by ci.id;
+
+    delete from public.cart_items where user_id = v_user_id;
+
+    return public.order_checkout_result(v_order.id, true);
+end;
+$$;
@@ -0,0 +1,5 @@
+-- Link pembayaran Snap dibuat saat customer pertama kali membuka
+-- POST /orders/{id}/generate-snap (bukan saat staff mengonfirmasi order) dan
+-- disimpan di order. snap_expires_at menandai kapan link harus dibuat ulang.
+alter table public.orders
+    add column if not exists snap_expires_at timestamptz;
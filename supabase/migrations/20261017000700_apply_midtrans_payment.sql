@@ -0,0 +1,65 @@
+-- Callback Midtrans (POST /payments/callback) dalam satu panggilan RPC.
+-- Sebelumnya route melakukan hingga delapan query berurutan sebelum membalas,
+-- sehingga Midtrans sering mengirim ulang notifikasi yang lambat.
+--
+--   p_payment : kolom payments dari notifikasi (transaksi_id, status_code,
+--               transaction_status, gross_amount, payment_type, transaction_time,
+--               settlement_time)
+--   p_paid    : transaksi settlement/capture; order dan item ditandai 'paid'
+--               dan keranjang customer dikosongkan
+--
+-- Mengembalikan {"applied": false} jika tidak ada yang perlu dinotifikasi
+-- (bukan pembayaran, order tidak ada, atau sudah 'paid' oleh callback sebelumnya),
+-- atau {"applied": true, "user_id", "staff_ids", "cursor"}.
+create or replace function public.apply_midtrans_payment(
+    p_order_id bigint,
+    p_payment jsonb,
+    p_paid boolean
+)
+returns jsonb
+language plpgsql
+as $$
+declare
+    v_user_id bigint;
+begin
+    update public.payments p
+       set transaksi_id = r.transaksi_id,
+           status_code = r.status_code,
+           transaction_status = r.transaction_status,
+           gross_amount = r.gross_amount,
+           payment_type = r.payment_type,
+           transaction_time = r.transaction_time,
+           settlement_time = r.settlement_time
+      from jsonb_populate_record(null::public.payments, p_payment) r
+     where p.order_id = p_order_id;
+
+    if not p_paid then
+        return jsonb_build_object('applied', false);
+    end if;
+
+    -- Hanya callback pertama yang mengubah status; pengiriman ulang tidak menotifikasi lagi
+    update public.orders
+       set status = 'paid'
+     where id = p_order_id and status <> 'paid'
+    returning user_id into v_user_id;
+
+    if not found then
+        return jsonb_build_object('applied', false);
+    end if;
+
+    update public.order_items set status = 'paid' where order_id = p_order_id;
+
+    delete from public.cart_items where user_id = v_user_id;
+
+    return jsonb_build_object(
+        'applied', true,
+        'user_id', v_user_id,
+        'staff_ids', coalesce((
+            select jsonb_agg(distinct pu.user_id)
+              from public.product_users pu
+             where pu.product_id in (select product_id from public.order_items where order_id = p_order_id)
+        ), '[]'::jsonb),
+        'cursor', public.current_change_xid()
+    );
+end;
+$$;
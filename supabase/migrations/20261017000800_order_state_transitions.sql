@@ -0,0 +1,59 @@
+-- Transisi status order mengikuti state machine di app/services/order_state.py.
+-- apply_midtrans_payment menerima status asal yang sah untuk 'paid' (p_expected)
+-- alih-alih hanya "belum paid", sehingga callback settlement yang terlambat tidak
+-- menghidupkan kembali order yang sudah dibatalkan atau sudah diproses dapur.
+drop function if exists public.apply_midtrans_payment(bigint, jsonb, boolean);
+
+create or replace function public.apply_midtrans_payment(
+    p_order_id bigint,
+    p_payment jsonb,
+    p_paid boolean,
+    p_expected text[] default array['pending', 'awaiting_payment']
+)
+returns jsonb
+language plpgsql
+as $$
+declare
+    v_user_id bigint;
+begin
+    update public.payments p
+       set transaksi_id = r.transaksi_id,
+           status_code = r.status_code,
+           transaction_status = r.transaction_status,
+           gross_amount = r.gross_amount,
+           payment_type = r.payment_type,
+           transaction_time = r.transaction_time,
+           settlement_time = r.settlement_time
+      from jsonb_populate_record(null::public.payments, p_payment) r
+     where p.order_id = p_order_id;
+
+    if not p_paid then
+        return jsonb_build_object('applied', false);
+    end if;
+
+    -- Compare-and-set: hanya callback pertama yang mengubah status yang menotifikasi
+    update public.orders
+       set status = 'paid'
+     where id = p_order_id and status = any(p_expected)
+    returning user_id into v_user_id;
+
+    if not found then
+        return jsonb_build_object('applied', false);
+    end if;
+
+    update public.order_items set status = 'paid' where order_id = p_order_id;
+
+    delete from public.cart_items where user_id = v_user_id;
+
+    return jsonb_build_object(
+        'applied', true,
+        'user_id', v_user_id,
+        'staff_ids', coalesce((
+            select jsonb_agg(distinct pu.user_id)
+              from public.product_users pu
+             where pu.product_id in (select product_id from public.order_items where order_id = p_order_id)
+        ), '[]'::jsonb),
+        'cursor', public.current_change_xid()
+    );
+end;
+$$;
@@ -0,0 +1,101 @@
+-- Jumlah item per status untuk setiap order, mis. {"cooking": 3, "completed": 9}.
+-- Dijaga oleh trigger di order_items sehingga route cukup membaca satu baris
+-- order untuk menentukan status keseluruhan, bukan memindai semua item setiap
+-- kali satu item berubah.
+alter table public.orders
+    add column if not exists item_status_counts jsonb not null default '{}'::jsonb;
+
+-- counts + deltas per key; key dengan jumlah 0 dibuang
+create or replace function public.merge_status_counts(p_counts jsonb, p_deltas jsonb)
+returns jsonb
+language sql
+immutable
+as $$
+    select coalesce(jsonb_object_agg(k, v) filter (where v <> 0), '{}'::jsonb)
+      from (
+        select k, coalesce((p_counts ->> k)::int, 0) + coalesce((p_deltas ->> k)::int, 0) as v
+          from (select jsonb_object_keys(p_counts) as k
+                union
+                select jsonb_object_keys(p_deltas)) keys
+      ) t;
+$$;
+
+-- Trigger per statement: update massal (mis. semua item order menjadi 'paid')
+-- mengubah setiap order yang terkena sekali saja.
+create or replace function public.sync_order_item_status_counts()
+returns trigger
+language plpgsql
+as $$
+declare
+    v_deltas jsonb;
+begin
+    -- [{"order_id", "status", "n"}] : perubahan jumlah per (order, status)
+    if tg_op = 'INSERT' then
+        select jsonb_agg(d) into v_deltas
+          from (select order_id, status, count(*)::int as n
+                  from new_rows
+                 where status is not null
+                 group by order_id, status) d;
+    elsif tg_op = 'DELETE' then
+        select jsonb_agg(d) into v_deltas
+          from (select order_id, status, -count(*)::int as n
+                  from old_rows
+                 where status is not null
+                 group by order_id, status) d;
+    else
+        select jsonb_agg(d) into v_deltas
+          from (select order_id, status, sum(n)::int as n
+                  from (select order_id, status, 1 as n from new_rows
+                        union all
+                        select order_id, status, -1 from old_rows) r
+                 where status is not null
+                 group by order_id, status
+                having sum(n) <> 0) d;
+    end if;
+
+    if v_deltas is null then
+        return null;
+    end if;
+
+    update public.orders o
+       set item_status_counts = public.merge_status_counts(o.item_status_counts, d.deltas)
+      from (select (e ->> 'order_id')::bigint as order_id,
+                   jsonb_object_agg(e ->> 'status', (e ->> 'n')::int) as deltas
+              from jsonb_array_elements(v_deltas) e
+             group by 1) d
+     where o.id = d.order_id;
+
+    return null;
+end;
+$$;
+
+drop trigger if exists order_items_status_counts_insert on public.order_items;
+create trigger order_items_status_counts_insert
+    after insert on public.order_items
+    referencing new table as new_rows
+    for each statement execute function public.sync_order_item_status_counts();
+
+drop trigger if exists order_items_status_counts_update on public.order_items;
+create trigger order_items_status_counts_update
+    after update on public.order_items
+    referencing old table as old_rows new table as new_rows
+    for each statement execute function public.sync_order_item_status_counts();
+
+drop trigger if exists order_items_status_counts_delete on public.order_items;
+create trigger order_items_status_counts_delete
+    after delete on public.order_items
+    referencing old table as old_rows
+    for each statement execute function public.sync_order_item_status_counts();
+
+-- Isi untuk order yang sudah ada
+update public.orders o
+   set item_status_counts = c.counts
+  from (
+    select order_id, jsonb_object_agg(status, n) as counts
+      from (select order_id, status, count(*)::int as n
+              from public.order_items
+             where status is not null
+             group by order_id, status) s
+     group by order_id
+  ) c
+ where o.id = c.order_id;
@@ -0,0 +1,16 @@
+import os
+import tempfile
+
+import pytest
+
+# app.config membuat client Supabase saat di-import; test tidak pernah menghubunginya.
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SUPABASE_SERVICE_KEY", "test-service-key")
+_tmpdir = tempfile.mkdtemp(prefix="ekantin-tests-")
+os.environ.setdefault("OUTBOX_DB_PATH", os.path.join(_tmpdir, "outbox.sqlite3"))
+os.environ.setdefault("IDEMPOTENCY_DB_PATH", os.path.join(_tmpdir, "idempotency.sqlite3"))
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
@@ -0,0 +1,111 @@
+import asyncio
+
+import pytest
+
+from app.routes.websockets import ConnectionManager
+from app.services.broadcast import (
+    BroadcastBackend, InMemoryBroadcastBackend, RedisBroadcastBackend, create_broadcast_backend,
+)
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+class Collector:
+    def __init__(self):
+        self.envelopes = asyncio.Queue()
+
+    async def __call__(self, envelope):
+        await self.envelopes.put(envelope)
+
+    async def next(self, timeout=2):
+        return await asyncio.wait_for(self.envelopes.get(), timeout)
+
+
+def test_create_broadcast_backend_from_url():
+    assert isinstance(create_broadcast_backend("memory://"), InMemoryBroadcastBackend)
+    assert isinstance(create_broadcast_backend(""), InMemoryBroadcastBackend)
+    assert isinstance(create_broadcast_backend("redis://localhost:6379/0"), RedisBroadcastBackend)
+    with pytest.raises(ValueError):
+        create_broadcast_backend("kafka://localhost")
+
+
+def test_incomplete_backend_fails_at_construction():
+    class NoPublish(BroadcastBackend):
+        async def start(self, on_message):
+            pass
+
+    with pytest.raises(TypeError):
+        NoPublish()
+
+
+@pytest.mark.anyio
+async def test_in_memory_backend_delivers_to_handler():
+    backend = InMemoryBroadcastBackend()
+    # Publish sebelum start tidak error dan tidak dikirim ke mana pun
+    await backend.publish({"user_ids": [1], "message": "lost"})
+    collector = Collector()
+    await backend.start(collector)
+    await backend.publish({"user_ids": [1], "message": "halo"})
+    assert await collector.next() == {"user_ids": [1], "message": "halo"}
+    await backend.stop()
+
+
+@pytest.mark.anyio
+async def test_redis_backend_fans_out_to_every_worker():
+    server = fakeredis.FakeServer()
+    workers = [
+        RedisBroadcastBackend("redis://fake", channel="test:ws", client=fakeredis.aioredis.FakeRedis(server=server))
+        for _ in range(2)
+    ]
+    collectors = [Collector() for _ in workers]
+    for backend, collector in zip(workers, collectors):
+        await backend.start(collector)
+    try:
+        envelope = {"topic": "staff", "message": "produk berubah"}
+        await workers[0].publish(envelope)
+        # Worker yang mem-publish juga menerima lewat jalur yang sama
+        assert [await collector.next() for collector in collectors] == [envelope, envelope]
+    finally:
+        for backend in workers:
+            await backend.stop()
+
+
+@pytest.mark.anyio
+async def test_redis_backend_survives_malformed_message(monkeypatch):
+    server = fakeredis.FakeServer()
+    publisher = fakeredis.aioredis.FakeRedis(server=server)
+    backend = RedisBroadcastBackend("redis://fake", channel="test:ws", client=fakeredis.aioredis.FakeRedis(server=server))
+    collector = Collector()
+
+    real_sleep = asyncio.sleep
+
+    async def no_backoff(_):
+        await real_sleep(0)
+
+    monkeypatch.setattr("app.services.broadcast.asyncio.sleep", no_backoff)
+    await backend.start(collector)
+    try:
+        await publisher.publish("test:ws", "bukan json")
+        await backend.publish({"user_ids": [3], "message": "ok"})
+        assert await collector.next() == {"user_ids": [3], "message": "ok"}
+    finally:
+        await backend.stop()
+        await publisher.aclose()
+
+
+@pytest.mark.anyio
+async def test_connection_manager_routes_envelopes_to_local_users(monkeypatch):
+    manager = ConnectionManager(InMemoryBroadcastBackend())
+    sent = []
+    monkeypatch.setattr(manager, "send_to_local_user", lambda user_id, message: sent.append((user_id, message)))
+    await manager.start()
+    manager.subscribe(1, "staff")
+    manager.subscribe(2, "staff")
+    manager.subscribe(3, "customer")
+
+    await manager.broadcast_to_topic("staff", "topic")
+    await manager.broadcast_to_users([3, 4], "direct")
+    await manager.broadcast_to_users([], "kosong")
+    await manager.stop()
+
+    assert sorted(sent) == [(1, "topic"), (2, "topic"), (3, "direct"), (4, "direct")]
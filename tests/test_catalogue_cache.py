@@ -0,0 +1,153 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app.routes import websockets
+from app.routes.websockets import ConnectionManager
+from app.services import catalogue_cache as catalogue_module
+from app.services.broadcast import InMemoryBroadcastBackend
+from app.services import cache as cache_module
+from app.services.cache import TTLCache
+
+
+def loader_for(value, calls):
+    async def load():
+        calls.append(value)
+        await asyncio.sleep(0.01)
+        return value
+    return load
+
+
+@pytest.mark.anyio
+async def test_concurrent_misses_share_one_load():
+    cache = TTLCache(ttl=60, max_entries=10)
+    calls = []
+    results = await asyncio.gather(*[cache.get_or_load("products", loader_for("v", calls)) for _ in range(5)])
+    assert results == ["v"] * 5
+    assert calls == ["v"]
+
+
+@pytest.mark.anyio
+async def test_locks_are_dropped_on_eviction_expiry_and_invalidate(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(cache_module, "time", SimpleNamespace(monotonic=lambda: now[0]))
+    cache = TTLCache(ttl=10, max_entries=2)
+    calls = []
+    for key in ("a", "b", "c"):
+        await cache.get_or_load(key, loader_for(key, calls))
+    # "a" dikeluarkan karena LRU
+    assert set(cache._locks) == {"b", "c"}
+
+    now[0] += 11
+    assert await cache.get_or_load("b", loader_for("b2", calls)) == "b2"
+    assert cache._locks.keys() == {"b", "c"}
+    # Entri "c" kedaluwarsa saat dibaca dan lock-nya ikut dibuang
+    assert cache._lookup("c") is cache_module._MISSING
+    assert set(cache._locks) == {"b"}
+
+    cache.invalidate()
+    assert cache._locks == {}
+    assert cache.stats()["locks"] == 0
+
+
+@pytest.mark.anyio
+async def test_invalidate_keeps_lock_of_running_loader():
+    cache = TTLCache(ttl=60, max_entries=10)
+    started, release = asyncio.Event(), asyncio.Event()
+    calls = []
+
+    async def slow_load():
+        calls.append("slow")
+        started.set()
+        await release.wait()
+        return "lama"
+
+    first = asyncio.create_task(cache.get_or_load("products", slow_load))
+    await started.wait()
+    waiter = asyncio.create_task(cache.get_or_load("products", loader_for("baru", calls)))
+    await asyncio.sleep(0)
+    cache.invalidate()
+    assert "products" in cache._locks
+    release.set()
+    assert await first == "lama"
+    # Hasil loader yang mulai sebelum invalidate tidak disimpan; waiter memuat ulang
+    assert await waiter == "baru"
+    assert calls == ["slow", "baru"]
+
+
+@pytest.mark.anyio
+async def test_product_update_envelope_invalidates_catalogue_on_every_worker(monkeypatch):
+    invalidations = []
+    monkeypatch.setattr(websockets, "invalidate_catalogue", lambda: invalidations.append(1))
+    manager = ConnectionManager(InMemoryBroadcastBackend())
+    sent = []
+    monkeypatch.setattr(manager, "send_to_local_user", lambda user_id, message: sent.append((user_id, message)))
+    manager.subscribe(5, "staff")
+    await manager.start()
+
+    # Envelope yang diterima dari worker lain
+    await manager._deliver_local({"topic": "staff", "message": "{}", "invalidate": "catalogue"})
+    await manager._deliver_local({"invalidate": "catalogue"})
+    await manager._deliver_local({"topic": "staff", "message": "{}"})
+    await manager.stop()
+
+    assert len(invalidations) == 2
+    assert sent == [(5, "{}"), (5, "{}")]
+
+
+@pytest.mark.anyio
+async def test_notify_product_change_publishes_invalidation(monkeypatch):
+    published = []
+
+    class RecordingBackend(InMemoryBroadcastBackend):
+        async def publish(self, envelope):
+            published.append(envelope)
+
+    monkeypatch.setattr(websockets, "manager", ConnectionManager(RecordingBackend()))
+    await websockets.notify_all_staff_of_product_change()
+    await websockets.invalidate_catalogue_everywhere()
+    assert published == [
+        {"topic": "staff", "message": '{"type": "product_update"}', "invalidate": "catalogue"},
+        {"invalidate": "catalogue"},
+    ]
+
+
+class RecordingTable:
+    def __init__(self, name, rows, log):
+        self.calls = [("table", name)]
+        self.rows = rows
+        log.append(self.calls)
+
+    def __getattr__(self, name):
+        def method(*args):
+            self.calls.append((name, *args))
+            return self
+        return method
+
+    async def execute(self):
+        return SimpleNamespace(data=self.rows)
+
+
+@pytest.mark.anyio
+async def test_products_by_owner_use_one_bulk_query(monkeypatch):
+    from app import crud
+
+    tables = {
+        "product_users": [{"product_id": 3}, {"product_id": 1}, {"product_id": 3}],
+        "products": [{"id": 1, "is_active": True}, {"id": 3, "is_active": True}],
+    }
+    log = []
+    fake = SimpleNamespace(table=lambda name: RecordingTable(name, tables[name], log))
+    monkeypatch.setattr(catalogue_module, "async_supabase", fake)
+    monkeypatch.setattr(crud, "async_supabase", fake)
+    monkeypatch.setattr(catalogue_module, "catalogue_cache", TTLCache(ttl=60, max_entries=10))
+
+    first = await catalogue_module.get_products_by_owner(9, is_active=True)
+    second = await catalogue_module.get_products_by_owner(9, is_active=True)
+
+    assert first == second == tables["products"]
+    assert log == [
+        [("table", "product_users"), ("select", "product_id"), ("eq", "user_id", 9)],
+        [("table", "products"), ("select", "*"), ("in_", "id", [1, 3]), ("eq", "is_active", True), ("order", "id")],
+    ]
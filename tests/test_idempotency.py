@@ -0,0 +1,178 @@
+import asyncio
+import threading
+import time
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
+
+from app.services import idempotency
+from app.services.idempotency import REPLAYED_HEADER, IdempotencyMiddleware, IdempotencyStore
+
+ORIGIN = "https://kantin.example"
+
+
+def build_app(store, responses=None, delay=0.0):
+    """App kecil dengan urutan middleware yang sama seperti app/main.py."""
+    app = FastAPI()
+    app.state.calls = 0
+    # Antrean status code untuk /payments/snap-token, default 200
+    app.state.responses = list(responses or [])
+
+    @app.post("/orders/")
+    async def create_order(payload: dict):
+        app.state.calls += 1
+        if delay:
+            await asyncio.sleep(delay)
+        return {"order": app.state.calls, "payload": payload}
+
+    @app.post("/payments/snap-token")
+    async def snap_token():
+        app.state.calls += 1
+        status_code = app.state.responses.pop(0) if app.state.responses else 200
+        return JSONResponse({"call": app.state.calls}, status_code=status_code)
+
+    @app.post("/orders/{order_id}/cancel")
+    async def not_idempotent(order_id: int):
+        app.state.calls += 1
+        return {"call": app.state.calls}
+
+    app.add_middleware(IdempotencyMiddleware, store=store)
+    app.add_middleware(CORSMiddleware, allow_origins=["*"], expose_headers=[REPLAYED_HEADER])
+    return app
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = IdempotencyStore(db_path=str(tmp_path / "idempotency.sqlite3"))
+    yield store
+    store.conn.close()
+
+
+def client_for(app):
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+
+
+def headers(key, token="user-a"):
+    return {"Idempotency-Key": key, "Authorization": f"Bearer {token}", "Origin": ORIGIN}
+
+
+@pytest.mark.anyio
+async def test_retry_with_same_key_is_replayed_with_cors_headers(store):
+    app = build_app(store)
+    async with client_for(app) as client:
+        first = await client.post("/orders/", json={"item": 1}, headers=headers("k1"))
+        second = await client.post("/orders/", json={"item": 1}, headers=headers("k1"))
+    assert first.status_code == second.status_code == 200
+    assert second.json() == first.json()
+    assert second.headers[REPLAYED_HEADER] == "true"
+    assert REPLAYED_HEADER not in first.headers
+    assert second.headers["access-control-allow-origin"] == "*"
+    assert app.state.calls == 1
+
+
+@pytest.mark.anyio
+async def test_key_is_scoped_per_authorization(store):
+    app = build_app(store)
+    async with client_for(app) as client:
+        await client.post("/orders/", json={"item": 1}, headers=headers("k1", "user-a"))
+        other = await client.post("/orders/", json={"item": 1}, headers=headers("k1", "user-b"))
+    assert REPLAYED_HEADER not in other.headers
+    assert app.state.calls == 2
+
+
+@pytest.mark.anyio
+async def test_same_key_with_different_body_is_rejected(store):
+    app = build_app(store)
+    async with client_for(app) as client:
+        await client.post("/orders/", json={"item": 1}, headers=headers("k1"))
+        mismatch = await client.post("/orders/", json={"item": 2}, headers=headers("k1"))
+    assert mismatch.status_code == 422
+    assert app.state.calls == 1
+
+
+@pytest.mark.anyio
+async def test_concurrent_duplicates_wait_for_the_first_request(store):
+    app = build_app(store, delay=0.2)
+    async with client_for(app) as client:
+        responses = await asyncio.gather(
+            *[client.post("/orders/", json={"item": 1}, headers=headers("k1")) for _ in range(3)]
+        )
+    assert app.state.calls == 1
+    assert len({r.text for r in responses}) == 1
+    assert sum(REPLAYED_HEADER in r.headers for r in responses) == 2
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("status_code", [400, 401, 403, 409, 500, 503])
+async def test_state_dependent_errors_are_not_stored(store, status_code):
+    app = build_app(store, responses=[status_code])
+    async with client_for(app) as client:
+        first = await client.post("/payments/snap-token", headers=headers("k1"))
+        retry = await client.post("/payments/snap-token", headers=headers("k1"))
+    assert first.status_code == status_code
+    assert retry.status_code == 200
+    assert REPLAYED_HEADER not in retry.headers
+    assert app.state.calls == 2
+
+
+@pytest.mark.anyio
+async def test_deterministic_client_error_is_stored(store):
+    app = build_app(store, responses=[422])
+    async with client_for(app) as client:
+        first = await client.post("/payments/snap-token", headers=headers("k1"))
+        retry = await client.post("/payments/snap-token", headers=headers("k1"))
+    assert first.status_code == retry.status_code == 422
+    assert retry.headers[REPLAYED_HEADER] == "true"
+    assert app.state.calls == 1
+
+
+@pytest.mark.anyio
+async def test_routes_outside_the_list_are_untouched(store):
+    app = build_app(store)
+    async with client_for(app) as client:
+        await client.post("/orders/1/cancel", headers=headers("k1"))
+        again = await client.post("/orders/1/cancel", headers=headers("k1"))
+    assert REPLAYED_HEADER not in again.headers
+    assert app.state.calls == 2
+
+
+@pytest.mark.anyio
+async def test_lock_is_refreshed_while_request_runs(store, monkeypatch):
+    monkeypatch.setattr(idempotency, "IDEMPOTENCY_LOCK_SECONDS", 0.3)
+    app = build_app(store, delay=0.6)
+    async with client_for(app) as client:
+        request = asyncio.create_task(client.post("/orders/", json={"item": 1}, headers=headers("k1")))
+        await asyncio.sleep(0.45)
+        row = store.conn.execute("select status, locked_until from idempotency_keys").fetchone()
+        # Tanpa heartbeat lock sudah habis di sini dan duplikat bisa mengambil alih
+        assert row["status"] == "in_progress"
+        assert row["locked_until"] > time.time()
+        await request
+    assert app.state.calls == 1
+
+
+@pytest.mark.anyio
+async def test_store_runs_off_the_event_loop(store, monkeypatch):
+    threads = []
+    for name in ("begin", "complete"):
+        original = getattr(store, name)
+
+        def recording(*args, _original=original):
+            threads.append(threading.current_thread().name)
+            return _original(*args)
+
+        monkeypatch.setattr(store, name, recording)
+    app = build_app(store)
+    async with client_for(app) as client:
+        await client.post("/orders/", json={"item": 1}, headers=headers("k1"))
+    assert len(threads) == 2
+    assert all(name.startswith("idempotency") for name in threads)
+
+
+def test_cors_is_the_outermost_middleware():
+    from app.main import app
+
+    assert app.user_middleware[0].cls is CORSMiddleware
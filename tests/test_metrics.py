@@ -0,0 +1,40 @@
+import httpx
+import pytest
+
+from app.main import app
+from app.models import UserOut
+from app.routes.dependencies import get_current_user
+
+
+def as_user(role):
+    return lambda: UserOut(id=1, nama_pengguna="tester", role=role, nomor_telepon="0812")
+
+
+@pytest.fixture
+def client():
+    yield httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+    app.dependency_overrides.clear()
+
+
+@pytest.mark.anyio
+async def test_metrics_requires_authentication(client):
+    async with client:
+        response = await client.get("/metrics")
+    assert response.status_code == 401
+
+
+@pytest.mark.anyio
+async def test_metrics_is_forbidden_for_customers(client):
+    app.dependency_overrides[get_current_user] = as_user("customer")
+    async with client:
+        response = await client.get("/metrics")
+    assert response.status_code == 403
+
+
+@pytest.mark.anyio
+async def test_metrics_for_staff(client):
+    app.dependency_overrides[get_current_user] = as_user("staff")
+    async with client:
+        response = await client.get("/metrics")
+    assert response.status_code == 200
+    assert {"outbox", "websockets", "payment_gateway"} <= set(response.json())
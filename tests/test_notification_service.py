@@ -0,0 +1,97 @@
+from types import SimpleNamespace
+
+import pytest
+
+from app.services import notification_service
+
+
+class FakeTokens:
+    """Tabel fcm_tokens untuk client supabase sync: select/delete + in_ + execute."""
+
+    def __init__(self, tokens, fail_delete=False):
+        self.tokens = tokens
+        self.fail_delete = fail_delete
+        self.selects = 0
+        self.deleted = []
+
+    def table(self, name):
+        assert name == "fcm_tokens"
+        return FakeQuery(self)
+
+
+class FakeQuery:
+    def __init__(self, db):
+        self.db = db
+        self.action = "select"
+        self.values = None
+
+    def select(self, *_):
+        return self
+
+    def delete(self):
+        self.action = "delete"
+        return self
+
+    def in_(self, _column, values):
+        self.values = values
+        return self
+
+    def execute(self):
+        if self.action == "delete":
+            if self.db.fail_delete:
+                raise RuntimeError("supabase down")
+            self.db.deleted.extend(self.values)
+            return SimpleNamespace(data=[])
+        self.db.selects += 1
+        return SimpleNamespace(data=[{"token": token} for token in self.db.tokens])
+
+
+@pytest.fixture
+def fcm(monkeypatch):
+    """_send_batch palsu: batch ke-`fail_on` gagal sekali; token 'bad-*' dianggap tidak valid."""
+    state = SimpleNamespace(sent=[], fail_on=None)
+
+    def fake_send_batch(tokens, title, body, data=None):
+        if state.fail_on == len(state.sent) + 1:
+            state.fail_on = None
+            raise RuntimeError("FCM 503")
+        state.sent.append(list(tokens))
+        return [token for token in tokens if token.startswith("bad")]
+
+    monkeypatch.setattr(notification_service, "_send_batch", fake_send_batch)
+    monkeypatch.setattr(notification_service, "FCM_BATCH_SIZE", 2)
+    return state
+
+
+def test_retry_only_sends_batches_that_did_not_go_out(monkeypatch, fcm):
+    db = FakeTokens(["t1", "t2", "t3", "t4", "t5"])
+    monkeypatch.setattr(notification_service, "supabase", db)
+    job = {"user_ids": [1, 2], "title": "Halo", "body": "Tes"}
+    fcm.fail_on = 2
+
+    with pytest.raises(RuntimeError):
+        notification_service._send_notification_to_users(job["user_ids"], "Halo", "Tes", None, job)
+    assert fcm.sent == [["t1", "t2"]]
+    assert job["pending_tokens"] == ["t3", "t4", "t5"]
+
+    # Percobaan ulang dari outbox memakai payload yang sama
+    notification_service._send_notification_to_users(job["user_ids"], "Halo", "Tes", None, job)
+    assert fcm.sent == [["t1", "t2"], ["t3", "t4"], ["t5"]]
+    assert job["pending_tokens"] == []
+    assert db.selects == 1
+
+
+def test_invalid_token_cleanup_failure_is_not_fatal(monkeypatch, fcm):
+    db = FakeTokens(["bad-1", "t1"], fail_delete=True)
+    monkeypatch.setattr(notification_service, "supabase", db)
+    notification_service._send_notification_to_users([1], "Halo", "Tes")
+    assert fcm.sent == [["bad-1", "t1"]]
+
+
+def test_invalid_tokens_from_sent_batches_are_removed_even_if_a_later_batch_fails(monkeypatch, fcm):
+    db = FakeTokens(["bad-1", "t1", "t2"])
+    monkeypatch.setattr(notification_service, "supabase", db)
+    fcm.fail_on = 2
+    with pytest.raises(RuntimeError):
+        notification_service._send_notification_to_users([1], "Halo", "Tes", None, {})
+    assert db.deleted == ["bad-1"]
@@ -0,0 +1,148 @@
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+
+from app.models import Order
+from app.routes import orders as orders_routes
+from app.services import order_state
+from app.services.order_state import (
+    ORDER_STATUSES, TRANSITIONS, InvalidTransitionError,
+    can_transition, derive_fulfilment_status, sources_for, transition_order,
+)
+
+
+class FakeQuery:
+    """Query builder minimal untuk tabel orders: select/update + eq/in_ + execute."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.filters = []
+        self.update_data = None
+        self.single_row = False
+
+    def select(self, *_):
+        return self
+
+    def update(self, data):
+        self.update_data = data
+        return self
+
+    def eq(self, column, value):
+        self.filters.append(lambda row: row.get(column) == value)
+        return self
+
+    def in_(self, column, values):
+        self.filters.append(lambda row: row.get(column) in values)
+        return self
+
+    def single(self):
+        self.single_row = True
+        return self
+
+    async def execute(self):
+        matched = [row for row in self.rows if all(check(row) for check in self.filters)]
+        if self.update_data is not None:
+            for row in matched:
+                row.update(self.update_data)
+        data = [dict(row) for row in matched]
+        if self.single_row:
+            data = data[0] if data else None
+        return SimpleNamespace(data=data)
+
+
+class FakeSupabase:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def table(self, name):
+        assert name == "orders"
+        return FakeQuery(self.rows)
+
+
+@pytest.fixture
+def orders_table(monkeypatch):
+    rows = [{"id": 1, "user_id": 7, "status": "awaiting_payment", "total_harga": 10000}]
+    fake = FakeSupabase(rows)
+    monkeypatch.setattr(order_state, "async_supabase", fake)
+    monkeypatch.setattr(orders_routes, "async_supabase", fake)
+    return rows
+
+
+def test_transition_table_is_closed():
+    for source, targets in TRANSITIONS.items():
+        assert targets <= ORDER_STATUSES, source
+    assert TRANSITIONS["completed"] == frozenset()
+    assert TRANSITIONS["cancelled"] == frozenset()
+
+
+def test_can_transition():
+    assert can_transition("awaiting_payment", "paid")
+    assert can_transition("paid", "cooking")
+    assert not can_transition("completed", "paid")
+    assert not can_transition("cancelled", "awaiting_payment")
+    assert not can_transition("unknown", "paid")
+
+
+def test_sources_for():
+    assert sources_for("paid") == ["awaiting_payment", "pending"]
+    assert sources_for("completed") == ["cooking", "paid", "ready_for_pickup"]
+    with pytest.raises(InvalidTransitionError):
+        sources_for("refunded")
+
+
+@pytest.mark.parametrize("counts, expected", [
+    ({}, None),
+    ({"completed": 3}, "completed"),
+    ({"completed": 1, "ready_for_pickup": 2}, "ready_for_pickup"),
+    ({"cooking": 1, "ready_for_pickup": 1, "completed": 1}, "cooking"),
+    ({"paid": 1, "completed": 2}, None),
+])
+def test_derive_fulfilment_status(counts, expected):
+    assert derive_fulfilment_status(counts) == expected
+
+
+@pytest.mark.anyio
+async def test_transition_order_compare_and_set(orders_table):
+    order = await transition_order(1, "paid", extra={"payment_method": "qris"})
+    assert order["status"] == "paid"
+    assert orders_table[0]["payment_method"] == "qris"
+    # Transisi yang sama kedua kalinya kalah CAS
+    assert await transition_order(1, "paid") is None
+
+
+@pytest.mark.anyio
+async def test_transition_order_rejects_illegal_expected(orders_table):
+    with pytest.raises(InvalidTransitionError):
+        await transition_order(1, "paid", expected=["completed"])
+    assert orders_table[0]["status"] == "awaiting_payment"
+
+
+def _update(status=None, total_harga=0):
+    return Order(id=None, user_id=7, status=status or "", total_harga=total_harga)
+
+
+@pytest.mark.anyio
+async def test_update_order_cancels_through_state_machine(orders_table):
+    user = SimpleNamespace(id=7, role="customer")
+    updated = await orders_routes.update_order(1, _update("cancelled"), current_user=user)
+    assert updated["status"] == "cancelled"
+
+
+@pytest.mark.anyio
+async def test_update_order_illegal_edge_is_conflict(orders_table):
+    user = SimpleNamespace(id=7, role="customer")
+    orders_table[0]["status"] = "completed"
+    with pytest.raises(HTTPException) as exc:
+        await orders_routes.update_order(1, _update("cancelled"), current_user=user)
+    assert exc.value.status_code == 409
+    assert orders_table[0]["status"] == "completed"
+
+
+@pytest.mark.anyio
+async def test_update_order_customer_cannot_mark_paid(orders_table):
+    user = SimpleNamespace(id=7, role="customer")
+    with pytest.raises(HTTPException) as exc:
+        await orders_routes.update_order(1, _update("paid"), current_user=user)
+    assert exc.value.status_code == 403
+    assert orders_table[0]["status"] == "awaiting_payment"
@@ -0,0 +1,49 @@
+from types import SimpleNamespace
+
+import pytest
+from fastapi import Response
+
+from app.routes import orders as orders_routes
+
+
+class RecordingQuery:
+    """Mencatat rantai query PostgREST dan mengembalikan `rows` saat execute."""
+
+    def __init__(self, table, rows, log):
+        self.calls = [("table", table)]
+        self.rows = rows
+        log.append(self.calls)
+
+    def __getattr__(self, name):
+        def method(*args, **kwargs):
+            self.calls.append((name, *args, *kwargs.items()))
+            return self
+        return method
+
+    async def execute(self):
+        return SimpleNamespace(data=self.rows)
+
+
+@pytest.mark.anyio
+async def test_my_order_items_filters_by_owner_with_inner_join(monkeypatch):
+    rows = [{"id": n, "order_id": 1, "orders": {"user_id": 7}} for n in (30, 20, 10)]
+    log = []
+    monkeypatch.setattr(
+        orders_routes, "async_supabase", SimpleNamespace(table=lambda name: RecordingQuery(name, rows, log))
+    )
+    response = Response()
+    items = await orders_routes.get_my_order_items(
+        response, page={"limit": 2, "after": 50}, current_user=SimpleNamespace(id=7, role="customer")
+    )
+
+    # Satu query saja, tanpa membaca daftar id order lebih dulu
+    assert log == [[
+        ("table", "order_items"),
+        ("select", "*, orders!inner(user_id)"),
+        ("eq", "orders.user_id", 7),
+        ("lt", "id", 50),
+        ("order", "id", ("desc", True)),
+        ("limit", 3),
+    ]]
+    assert [item["id"] for item in items] == [30, 20]
+    assert response.headers["X-Next-Cursor"] == "20"
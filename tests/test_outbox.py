@@ -0,0 +1,187 @@
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from app.services import outbox as outbox_module
+from app.services.outbox import OUTBOX_BASE_BACKOFF, OUTBOX_LEASE_SECONDS, Outbox
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(outbox_module, "time", SimpleNamespace(time=clock.time))
+    return clock
+
+
+@pytest.fixture
+def box(tmp_path):
+    box = Outbox(db_path=str(tmp_path / "outbox.sqlite3"), concurrency=2, max_attempts=3)
+    yield box
+    box.conn.close()
+
+
+def _row(box, message_id):
+    return box.conn.execute("select * from outbox where id = ?", (message_id,)).fetchone()
+
+
+def _failing(calls):
+    async def handler(payload):
+        calls.append(payload)
+        raise RuntimeError("push gagal")
+    return handler
+
+
+@pytest.mark.anyio
+async def test_message_is_delivered_once(box, clock):
+    delivered = []
+
+    async def handler(payload):
+        delivered.append(payload)
+
+    box.register_handler("push", handler)
+    message_id = await box.enqueue("push", {"user_id": 1})
+    rows = box._claim(10)
+    assert [row["id"] for row in rows] == [message_id]
+    await box._process(rows[0])
+    assert delivered == [{"user_id": 1}]
+    assert _row(box, message_id)["status"] == "done"
+    assert box._claim(10) == []
+
+
+@pytest.mark.anyio
+async def test_claimed_message_is_leased_until_lease_expires(box, clock):
+    message_id = await box.enqueue("push", {})
+    assert len(box._claim(10)) == 1
+    assert box._claim(10) == []
+
+    # Worker pemegang lease dianggap mati; pesan bisa diambil lagi
+    clock.advance(OUTBOX_LEASE_SECONDS + 1)
+    rows = box._claim(10)
+    assert [row["id"] for row in rows] == [message_id]
+    assert rows[0]["attempts"] == 2
+
+
+@pytest.mark.anyio
+async def test_claim_respects_limit_and_order(box, clock):
+    ids = [await box.enqueue("push", {"n": n}) for n in range(3)]
+    assert [row["id"] for row in box._claim(2)] == ids[:2]
+    assert [row["id"] for row in box._claim(2)] == ids[2:]
+
+
+@pytest.mark.anyio
+async def test_failed_message_is_retried_with_exponential_backoff(box, clock):
+    calls = []
+    box.register_handler("push", _failing(calls))
+    message_id = await box.enqueue("push", {})
+    start = clock.now
+
+    await box._process(box._claim(10)[0])
+    row = _row(box, message_id)
+    assert row["status"] == "pending"
+    assert row["last_error"] == "push gagal"
+    first_delay = row["next_attempt_at"] - start
+    assert OUTBOX_BASE_BACKOFF * 0.8 <= first_delay <= OUTBOX_BASE_BACKOFF * 1.2
+    assert box._claim(10) == []
+
+    clock.advance(first_delay)
+    await box._process(box._claim(10)[0])
+    second_delay = _row(box, message_id)["next_attempt_at"] - clock.now
+    assert OUTBOX_BASE_BACKOFF * 2 * 0.8 <= second_delay <= OUTBOX_BASE_BACKOFF * 2 * 1.2
+    assert len(calls) == 2
+
+
+@pytest.mark.anyio
+async def test_message_is_dead_lettered_after_max_attempts(box, clock):
+    calls = []
+    box.register_handler("push", _failing(calls))
+    message_id = await box.enqueue("push", {})
+
+    for _ in range(box.max_attempts):
+        rows = box._claim(10)
+        assert len(rows) == 1
+        await box._process(rows[0])
+        clock.advance(outbox_module.OUTBOX_MAX_BACKOFF * 2)
+
+    row = _row(box, message_id)
+    assert row["status"] == "dead"
+    assert row["attempts"] == box.max_attempts
+    assert box._claim(10) == []
+    assert (await box.stats())["dead"] == 1
+
+
+@pytest.mark.anyio
+async def test_unknown_kind_counts_as_failure(box, clock):
+    message_id = await box.enqueue("tidak_ada", {})
+    await box._process(box._claim(10)[0])
+    row = _row(box, message_id)
+    assert row["status"] == "pending"
+    assert "tidak_ada" in row["last_error"]
+
+
+@pytest.mark.anyio
+async def test_worker_delivers_enqueued_messages(box):
+    delivered = asyncio.Queue()
+
+    async def handler(payload):
+        await delivered.put(payload)
+
+    box.register_handler("ws", handler)
+    await box.start()
+    try:
+        await box.enqueue("ws", {"n": 1})
+        await box.enqueue("ws", {"n": 2})
+        received = [await asyncio.wait_for(delivered.get(), 2) for _ in range(2)]
+    finally:
+        await box.stop()
+    assert sorted(payload["n"] for payload in received) == [1, 2]
+    # Pesan ditandai done setelah handler selesai
+    for _ in range(20):
+        if (await box.stats())["done"] == 2:
+            break
+        await asyncio.sleep(0.01)
+    assert (await box.stats())["done"] == 2
+
+
+@pytest.mark.anyio
+async def test_sqlite_runs_off_the_event_loop(box, monkeypatch):
+    threads = []
+    original = box._insert
+
+    def recording(*args):
+        threads.append(threading.current_thread().name)
+        return original(*args)
+
+    monkeypatch.setattr(box, "_insert", recording)
+    await box.enqueue("push", {})
+    assert threads and threads[0].startswith("outbox-db")
+
+
+@pytest.mark.anyio
+async def test_progress_recorded_in_payload_survives_a_retry(box, clock):
+    seen = []
+
+    async def handler(payload):
+        seen.append(dict(payload))
+        if "done_part" not in payload:
+            payload["done_part"] = 1
+            raise RuntimeError("gagal di tengah")
+
+    box.register_handler("push", handler)
+    await box.enqueue("push", {"n": 1})
+    await box._process(box._claim(10)[0])
+    clock.advance(outbox_module.OUTBOX_MAX_BACKOFF * 2)
+    await box._process(box._claim(10)[0])
+    assert seen == [{"n": 1}, {"n": 1, "done_part": 1}]
@@ -0,0 +1,246 @@
+import asyncio
+import json
+import socket
+import threading
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+import pytest
+
+from app.services import payment_gateway
+from app.services.payment_gateway import PaymentGatewayError, SnapClient, _parse_timestamptz, _snap_link_valid
+
+
+def test_parse_timestamptz_accepts_any_fraction_length():
+    parsed = _parse_timestamptz("2026-10-17T10:00:00.12345+00:00")
+    assert parsed == datetime(2026, 10, 17, 10, 0, 0, 123450, tzinfo=timezone.utc)
+    assert _parse_timestamptz("2026-10-17T10:00:00.1+07:00").utcoffset() == timedelta(hours=7)
+    assert _parse_timestamptz("2026-10-17T10:00:00Z").tzinfo is not None
+
+
+def test_parse_timestamptz_returns_none_for_garbage():
+    assert _parse_timestamptz("bukan tanggal") is None
+
+
+def test_snap_link_valid_uses_expiry():
+    future = (datetime.now(timezone.utc) + timedelta(hours=1)).isoformat(timespec="milliseconds")
+    past = (datetime.now(timezone.utc) - timedelta(hours=1)).isoformat()
+    assert _snap_link_valid({"snap_redirect_url": "https://pay", "snap_expires_at": future})
+    assert not _snap_link_valid({"snap_redirect_url": "https://pay", "snap_expires_at": past})
+    assert not _snap_link_valid({"snap_redirect_url": None, "snap_expires_at": future})
+
+
+def test_snap_link_with_unparseable_expiry_is_treated_as_expired():
+    assert not _snap_link_valid({"snap_redirect_url": "https://pay", "snap_expires_at": "2026-13-45T99"})
+
+
+# --- SnapClient terhadap server Snap palsu lokal ---------------------------
+
+ITEMS = [{"id": "1", "price": 10000, "quantity": 1, "name": "Nasi Goreng"}]
+CUSTOMER = {"nama_pengguna": "Budi", "nomor_telepon": "0812"}
+
+
+class FakeSnap:
+    """Server Snap lokal; menjawab dari antrean `responses`, lalu 201 dengan token."""
+
+    def __init__(self, activate=True):
+        self.responses = []
+        self.requests = []
+        self.delay = 0.0
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                fake.requests.append({"body": body, "authorization": self.headers.get("Authorization")})
+                if fake.delay:
+                    threading.Event().wait(fake.delay)
+                if fake.responses:
+                    status, payload = fake.responses.pop(0)
+                else:
+                    n = len(fake.requests)
+                    status, payload = 201, {"token": f"tok-{n}", "redirect_url": f"https://snap/{n}"}
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler, bind_and_activate=False)
+        self.server.daemon_threads = True
+        self.server.server_bind()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/snap/v1/transactions"
+        self.thread = None
+        if activate:
+            self.activate()
+
+    def activate(self):
+        self.server.server_activate()
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True)
+        self.thread.start()
+
+    def shutdown(self):
+        if self.thread is not None:
+            self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Backoff retry dicatat tanpa benar-benar menunggu."""
+    recorded = []
+
+    async def fake_sleep(delay):
+        recorded.append(delay)
+        await asyncio.sleep(0)
+
+    monkeypatch.setattr(payment_gateway, "asyncio", SimpleNamespace(sleep=fake_sleep, gather=asyncio.gather))
+    return recorded
+
+
+@pytest.fixture
+def snap():
+    fake = FakeSnap()
+    yield fake
+    fake.shutdown()
+
+
+@pytest.mark.anyio
+async def test_create_transaction_posts_with_basic_auth(snap, sleeps):
+    client = SnapClient(snap.url, "server-key")
+    try:
+        result = await client.create_transaction(42, ITEMS, 10000, CUSTOMER)
+    finally:
+        await client.close()
+    assert result == {"token": "tok-1", "redirect_url": "https://snap/1"}
+    request = snap.requests[0]
+    assert request["authorization"] == "Basic c2VydmVyLWtleTo="
+    assert request["body"]["transaction_details"]["gross_amount"] == 10000
+    assert request["body"]["transaction_details"]["order_id"].startswith("42-")
+    assert sleeps == []
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("status", [503, 429])
+async def test_retries_on_transient_status(snap, sleeps, status):
+    snap.responses = [(status, {"error_messages": ["busy"]})]
+    client = SnapClient(snap.url, "server-key")
+    try:
+        result = await client.create_transaction(1, ITEMS, 10000, CUSTOMER)
+    finally:
+        await client.close()
+    assert result["token"] == "tok-2"
+    assert len(snap.requests) == 2
+    assert sleeps == [0.2]
+    assert client.metrics["retries"] == 1
+
+
+@pytest.mark.anyio
+async def test_retries_connect_error_until_server_is_up(sleeps):
+    fake = FakeSnap(activate=False)
+    sleeps_before_activate = []
+
+    async def sleep_then_activate(delay):
+        sleeps_before_activate.append(delay)
+        if fake.thread is None:
+            fake.activate()
+
+    payment_gateway.asyncio.sleep = sleep_then_activate
+    client = SnapClient(fake.url, "server-key")
+    try:
+        result = await client.create_transaction(1, ITEMS, 10000, CUSTOMER)
+    finally:
+        await client.close()
+        fake.shutdown()
+    assert result["token"] == "tok-1"
+    assert sleeps_before_activate == [0.2]
+    assert client.metrics["retries"] == 1
+
+
+@pytest.mark.anyio
+async def test_second_call_for_same_order_is_cached(snap, sleeps):
+    client = SnapClient(snap.url, "server-key")
+    try:
+        first = await client.create_transaction(7, ITEMS, 10000, CUSTOMER)
+        second = await client.create_transaction(7, ITEMS, 10000, CUSTOMER)
+        changed = await client.create_transaction(7, ITEMS, 12000, CUSTOMER)
+    finally:
+        await client.close()
+    assert first == second
+    assert changed != first
+    assert len(snap.requests) == 2
+
+
+@pytest.mark.anyio
+async def test_concurrent_calls_are_coalesced(snap, sleeps):
+    snap.delay = 0.1
+    client = SnapClient(snap.url, "server-key")
+    try:
+        results = await asyncio.gather(*[client.create_transaction(9, ITEMS, 10000, CUSTOMER) for _ in range(5)])
+    finally:
+        await client.close()
+    assert len(snap.requests) == 1
+    assert all(result == results[0] for result in results)
+
+
+@pytest.mark.anyio
+async def test_gives_up_after_max_retries(snap, sleeps):
+    snap.responses = [(503, {"error_messages": ["down"]})] * (payment_gateway.MIDTRANS_MAX_RETRIES + 1)
+    client = SnapClient(snap.url, "server-key")
+    try:
+        with pytest.raises(PaymentGatewayError, match="Midtrans 503"):
+            await client.create_transaction(1, ITEMS, 10000, CUSTOMER)
+        # Kegagalan tidak disimpan di cache; panggilan berikutnya mencoba lagi
+        result = await client.create_transaction(1, ITEMS, 10000, CUSTOMER)
+    finally:
+        await client.close()
+    assert result["token"] == f"tok-{payment_gateway.MIDTRANS_MAX_RETRIES + 2}"
+    assert sleeps == [0.2 * 2 ** attempt for attempt in range(payment_gateway.MIDTRANS_MAX_RETRIES)]
+    assert client.metrics["errors"] == 1
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("status", [502, 504])
+async def test_gateway_errors_are_not_replayed(snap, sleeps, status):
+    # Midtrans mungkin sudah membuat transaksinya; POST ulang bisa menggandakan transaksi
+    snap.responses = [(status, {"error_messages": ["gateway"]})]
+    client = SnapClient(snap.url, "server-key")
+    try:
+        with pytest.raises(PaymentGatewayError, match=f"Midtrans {status}"):
+            await client.create_transaction(1, ITEMS, 10000, CUSTOMER)
+    finally:
+        await client.close()
+    assert len(snap.requests) == 1
+    assert sleeps == []
+
+
+@pytest.mark.anyio
+async def test_non_retryable_error_is_raised_immediately(snap, sleeps):
+    snap.responses = [(401, {"error_messages": ["Access denied"]})]
+    client = SnapClient(snap.url, "server-key")
+    try:
+        with pytest.raises(PaymentGatewayError, match="Access denied"):
+            await client.create_transaction(1, ITEMS, 10000, CUSTOMER)
+    finally:
+        await client.close()
+    assert len(snap.requests) == 1
+    assert sleeps == []
+
+
+@pytest.mark.anyio
+async def test_connect_error_exhausts_retries(sleeps):
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    client = SnapClient(f"http://127.0.0.1:{port}/snap/v1/transactions", "server-key")
+    try:
+        with pytest.raises(PaymentGatewayError, match="Tidak dapat terhubung"):
+            await client.create_transaction(1, ITEMS, 10000, CUSTOMER)
+    finally:
+        await client.close()
+    assert len(sleeps) == payment_gateway.MIDTRANS_MAX_RETRIES
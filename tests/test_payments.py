@@ -0,0 +1,63 @@
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from app.routes import payments
+
+VALID = {
+    "order_id": "12-ab12cd",
+    "status_code": "200",
+    "gross_amount": "10500.00",
+    "signature_key": "x" * 128,
+    "transaction_status": "settlement",
+}
+
+
+@pytest.fixture
+def signature_checks(monkeypatch):
+    checked = []
+
+    def fake_verify(body):
+        checked.append(body)
+        return False
+
+    monkeypatch.setattr(payments, "verify_notification_signature", fake_verify)
+    return checked
+
+
+async def post_callback(**kwargs):
+    app = FastAPI()
+    app.include_router(payments.router)
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        return await client.post("/payments/callback", **kwargs)
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("payload", [
+    {**VALID, "gross_amount": None},
+    {**VALID, "gross_amount": 10500},
+    {**VALID, "gross_amount": "sepuluh ribu"},
+    {**VALID, "order_id": "abc-123"},
+    {key: value for key, value in VALID.items() if key != "signature_key"},
+    {key: value for key, value in VALID.items() if key != "status_code"},
+    {**VALID, "transaction_status": ""},
+    ["bukan", "objek"],
+])
+async def test_malformed_callback_is_rejected_before_signature_check(signature_checks, payload):
+    response = await post_callback(json=payload)
+    assert response.status_code == 400
+    assert signature_checks == []
+
+
+@pytest.mark.anyio
+async def test_callback_with_invalid_json_is_rejected(signature_checks):
+    response = await post_callback(content=b"{bukan json", headers={"Content-Type": "application/json"})
+    assert response.status_code == 400
+    assert signature_checks == []
+
+
+@pytest.mark.anyio
+async def test_well_formed_callback_reaches_signature_check(signature_checks):
+    response = await post_callback(json=VALID)
+    assert response.status_code == 403
+    assert signature_checks == [VALID]
@@ -0,0 +1,64 @@
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from app import crud
+from app.routes import products
+
+ROWS = [{"id": 1, "nama_produk": "Nasi Goreng", "harga": 15000}, {"id": 2, "nama_produk": "Es Teh", "harga": 5000}]
+
+
+class RecordingQuery:
+    def __init__(self, name, log):
+        self.calls = [("table", name)]
+        log.append(self.calls)
+
+    def __getattr__(self, name):
+        def method(*args, **kwargs):
+            self.calls.append((name, *args, *kwargs.values()))
+            return self
+        return method
+
+    async def execute(self):
+        return SimpleNamespace(data=ROWS)
+
+
+@pytest.fixture
+def client(monkeypatch):
+    log = []
+    monkeypatch.setattr(crud, "async_supabase", SimpleNamespace(table=lambda name: RecordingQuery(name, log)))
+
+    async def cached_page(*_args, **_kwargs):
+        return [{"id": 9, "nama_produk": "dari cache", "harga": 1}], None
+
+    monkeypatch.setattr(products, "get_products_page", cached_page)
+    app = FastAPI()
+    app.include_router(products.router)
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+    client.log = log
+    return client
+
+
+@pytest.mark.anyio
+async def test_fields_are_pushed_down_to_postgrest_select(client):
+    async with client:
+        response = await client.get("/products/", params={"fields": "nama_produk,harga", "limit": 5})
+    assert response.status_code == 200
+    assert response.json() == ROWS
+    assert client.log == [[
+        ("table", "products"),
+        ("select", "id,nama_produk,harga"),
+        ("eq", "is_active", True),
+        ("order", "id", False),
+        ("limit", 6),
+    ]]
+
+
+@pytest.mark.anyio
+async def test_without_fields_the_catalogue_cache_is_used(client):
+    async with client:
+        response = await client.get("/products/")
+    assert response.json() == [{"id": 9, "nama_produk": "dari cache", "harga": 1}]
+    assert client.log == []